@@ -1,16 +1,73 @@
+from contextlib import asynccontextmanager
+from datetime import date, datetime
 from pathlib import Path
+import hashlib
+import hmac
+import json
+import os
 import sys
-from fastapi import FastAPI
+from time import perf_counter
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Header, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
 
 # Make src importable
 sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
 
-from data_loader import load_transactions_csv
-from orchestrator import evaluate_listing
+from orchestrator import evaluate_listing, evaluate_listings_batch
+from utils_text import norm
+from heatmap import market_heatmap
+from autocomplete import PlaceIndex, place_counts
+from dataset import DatasetStore
+from snapshot import snapshot_dir_for
+from sql_store import sql_path_for
+from cache import LRUCache
+import metrics
+from config import (
+    DATASET_RELOAD_INTERVAL_S, EVAL_CACHE_MAX_ENTRIES, EVAL_CACHE_TTL_S, HEATMAP_CACHE_ENTRIES, AUTOCOMPLETE_LIMIT,
+)
+
+# Load data once on startup (CSV for now)
+DATA_PATH = Path(__file__).resolve().parents[1] / "data" / "transactions.csv"
+
+# DATASET_MODE=shared: attach read-only to the snapshot published by
+# scripts/publish_dataset.py, so N workers share one copy of the data in RAM.
+# DATASET_MODE=sqlite: query the database built by scripts/build_sqlite.py
+# instead of holding the history in RAM (no heatmap, no nearby comps from lat / lon).
+DATASET_MODE = os.getenv("DATASET_MODE", "local")
+if DATASET_MODE == "shared":
+    STORE = DatasetStore(os.getenv("DATASET_SNAPSHOT") or snapshot_dir_for(DATA_PATH), mode="shared")
+elif DATASET_MODE == "sqlite":
+    STORE = DatasetStore(os.getenv("DATASET_SQLITE") or sql_path_for(DATA_PATH), mode="sqlite")
+else:
+    STORE = DatasetStore(DATA_PATH)
+
+# Asking-price independent part of /evaluate results (see orchestrator.evaluate_listing)
+EVAL_CACHE = LRUCache(int(os.getenv("EVAL_CACHE_MAX_ENTRIES", EVAL_CACHE_MAX_ENTRIES)),
+                      ttl_s=float(os.getenv("EVAL_CACHE_TTL_S", EVAL_CACHE_TTL_S)))
 
-app = FastAPI(title="Real Estate Valuation API", version="0.1.0")
+# Whole-dataset heatmap tables, keyed by (dataset version, day)
+HEATMAP_CACHE = LRUCache(HEATMAP_CACHE_ENTRIES)
+
+# City / neighborhood autocomplete indexes, keyed by dataset version
+PLACES_CACHE = LRUCache(2)
+
+# Shared secret for /admin/* (sent as X-Admin-Token); unset → admin endpoints are disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# /admin/ingest only reads delta files from this directory
+INGEST_DIR = Path(os.getenv("INGEST_DIR") or DATA_PATH.parent / "deltas").resolve()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Background watcher: rebuilds off the request path and swaps the dataset in
+    STORE.start_watcher(float(os.getenv("DATASET_RELOAD_INTERVAL_S", DATASET_RELOAD_INTERVAL_S)))
+    yield
+    STORE.stop_watcher()
+
+app = FastAPI(title="Real Estate Valuation API", version="0.1.0", lifespan=lifespan)
 
 # CORS: allow local frontends (edit origins as needed)
 app.add_middleware(
@@ -26,11 +83,20 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Server-Timing"],
 )
 
-# Load data once on startup (CSV for now)
-DATA_PATH = Path(__file__).resolve().parents[1] / "data" / "transactions.csv"
-DF = load_transactions_csv(str(DATA_PATH))
+@app.middleware("http")
+async def timing_middleware(request, call_next):
+    """Request latency histogram + Server-Timing header with the per-stage breakdown."""
+    timings = metrics.start_request_timings()
+    t0 = perf_counter()
+    response = await call_next(request)
+    total = perf_counter() - t0
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.REQUEST_SECONDS.observe(total, request.method, route, str(response.status_code))
+    response.headers["Server-Timing"] = metrics.server_timing(timings, total)
+    return response
 
 class EvaluateInput(BaseModel):
     city: str
@@ -38,22 +104,259 @@ class EvaluateInput(BaseModel):
     rooms: float
     size_sqm: float
     asking_price_ils: int
+    # optional listing location: sparse neighborhoods then use the nearest deals as comps
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lon: Optional[float] = Field(default=None, ge=-180, le=180)
+    # optional evaluation date (not in the future): only deals dated before it are used
+    as_of: Optional[date] = None
+
+class BatchEvaluateInput(BaseModel):
+    listings: List[EvaluateInput]
+    detail: bool = False  # True → full /evaluate payload per listing
+
+class IngestInput(BaseModel):
+    path: str  # delta CSV inside INGEST_DIR, relative to it (same columns as transactions.csv)
+
+# Upper bound on listings per /evaluate/batch call
+BATCH_MAX_LISTINGS = 20_000
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    return {"status": "ok", "dataset": STORE.status(), "eval_cache": EVAL_CACHE.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus text exposition: stage/request latency histograms, cache and dataset gauges."""
+    cache, ds = EVAL_CACHE.stats(), STORE.status()
+    extra = []
+    for name in ("hits", "misses", "evictions", "expirations"):
+        extra += metrics.gauge_lines(f"realestate_eval_cache_{name}_total", f"Eval cache {name}.", cache[name], kind="counter")
+    extra += metrics.gauge_lines("realestate_eval_cache_entries", "Eval cache entries.", cache["size"])
+    extra += metrics.gauge_lines("realestate_dataset_rows", "Rows in the served dataset.", ds["n_rows"],
+                                 labels={"version": ds["version"]})
+    extra += metrics.gauge_lines("realestate_dataset_reloads_total", "Dataset swaps since start.", ds["reloads"], kind="counter")
+    return PlainTextResponse(metrics.render(extra), media_type="text/plain; version=0.0.4")
+
+@app.post("/admin/reload")
+def admin_reload(force: bool = False, x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Rebuild the dataset now (if the source changed, or always with force=true)
+    and swap it in. Requests already running keep the previous version.
+    """
+    _check_admin(x_admin_token)
+    swapped = STORE.reload(force=force)
+    return {"reloaded": swapped, "dataset": STORE.status()}
+
+@app.post("/admin/ingest")
+def admin_ingest(payload: IngestInput, x_admin_token: Optional[str] = Header(default=None)):
+    """
+    Append a delta file of new deals (deduped on tx_id) without a full reload.
+    The file must be inside INGEST_DIR.
+    """
+    _check_admin(x_admin_token)
+    path = (INGEST_DIR / payload.path).resolve()
+    if not path.is_relative_to(INGEST_DIR) or not path.is_file():
+        raise HTTPException(status_code=400, detail="path must name a delta file inside INGEST_DIR.")
+    try:
+        counts = STORE.ingest(path)
+    except (OSError, ValueError, KeyError) as e:  # unreadable file, bad values, missing columns
+        print(f"[admin] ingest of {path} failed: {type(e).__name__}: {e}")
+        raise HTTPException(status_code=400, detail="Delta file could not be ingested; see the server log.")
+    return {**counts, "dataset": STORE.status()}
+
+def _require(available: bool, what: str):
+    if not available:
+        raise HTTPException(status_code=503, detail=f"{what} is not available with DATASET_MODE={DATASET_MODE}.")
+
+def _check_admin(token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set).")
+    if token is None or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+def _as_of_datetime(as_of: Optional[date]) -> Optional[datetime]:
+    if as_of is None:
+        return None
+    if as_of > datetime.utcnow().date():
+        raise HTTPException(status_code=422, detail="as_of must not be in the future.")
+    return datetime.combine(as_of, datetime.min.time())
+
+def _etag(payload: EvaluateInput, version) -> str:
+    # Same inputs + same dataset version + same day → same response body
+    raw = json.dumps([app.version, version, datetime.utcnow().date().isoformat(), payload.model_dump(mode="json")],
+                     sort_keys=True, ensure_ascii=False)
+    return '"' + hashlib.sha1(raw.encode("utf-8")).hexdigest() + '"'
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
 
 @app.post("/evaluate")
-def evaluate(payload: EvaluateInput):
+def evaluate(payload: EvaluateInput, response: Response,
+             if_none_match: Optional[str] = Header(default=None)):
     """
     Main endpoint: receive listing attributes, return all computed metrics.
+    Sends an ETag; a matching If-None-Match gets 304 without re-evaluating.
+    With as_of (YYYY-MM-DD, not in the future) the listing is valued as on that
+    date, from the deals dated before it.
     """
+    as_of = _as_of_datetime(payload.as_of)
+    ds = STORE.current  # one version for the whole request
+    etag = _etag(payload, ds.version)
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"  # clients revalidate with If-None-Match
     result = evaluate_listing(
-        transactions_df=DF,
+        transactions_df=ds.df,
         city=payload.city,
         neighborhood=payload.neighborhood,
         rooms=payload.rooms,
         size_sqm=payload.size_sqm,
         asking_price_ils=payload.asking_price_ils,
+        index=ds.index,
+        text=ds.text,
+        cache=EVAL_CACHE,
+        version=ds.version,
+        cube=ds.cube,
+        growth_table=ds.growth,
+        lat=payload.lat,
+        lon=payload.lon,
+        spatial=ds.spatial,
+        as_of=as_of,
     )
     return result
+
+@app.post("/evaluate/batch")
+def evaluate_batch(payload: BatchEvaluateInput):
+    """
+    Evaluate many listings in one call. Listings sharing a segment are resolved together;
+    those with an as_of are evaluated one by one, as in /evaluate.
+    Results are returned in input order.
+    """
+    if len(payload.listings) > BATCH_MAX_LISTINGS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_LISTINGS} listings per batch.")
+    listings = [
+        dict(city=l.city, neighborhood=l.neighborhood, rooms=l.rooms,
+             size_sqm=l.size_sqm, asking_price_ils=l.asking_price_ils, lat=l.lat, lon=l.lon,
+             as_of=_as_of_datetime(l.as_of))
+        for l in payload.listings
+    ]
+    ds = STORE.current
+    results = evaluate_listings_batch(ds.df, listings, index=ds.index, detail=payload.detail,
+                                      text=ds.text, cube=ds.cube, growth_table=ds.growth, spatial=ds.spatial)
+    return {"n": len(results), "results": results}
+
+@app.get("/area/stats")
+def area_stats(city: str, neighborhood: Optional[str] = None, rooms: Optional[float] = None,
+               years: int = 5, by: str = "year"):
+    """
+    Deal count and mean/std of price and price per sqm for a city, or one of
+    its neighborhoods, optionally for one rooms value, over the last `years`
+    calendar years (current one included). by=year|quarter|total.
+    Answered from the aggregate cube, without touching transaction rows.
+    """
+    if by not in ("year", "quarter", "total"):
+        raise HTTPException(status_code=422, detail="by must be one of year, quarter, total.")
+    ds = STORE.current
+    _require(ds.cube is not None, "/area/stats")
+    keys = ds.cube.keys(norm(city), norm(neighborhood) if neighborhood else None, rooms)
+    if not keys:
+        raise HTTPException(status_code=404, detail="No deals for this area.")
+    this_year = datetime.utcnow().year
+    period_from = (this_year - max(years, 1) + 1) * 4
+    summary = ds.cube.rollup(keys, period_from=period_from)
+    result = {"city": city, "neighborhood": neighborhood, "rooms": rooms, "years": years, **summary}
+    if by != "total":
+        result["per_" + by] = ds.cube.rollup(keys, period_from=period_from, by=by)
+    return result
+
+@app.get("/appreciation/ranking")
+def appreciation_ranking(city: Optional[str] = None, rooms: Optional[float] = None,
+                         level: str = "neighborhood", min_points: int = 10, order: str = "desc",
+                         limit: int = 50, offset: int = 0):
+    """
+    Segments ranked by precomputed annual appreciation (log-ppsqm trend over
+    the long-term window). level=neighborhood → (city, neighborhood, rooms);
+    level=city → (city, rooms).
+    """
+    if level not in ("neighborhood", "city") or order not in ("asc", "desc"):
+        raise HTTPException(status_code=422, detail="level must be neighborhood|city and order asc|desc.")
+    ds = STORE.current
+    _require(ds.growth is not None, "/appreciation/ranking")
+    ranked = ds.growth.ranking(norm(city) if city else None, rooms, level=level,
+                               min_points=min_points, ascending=order == "asc")
+    page = ranked.iloc[max(offset, 0):max(offset, 0) + min(max(limit, 1), 500)]
+    return {
+        "total": len(ranked),
+        "as_of": ds.growth.as_of.date().isoformat(),
+        "estimator": ds.growth.estimator,
+        "segments": [
+            {"city_norm": r.city_norm, "neigh_norm": r.neigh_norm, "rooms": float(r.rooms),
+             "annual_pct": float(r.annual_pct), "n_points": int(r.n_points), "span_years": float(r.span_years)}
+            for r in page.itertuples()
+        ],
+    }
+
+HEATMAP_SORT_COLUMNS = ("fair_ppsqm", "iqr", "recent_n", "sales_last5", "annual_pct")
+
+@app.get("/market/heatmap")
+def heatmap(city: Optional[str] = None, neighborhood: Optional[str] = None, rooms: Optional[float] = None,
+            min_recent: int = 0, sort: Optional[str] = None, order: str = "desc",
+            limit: int = 200, offset: int = 0):
+    """
+    Fair ppsqm (median / IQR of recent deals), recent and 5-year deal counts and
+    appreciation for every city / neighborhood / rooms segment. The full table
+    is computed in one grouped pass per dataset version and day, then filtered
+    and paged. Default order: city, neighborhood, rooms.
+    """
+    if (sort is not None and sort not in HEATMAP_SORT_COLUMNS) or order not in ("asc", "desc"):
+        raise HTTPException(status_code=422, detail=f"sort must be one of {', '.join(HEATMAP_SORT_COLUMNS)}; order asc|desc.")
+    ds = STORE.current
+    _require(ds.in_memory, "/market/heatmap")
+    today = datetime.utcnow()
+    key = (ds.version, today.date())
+    table = HEATMAP_CACHE.get(key)
+    if table is None:
+        with metrics.stage("heatmap"):
+            table = market_heatmap(ds.df, today=today, growth=ds.growth)
+        HEATMAP_CACHE.put(key, table)
+
+    t = table
+    if city:
+        t = t[t["city_norm"] == norm(city)]
+    if neighborhood:
+        t = t[t["neigh_norm"] == norm(neighborhood)]
+    if rooms is not None:
+        t = t[t["rooms"] == float(rooms)]
+    if min_recent > 0:
+        t = t[t["recent_n"] >= min_recent]
+    if sort is not None:
+        t = t.sort_values(sort, ascending=order == "asc", na_position="last", kind="stable")
+    page = t.iloc[max(offset, 0):max(offset, 0) + min(max(limit, 1), 1000)]
+    return {
+        "version": ds.version,
+        "as_of": today.date().isoformat(),
+        "total": len(t),
+        "segments": page.astype(object).where(page.notna(), None).to_dict(orient="records"),
+    }
+
+@app.get("/places/autocomplete")
+def places_autocomplete(q: str, kind: Optional[str] = None, city: Optional[str] = None,
+                        limit: int = AUTOCOMPLETE_LIMIT):
+    """
+    Cities and neighborhoods for a partly typed (or misspelled) name, Hebrew or
+    English, most active first. kind=city|neighborhood; city restricts the
+    results to one city. Use the returned city / neighborhood in /evaluate.
+    """
+    if kind not in (None, "city", "neighborhood"):
+        raise HTTPException(status_code=422, detail="kind must be city or neighborhood.")
+    ds = STORE.current
+    places = PLACES_CACHE.get(ds.version)
+    if places is None:
+        with metrics.stage("places"):
+            places = PlaceIndex(place_counts(ds.df))
+        PLACES_CACHE.put(ds.version, places)
+    return {"query": q, "results": places.suggest(q, kind=kind, city=city, limit=min(max(limit, 1), 50))}
@@ -2,10 +2,17 @@
 Lightweight client for data.gov.il CKAN Datastore API.
 - Use datastore_search for paging/filters.
 - Use datastore_search_sql for server-side SQL filtering when available.
+- Bulk / incremental copies of a whole resource: src/ckan_sync.py.
+- Nadlan CloudFront JSONs go through an on-disk cache revalidated with
+  ETag / Last-Modified (ConditionalCache) when NADLAN_CACHE_DIR is set.
 """
 
 from typing import Optional, Dict, Any, List
+import hashlib
+import json
 import os
+import time
+from pathlib import Path
 import requests
 import pandas as pd
 from requests.adapters import HTTPAdapter
@@ -16,15 +23,18 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATA_GOV_BASE = os.getenv("DATA_GOV_BASE", "https://data.gov.il/api/3/action").rstrip("/")
+NADLAN_BASE = os.getenv("NADLAN_BASE", "https://d3h795h5crxp9r.cloudfront.net").rstrip("/")
+NADLAN_CACHE_DIR = os.getenv("NADLAN_CACHE_DIR")  # unset → no on-disk cache
 
 class GovDataClient:
     def __init__(self, base_url: Optional[str] = None, timeout: int = 30):
         self.base_url = (base_url or DATA_GOV_BASE).rstrip("/")
         self.timeout = timeout
+        self.session = _session_gov()  # one pooled, retrying session for all datastore calls
 
     def datastore_search(self, resource_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
         url = f"{self.base_url}/datastore_search"
-        r = requests.get(url, params={"resource_id": resource_id, **params}, timeout=self.timeout)
+        r = self.session.get(url, params={"resource_id": resource_id, **params}, timeout=self.timeout)
         r.raise_for_status()
         data = r.json()
         if not data.get("success"):
@@ -36,7 +46,7 @@ class GovDataClient:
         payload = {"resource_id": resource_id, "sql": sql}
         if extra:
             payload.update(extra)
-        r = requests.get(url, params=payload, timeout=self.timeout)
+        r = self.session.get(url, params=payload, timeout=self.timeout)
         r.raise_for_status()
         data = r.json()
         if not data.get("success"):
@@ -75,6 +85,79 @@ def _session_gov() -> requests.Session:
     s.mount("https://", adapter)
     return s
 
+# --- on-disk cache of JSON GETs, revalidated with conditional requests ---
+class ConditionalCache:
+    """
+    Last body + validators (ETag, Last-Modified) per URL under `directory`.
+    Every get revalidates (If-None-Match / If-Modified-Since); an unchanged
+    resource answers 304 without a body and the stored copy is returned.
+    """
+
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.stats = {"fetched": 0, "not_modified": 0, "bytes": 0}
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return self.directory / f"{key}.json", self.directory / f"{key}.meta.json"
+
+    def get_json(self, session: requests.Session, url: str, timeout: float = TIMEOUT,
+                 headers: Optional[Dict[str, str]] = None):
+        body_path, meta_path = self._paths(url)
+        meta = None
+        if body_path.exists() and meta_path.exists():
+            try:
+                meta = json.loads(meta_path.read_text())
+            except ValueError:
+                meta = None
+        conditional = {}
+        if meta:
+            if meta.get("etag"):
+                conditional["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                conditional["If-Modified-Since"] = meta["last_modified"]
+        r = session.get(url, timeout=timeout, headers={**(headers or {}), **conditional})
+        if r.status_code == 304 and meta:
+            self.stats["not_modified"] += 1
+            return json.loads(body_path.read_bytes())
+        r.raise_for_status()
+        data = r.json()
+        self.stats["fetched"] += 1
+        self.stats["bytes"] += len(r.content)
+        new_meta = {"url": url, "etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified"),
+                    "fetched_at": time.time()}
+        for path, content in ((body_path, r.content), (meta_path, json.dumps(new_meta).encode("utf-8"))):
+            tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+            tmp.write_bytes(content)
+            os.replace(tmp, path)
+        return data
+
+_NADLAN_CACHE = None
+
+def nadlan_cache() -> Optional[ConditionalCache]:
+    """Cache shared by the Nadlan helpers (None when NADLAN_CACHE_DIR is unset)."""
+    global _NADLAN_CACHE
+    if _NADLAN_CACHE is None and NADLAN_CACHE_DIR:
+        _NADLAN_CACHE = ConditionalCache(NADLAN_CACHE_DIR)
+    return _NADLAN_CACHE
+
+def _nadlan_json(path: str, session: Optional[requests.Session] = None):
+    """GET NADLAN_BASE/path as JSON, through nadlan_cache() when configured."""
+    url = f"{NADLAN_BASE}/{path}"
+    cache = nadlan_cache()
+    own = session is None
+    s = _session_gov() if own else session
+    try:
+        if cache is not None:
+            return cache.get_json(s, url)
+        r = s.get(url, timeout=TIMEOUT)
+        r.raise_for_status()
+        return r.json()
+    finally:
+        if own:
+            s.close()
+
 # --- GovMap autocomplete (free text search) ---
 def search_address(query: str, limit: int = 10) -> dict:
     """Best-effort address search via GovMap. May fail if endpoint blocks server-side calls."""
@@ -101,35 +184,24 @@ def search_address(query: str, limit: int = 10) -> dict:
 
 
 # --- Nadlan.gov (CloudFront) indexes & pages ---
-def list_neighborhood_index():
-    url = "https://d3h795h5crxp9r.cloudfront.net/api/index/neigh.json"
+# Pass one session to reuse its connections across many pages.
+def list_neighborhood_index(session: Optional[requests.Session] = None):
     try:
-        with _session_gov() as s:
-            r = s.get(url, timeout=TIMEOUT)
-            r.raise_for_status()
-            return r.json()
+        return _nadlan_json("api/index/neigh.json", session)
     except Exception as e:
         print(f"[Nadlan] neighborhood_index error: {e}")
         return None
 
-def get_settlement_page(settlement_id: str | int) -> dict:
-    url = f"https://d3h795h5crxp9r.cloudfront.net/api/pages/settlement/buy/{settlement_id}.json"
+def get_settlement_page(settlement_id: str | int, session: Optional[requests.Session] = None) -> dict:
     try:
-        with _session_gov() as s:
-            r = s.get(url, timeout=TIMEOUT)
-            r.raise_for_status()
-            return r.json()
+        return _nadlan_json(f"api/pages/settlement/buy/{settlement_id}.json", session)
     except Exception as e:
         print(f"[Nadlan] settlement {settlement_id} error: {e}")
         return None
 
-def get_neighborhood_page(neighborhood_id: str | int) -> dict:
-    url = f"https://d3h795h5crxp9r.cloudfront.net/api/pages/neighborhood/buy/{neighborhood_id}.json"
+def get_neighborhood_page(neighborhood_id: str | int, session: Optional[requests.Session] = None) -> dict:
     try:
-        with _session_gov() as s:
-            r = s.get(url, timeout=TIMEOUT)
-            r.raise_for_status()
-            return r.json()
+        return _nadlan_json(f"api/pages/neighborhood/buy/{neighborhood_id}.json", session)
     except Exception as e:
         print(f"[Nadlan] neighborhood {neighborhood_id} error: {e}")
         return None
@@ -0,0 +1,238 @@
+# scripts/benchmark.py
+# Reproducible performance benchmark.
+#   python scripts/benchmark.py run --sizes 10k,1m,10m --out bench.json
+#   python scripts/benchmark.py compare base.json bench.json [--threshold 0.10]
+#
+# For each size a synthetic dataset with skewed city / neighborhood / rooms
+# popularity (scripts/make_synthetic_csv.py) is generated once, cached under
+# data/bench/, and measured in a fresh subprocess, so peak RSS is per size:
+#   - load: CSV parse + snapshot write, warm snapshot load, index build
+#   - memory: peak RSS, frame size and per-column footprint
+#   - evaluate_listing: end-to-end and per-stage p50/p95/p99 (ms)
+#   - evaluate_listings_batch: listings/s
+# compare exits with status 1 when any metric got worse by more than --threshold.
+
+import argparse
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT / "src"))
+sys.path.append(str(ROOT / "scripts"))
+
+import make_synthetic_csv
+
+BENCH_DIR = ROOT / "data" / "bench"
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+PERCENTILES = (50, 95, 99)
+
+# metric name → True when higher is better
+HIGHER_IS_BETTER = {"batch_listings_per_s": True}
+
+def _size_label(n: int) -> str:
+    for label, rows in SIZES.items():
+        if rows == n:
+            return label
+    return str(n)
+
+def _parse_sizes(text: str) -> list[int]:
+    out = []
+    for part in text.split(","):
+        part = part.strip().lower()
+        out.append(SIZES[part] if part in SIZES else int(part))
+    return out
+
+# ---------- synthetic data ----------
+
+def ensure_dataset(n_rows: int, seed: int) -> Path:
+    """Generate (once per size/seed) with make_synthetic_csv, national-scale shape."""
+    BENCH_DIR.mkdir(parents=True, exist_ok=True)
+    path = BENCH_DIR / f"transactions_{_size_label(n_rows)}_s{seed}.csv"
+    if path.exists():
+        return path
+    chunks = make_synthetic_csv.generate(
+        n_rows, cities=max(20, min(250, n_rows // 2_000)), max_neighborhoods=60,
+        city_skew=1.1, neigh_skew=1.0, wide_rooms=True, growth_jitter=0.01,
+        outlier_rate=0.002, years_back=12, recent_bias=1.4, seed=seed, today=datetime.utcnow())
+    return make_synthetic_csv.write_dataset(chunks, path)
+
+# ---------- measurement (runs in a child process per size) ----------
+
+def _pcts(values) -> dict:
+    if not values:
+        return {}
+    arr = np.asarray(values) * 1000.0
+    return {f"p{p}": round(float(np.percentile(arr, p)), 4) for p in PERCENTILES}
+
+def _sample_listings(df: pd.DataFrame, n: int, rng) -> list[dict]:
+    """Listings drawn from real rows, so query popularity follows the data skew."""
+    rows = df.iloc[rng.integers(0, len(df), size=n)]
+    sizes = np.round(rows["size_sqm"].to_numpy() * rng.uniform(0.95, 1.05, size=n), 1)
+    asking = np.round(rows["price_per_sqm"].to_numpy() * sizes * rng.uniform(0.85, 1.15, size=n))
+    return [
+        dict(city=c, neighborhood=nb, rooms=float(r), size_sqm=float(s), asking_price_ils=int(a))
+        for c, nb, r, s, a in zip(rows["city"], rows["neighborhood"], rows["rooms"], sizes, asking)
+    ]
+
+def measure(csv_path: Path, queries: int, batch: int, seed: int) -> dict:
+    import metrics
+    from data_loader import load_transactions_csv, memory_report
+    from orchestrator import evaluate_listing, evaluate_listings_batch
+    from segment_index import SegmentIndex
+    from snapshot import snapshot_dir_for
+
+    shutil.rmtree(snapshot_dir_for(csv_path), ignore_errors=True)
+    out = {}
+
+    t = time.perf_counter()
+    load_transactions_csv(str(csv_path))          # parse + write snapshot
+    out["load_csv_s"] = round(time.perf_counter() - t, 4)
+    t = time.perf_counter()
+    df = load_transactions_csv(str(csv_path))     # warm snapshot
+    out["load_snapshot_s"] = round(time.perf_counter() - t, 4)
+    t = time.perf_counter()
+    index = SegmentIndex(df)
+    out["index_build_s"] = round(time.perf_counter() - t, 4)
+    out["rows"] = len(df)
+    report = memory_report(df)
+    out["frame_mb"] = round(float(report["mb"].sum()), 1)
+    out["column_mb"] = report["mb"].round(2).to_dict()
+
+    rng = np.random.default_rng(seed)
+    listings = _sample_listings(df, queries, rng)
+    for l in listings[: min(20, queries)]:     # warm-up
+        evaluate_listing(df, index=index, **l)
+    totals, stages = [], {}
+    for l in listings:
+        timings = metrics.start_request_timings()
+        t = time.perf_counter()
+        evaluate_listing(df, index=index, **l)
+        totals.append(time.perf_counter() - t)
+        for name, dt in timings.items():
+            stages.setdefault(name, []).append(dt)
+    out["evaluate_ms"] = _pcts(totals)
+    out["stage_ms"] = {name: _pcts(v) for name, v in sorted(stages.items())}
+
+    batch_listings = _sample_listings(df, batch, rng)
+    t = time.perf_counter()
+    evaluate_listings_batch(df, batch_listings, index=index)
+    out["batch_listings_per_s"] = round(batch / (time.perf_counter() - t), 1)
+
+    out["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return out
+
+# ---------- run / compare ----------
+
+def _meta(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "queries": args.queries,
+        "batch": args.batch,
+    }
+
+def run(args) -> None:
+    results = {}
+    for n in _parse_sizes(args.sizes):
+        label = _size_label(n)
+        csv_path = ensure_dataset(n, args.seed)
+        print(f"[bench] {label}: {csv_path}", file=sys.stderr)
+        child = subprocess.run(
+            [sys.executable, __file__, "_measure", str(csv_path),
+             "--queries", str(args.queries), "--batch", str(args.batch), "--seed", str(args.seed)],
+            capture_output=True, text=True)
+        if child.returncode != 0:
+            print(child.stderr, file=sys.stderr)
+            raise SystemExit(f"[bench] {label} failed")
+        results[label] = json.loads(child.stdout.strip().splitlines()[-1])
+    report = {"meta": _meta(args), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text)
+        print(f"[bench] wrote {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+def _flatten(d: dict, prefix: str = "") -> dict:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)) and k != "rows":
+            out[key] = float(v)
+    return out
+
+def compare(args) -> int:
+    base = json.loads(Path(args.base).read_text())["results"]
+    new = json.loads(Path(args.new).read_text())["results"]
+    regressions = 0
+    for label in [l for l in base if l in new]:
+        b, n = _flatten(base[label]), _flatten(new[label])
+        for key in sorted(set(b) & set(n)):
+            if b[key] <= 0 or ("_ms." in key and max(b[key], n[key]) < args.min_ms):
+                continue  # sub-noise timings (e.g. 0.01 ms stages) swing by more than any threshold
+            higher_better = HIGHER_IS_BETTER.get(key.split(".")[0], False)
+            change = (n[key] - b[key]) / b[key]
+            worse = -change if higher_better else change
+            flag = "REGRESSION" if worse > args.threshold else ("improved" if worse < -args.threshold else "")
+            regressions += flag == "REGRESSION"
+            if flag or args.verbose:
+                print(f"{label:>5} {key:<40} {b[key]:>12.4f} → {n[key]:>12.4f} ({change:+.1%}) {flag}")
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+def main():
+    p = argparse.ArgumentParser(description="Real estate backend benchmark")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run", help="generate (if needed) and measure datasets")
+    r.add_argument("--sizes", default="10k,1m", help="comma list of 10k/100k/1m/10m or row counts")
+    r.add_argument("--queries", type=int, default=500, help="evaluate_listing calls per size")
+    r.add_argument("--batch", type=int, default=20_000, help="listings in the batch throughput run")
+    r.add_argument("--seed", type=int, default=7)
+    r.add_argument("--out", help="write the JSON report here (default: stdout)")
+
+    m = sub.add_parser("_measure")  # internal: one size, in its own process
+    m.add_argument("csv")
+    m.add_argument("--queries", type=int, default=500)
+    m.add_argument("--batch", type=int, default=20_000)
+    m.add_argument("--seed", type=int, default=7)
+
+    c = sub.add_parser("compare", help="flag regressions between two reports")
+    c.add_argument("base")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=0.10, help="relative change counted as regression")
+    c.add_argument("--min-ms", type=float, default=0.05, help="ignore latencies below this (ms)")
+    c.add_argument("--verbose", action="store_true", help="print unchanged metrics too")
+
+    args = p.parse_args()
+    if args.cmd == "run":
+        run(args)
+    elif args.cmd == "_measure":
+        print(json.dumps(measure(Path(args.csv), args.queries, args.batch, args.seed)))
+    else:
+        sys.exit(compare(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+# scripts/build_sqlite.py
+# Load the transactions CSV into an indexed SQLite database for DATASET_MODE=sqlite:
+#   python scripts/build_sqlite.py [data/transactions.csv] [out.sqlite]
+#   DATASET_MODE=sqlite uvicorn api.real_estate_api:app
+# The CSV is cleaned chunk by chunk, so this runs in bounded memory.
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from sql_store import SQLiteStore
+
+def main():
+    default = Path(__file__).resolve().parents[1] / "data" / "transactions.csv"
+    csv_path = Path(sys.argv[1]) if len(sys.argv) > 1 else default
+    db_path = Path(sys.argv[2]) if len(sys.argv) > 2 else None
+    store = SQLiteStore.build(csv_path, db_path)
+    print(f"Built {store.path} from {csv_path}: {len(store)} rows")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# scripts/check_allocations.py
+# Allocation regression check for evaluate_listing.
+#   python scripts/check_allocations.py [--size 100k] [--queries 200] [--base-kb 128]
+#       [--bytes-per-segment-row 64] [--bytes-per-row 4]
+#
+# Runs evaluate_listing on a synthetic dataset (benchmark.ensure_dataset) and
+# measures the tracemalloc peak of every call, in three cases:
+#   - index:    SegmentIndex, listing in a known neighborhood
+#   - fallback: SegmentIndex, unknown neighborhood (whole-city segment)
+#   - scan:     no index (boolean filters over the full frame)
+# A call may allocate at most --base-kb, plus --bytes-per-segment-row per row
+# of its segment (city / neighborhood-or-city / rooms: position arrays and
+# gathered columns), plus --bytes-per-row per frame row for scan (filter
+# masks), so the budget grows with the work a call does, not with the dataset.
+# Copying the segment's rows as a frame costs well over 100 bytes per row.
+# Prints the worst call per case; exits with status 1 when any call is over.
+
+import argparse
+import sys
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT / "src"))
+sys.path.append(str(ROOT / "scripts"))
+
+from benchmark import SIZES, _sample_listings, ensure_dataset
+
+CASES = ("index", "fallback", "scan")
+
+def _peak(fn) -> int:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def check(args) -> int:
+    from data_loader import load_transactions_csv
+    from comps import segment_positions
+    from orchestrator import evaluate_listing
+    from segment_index import SegmentIndex
+
+    n_rows = SIZES.get(args.size.lower()) or int(args.size)
+    df = load_transactions_csv(str(ensure_dataset(n_rows, args.seed)))
+    index = SegmentIndex(df)
+    listings = _sample_listings(df, args.queries, np.random.default_rng(args.seed))
+
+    over = 0
+    for case in CASES:
+        kw = {} if case == "scan" else {"index": index}
+        worst = None
+        for i, l in enumerate(listings):
+            if case == "fallback":
+                l = {**l, "neighborhood": "__no such neighborhood__"}
+            if i == 0:
+                evaluate_listing(df, **kw, **l)  # warm-up (lazy imports, caches)
+            peak = _peak(lambda: evaluate_listing(df, **kw, **l))
+            segment = len(segment_positions(df, l["city"], l["neighborhood"], l["rooms"], index=index))
+            budget = (args.base_kb * 1024 + args.bytes_per_segment_row * segment
+                      + args.bytes_per_row * (len(df) if case == "scan" else 0))
+            over += peak > budget
+            if worst is None or peak / budget > worst[0] / worst[1]:
+                worst = (peak, budget, l)
+        peak, budget, l = worst
+        flag = "OVER BUDGET" if peak > budget else "ok"
+        print(f"{case:<9} worst peak {peak / 1024:>9.1f} KB of {budget / 1024:>9.1f} KB budget  "
+              f"({l['city']} / {l['neighborhood']} / {l['rooms']}) {flag}")
+    print(f"{len(df)} rows, {len(listings)} listings per case: {over} call(s) over budget")
+    return 1 if over else 0
+
+def main():
+    p = argparse.ArgumentParser(description="evaluate_listing allocation check")
+    p.add_argument("--size", default="100k", help="10k/100k/1m/10m or a row count")
+    p.add_argument("--queries", type=int, default=200, help="listings per case")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--base-kb", type=float, default=128, help="budget per call, KB")
+    p.add_argument("--bytes-per-segment-row", type=float, default=64, help="extra budget per segment row")
+    p.add_argument("--bytes-per-row", type=float, default=4, help="extra budget per frame row (scan only)")
+    sys.exit(check(p.parse_args()))
+
+if __name__ == "__main__":
+    main()
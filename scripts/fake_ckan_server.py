@@ -0,0 +1,190 @@
+# scripts/fake_ckan_server.py
+# Local stand-in for the CKAN datastore API (serving a CSV as one resource) and
+# the Nadlan CloudFront JSONs, to test scripts/sync_ckan.py and the conditional
+# requests of gov_data_client without data.gov.il:
+#
+#   python scripts/fake_ckan_server.py data/transactions.csv --port 8765 --fail-rate 0.05
+#   python scripts/sync_ckan.py --resource-id fake --base-url http://127.0.0.1:8765/api/3/action \
+#       --out data/ckan/transactions.csv
+#   NADLAN_BASE=http://127.0.0.1:8765 NADLAN_CACHE_DIR=data/nadlan_cache python scripts/refresh_nadlan.py
+#
+# Implements datastore_search with resource_id, offset, limit, sort=_id asc and
+# include_total (rows get _id = 1..n in file order), datastore_search_sql (a
+# read-only SELECT run by SQLite over the same rows, table name = resource id),
+# and /api/index/neigh.json + /api/pages/settlement/buy/<id>.json built from the
+# rows, with ETag / Last-Modified and 304 answers to conditional requests.
+# --rows serves only the first N rows (restart with more to simulate new deals);
+# --fail-rate answers that share of requests with 503 and --delay-ms slows every
+# page, to exercise retries and concurrency.
+
+import argparse
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+MAX_LIMIT = 32_000  # CKAN's cap on rows per datastore_search call
+
+def _sqlite_table(df: pd.DataFrame, resource_id: str) -> sqlite3.Connection:
+    db = sqlite3.connect(":memory:", check_same_thread=False)
+    cols = ", ".join(f'"{c}" TEXT' for c in df.columns)
+    db.execute(f'CREATE TABLE "{resource_id}" ("_id" INTEGER PRIMARY KEY, {cols})')
+    marks = ", ".join("?" * (len(df.columns) + 1))
+    db.executemany(f'INSERT INTO "{resource_id}" VALUES ({marks})',
+                   ((i + 1, *row) for i, row in enumerate(df.itertuples(index=False))))
+    return db
+
+def _nadlan_pages(df: pd.DataFrame) -> dict:
+    """path → JSON body: a neighborhood index and one page per settlement (ids in city order)."""
+    cities = sorted(df["city"].unique())
+    neigh = (df[["city", "neighborhood"]].drop_duplicates().sort_values(["city", "neighborhood"]))
+    pages = {"api/index/neigh.json": [
+        {"id": i + 1, "name": n, "settlement_id": cities.index(c) + 1}
+        for i, (c, n) in enumerate(zip(neigh["city"], neigh["neighborhood"]))]}
+    price = pd.to_numeric(df["price_ils"], errors="coerce")
+    for i, c in enumerate(cities):
+        deals = price[df["city"] == c]
+        pages[f"api/pages/settlement/buy/{i + 1}.json"] = {
+            "id": i + 1, "name": c, "deals": int(deals.count()), "avg_price": round(float(deals.mean()), 2)}
+    return {path: json.dumps(body, ensure_ascii=False).encode("utf-8") for path, body in pages.items()}
+
+def make_handler(df: pd.DataFrame, resource_id: str, fail_rate: float, delay_s: float):
+    fields = [{"id": "_id", "type": "int"}] + [{"id": c, "type": "text"} for c in df.columns]
+    lock = threading.Lock()
+    stats = {"requests": 0, "failed": 0, "not_modified": 0, "bytes": 0}
+    db = _sqlite_table(df, resource_id)
+    pages = _nadlan_pages(df)
+    started = time.time()
+    last_modified = formatdate(started, usegmt=True)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, so pooled connections are reused
+
+        def _send(self, status: int, payload: dict | bytes, headers: dict | None = None) -> None:
+            body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+            with lock:
+                stats["bytes"] += len(body)
+
+        def _not_modified(self, etag: str) -> bool:
+            inm = self.headers.get("If-None-Match")
+            if inm is not None:
+                return etag in [t.strip() for t in inm.split(",")] or inm.strip() == "*"
+            ims = self.headers.get("If-Modified-Since")
+            try:
+                return ims is not None and parsedate_to_datetime(ims).timestamp() >= int(started)
+            except (TypeError, ValueError):
+                return False
+
+        def _static(self, path: str):
+            body = pages.get(path)
+            if body is None:
+                return self._send(404, {"message": "Not found"})
+            etag = '"' + hashlib.sha1(body).hexdigest()[:16] + '"'
+            headers = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "max-age=60"}
+            if self._not_modified(etag):
+                with lock:
+                    stats["not_modified"] += 1
+                self.send_response(304)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self._send(200, body, headers)
+
+        def _sql(self, sql: str):
+            if not sql.lstrip().lower().startswith("select"):
+                return self._send(400, {"success": False, "error": {"message": "read-only SELECT only"}})
+            try:
+                with lock:
+                    cur = db.execute(sql)
+                    names = [d[0] for d in cur.description]
+                    rows = cur.fetchall()
+            except sqlite3.Error as e:
+                return self._send(409, {"success": False, "error": {"message": str(e)}})
+            records = [dict(zip(names, r)) for r in rows]
+            self._send(200, {"success": True, "result": {"records": records, "fields": fields, "sql": sql}})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            q = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            with lock:
+                stats["requests"] += 1
+            if url.path.startswith("/api/index/") or url.path.startswith("/api/pages/"):
+                return self._static(url.path.lstrip("/"))
+            if url.path.endswith("/datastore_search_sql"):
+                if random.random() < fail_rate:
+                    with lock:
+                        stats["failed"] += 1
+                    return self._send(503, {"success": False, "error": {"message": "Service unavailable"}})
+                return self._sql(q.get("sql", ""))
+            if not url.path.endswith("/datastore_search"):
+                return self._send(404, {"success": False, "error": {"message": "Not found"}})
+            if q.get("resource_id") != resource_id:
+                return self._send(404, {"success": False, "error": {"message": "Resource not found"}})
+            if random.random() < fail_rate:
+                with lock:
+                    stats["failed"] += 1
+                return self._send(503, {"success": False, "error": {"message": "Service unavailable"}})
+            if delay_s:
+                time.sleep(delay_s)
+            if q.get("sort", "_id asc") != "_id asc":
+                return self._send(400, {"success": False, "error": {"message": "only sort=_id asc"}})
+            offset = int(q.get("offset", 0))
+            limit = min(int(q.get("limit", 100)), MAX_LIMIT)
+            page = df.iloc[offset:offset + limit]
+            records = [{"_id": offset + i + 1, **r} for i, r in enumerate(page.to_dict(orient="records"))]
+            result = {"resource_id": resource_id, "fields": fields, "records": records,
+                      "offset": offset, "limit": limit}
+            if q.get("include_total", "true") == "true":
+                result["total"] = len(df)
+            self._send(200, {"success": True, "result": result})
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler, stats
+
+def main():
+    p = argparse.ArgumentParser(description="Local stand-in CKAN datastore server")
+    p.add_argument("csv")
+    p.add_argument("--resource-id", default="fake")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--rows", type=int, default=None, help="serve only the first N rows")
+    p.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    p.add_argument("--delay-ms", type=float, default=0.0, help="latency added to every page")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    random.seed(args.seed)
+    df = pd.read_csv(args.csv, dtype=str, keep_default_na=False)
+    if args.rows is not None:
+        df = df.head(args.rows)
+    handler, stats = make_handler(df, args.resource_id, args.fail_rate, args.delay_ms / 1000)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+    print(f"Serving {len(df)} rows of {args.csv} as resource {args.resource_id!r} "
+          f"on http://127.0.0.1:{args.port}/api/3/action", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"{stats['requests']} requests, {stats['failed']} answered with 503, "
+              f"{stats['not_modified']} with 304, {stats['bytes']} body bytes")
+
+if __name__ == "__main__":
+    main()
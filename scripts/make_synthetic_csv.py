@@ -1,17 +1,30 @@
 # scripts/make_synthetic_csv.py
-# Generate a multi-city synthetic real-estate transactions CSV for testing:
-# - Multiple cities and neighborhoods
-# - Varying rooms (2/3/4) and sizes
-# - Recent (last 2y) + long-term (~10y back, buckets ~ every 2y, 1-5 deals per bucket)
+# Generate a multi-city synthetic real-estate transactions dataset for testing:
+# - Multiple cities and neighborhoods (Zipf-skewed popularity beyond the 5 named cities)
+# - Rooms mix (2/3/4 by default) and room-dependent sizes
+# - Deals over ~10 years, denser in recent years, priced on per-city appreciation curves
+# - Optional outliers (data-entry style price errors)
+# - Optional lat/lon: each neighborhood is a cluster around a point near its city center
+#
+# Rows are sampled array-at-a-time with NumPy and written chunk by chunk, so
+# peak memory is bounded by --chunk-rows, not by --rows.
+#
+#   python scripts/make_synthetic_csv.py                       # dev CSV → data/transactions.csv
+#   python scripts/make_synthetic_csv.py --rows 10000000 --cities 250 \
+#       --out data/synthetic --format parquet --partition-by year
+#
+# Output layouts:
+#   --out file.csv                     one CSV, chunks appended
+#   --out dir/ [--partition-by none]   dir/part-00000.csv, part-00001.csv, ... (one per chunk)
+#   --out dir/ --partition-by year     dir/year=2021/part-00000.csv, ... (hive style; also city)
 
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
-import random
+import argparse
+import shutil
+from datetime import datetime
 from pathlib import Path
 
-random.seed(7)
-np.random.seed(7)
+import numpy as np
+import pandas as pd
 
 TODAY = datetime(2025, 10, 24)
 
@@ -22,7 +35,6 @@ CITIES = [
     ("Rishon LeZion", ["West", "Neve Dekalim", "Ramat Eliyahu"]),
     ("Ramat Gan", ["Merom Nave", "Ramat Chen", "Borochov"]),
 ]
-ROOMS = [2.0, 3.0, 4.0]
 BASE_PPSQM = {
     "Tel Aviv-Yafo": 52000,
     "Jerusalem": 42000,
@@ -30,97 +42,257 @@ BASE_PPSQM = {
     "Rishon LeZion": 35000,
     "Ramat Gan": 38000,
 }
+CITY_CENTERS = {
+    "Tel Aviv-Yafo": (32.0853, 34.7818),
+    "Jerusalem": (31.7683, 35.2137),
+    "Haifa": (32.7940, 34.9896),
+    "Rishon LeZion": (31.9730, 34.7925),
+    "Ramat Gan": (32.0684, 34.8248),
+}
+NEIGH_SPREAD_DEG = 0.02   # neighborhood centers ~2 km around the city center
+DEAL_SPREAD_DEG = 0.003   # deals ~300 m around their neighborhood center
+STREETS = np.array(["Herzl", "Dizengoff", "Jabotinsky", "Ben Yehuda", "Bialik", "Hashalom", "Allenby"])
+
+ROOMS = [2.0, 3.0, 4.0]
+ROOMS_P = [1 / 3, 1 / 3, 1 / 3]
+ROOMS_WIDE = [1.0, 1.5, 2.0, 2.5, 3.0, 3.5, 4.0, 4.5, 5.0, 6.0]
+ROOMS_WIDE_P = [.02, .01, .10, .04, .30, .06, .28, .06, .10, .03]
+# 2-room slightly cheaper per sqm, 4-room slightly higher (purely synthetic)
+ROOM_FACTOR = {1.0: 0.86, 1.5: 0.88, 2.0: 0.90, 2.5: 0.95, 3.0: 1.00, 3.5: 1.04,
+               4.0: 1.08, 4.5: 1.10, 5.0: 1.12, 6.0: 1.15}
+_ROOM_KEYS = np.array(sorted(ROOM_FACTOR))
+_ROOM_VALUES = np.array([ROOM_FACTOR[k] for k in _ROOM_KEYS])
+
+DEFAULT_CURVE = {2015: 0.016}  # year → annual appreciation from that year on
+
+def parse_curve(text: str) -> dict:
+    """'2015:0.03,2020:0.08,2023:-0.01' → {2015: 0.03, 2020: 0.08, 2023: -0.01}"""
+    out = {}
+    for part in text.split(","):
+        year, rate = part.split(":")
+        out[int(year)] = float(rate)
+    return out
+
+def _zipf_weights(n: int, s: float) -> np.ndarray:
+    """P(rank k) ∝ 1 / k**s; s=0 is uniform."""
+    w = 1.0 / np.arange(1, n + 1) ** s
+    return w / w.sum()
+
+class Universe:
+    """
+    Per-city / per-neighborhood parameters, drawn once so every chunk
+    samples from the same market.
+      - first len(CITIES) cities are the named ones, the rest "City 6", ...
+      - city popularity ~ Zipf(city_skew), neighborhoods ~ Zipf(neigh_skew) inside
+        a city; neighborhoods per city scale with the city's popularity
+      - each city gets its own offset on top of the appreciation curve
+      - with coords, each city a center (named ones real, others inside Israel's
+        bounding box) and each neighborhood a center around it
+    """
+
+    def __init__(self, rng, n_cities: int, max_neighborhoods: int, city_skew: float, neigh_skew: float,
+                 curve: dict, growth_jitter: float, years_back: int, today: datetime, coords: bool = False):
+        names = [c for c, _ in CITIES][:n_cities] + [f"City {i + 1}" for i in range(len(CITIES), n_cities)]
+        self.cities = np.array(names)
+        self.city_p = _zipf_weights(n_cities, city_skew)
+
+        rel = self.city_p / self.city_p[0]
+        self.n_neigh = np.maximum(3, np.round(max_neighborhoods * rel)).astype(np.int64)
+        named = dict(CITIES)
+        self.neigh_names = []
+        for i, c in enumerate(names):
+            fixed = named.get(c, [])
+            if len(fixed) >= self.n_neigh[i]:
+                self.neigh_names.append(np.array(fixed[: self.n_neigh[i]]))
+            else:
+                extra = [f"{c} N{j + 1}" for j in range(len(fixed), self.n_neigh[i])]
+                self.neigh_names.append(np.array(fixed + extra))
+        self.neigh_offset = np.r_[0, np.cumsum(self.n_neigh)[:-1]]
+        # city c's neighborhood CDF shifted into [c, c+1): one searchsorted samples all rows
+        self.neigh_cdf = np.concatenate([c + np.cumsum(_zipf_weights(k, neigh_skew))
+                                         for c, k in enumerate(self.n_neigh)])
+        self.neigh_cdf[self.neigh_offset + self.n_neigh - 1] = np.arange(n_cities) + 1.0
 
-def random_address():
-    streets = ["Herzl", "Dizengoff", "Jabotinsky", "Ben Yehuda", "Bialik", "Hashalom", "Allenby"]
-    return f"{np.random.choice(streets)} {np.random.randint(1, 251)}"
+        self.base = np.array([BASE_PPSQM.get(c, 0) or rng.uniform(15_000, 45_000) for c in names])
+        self.neigh_factor = rng.uniform(0.85, 1.15, size=int(self.n_neigh.sum()))
+        for i, c in enumerate(names):  # named neighborhoods stay at their city's base
+            k = min(len(named.get(c, [])), self.n_neigh[i])
+            self.neigh_factor[self.neigh_offset[i]:self.neigh_offset[i] + k] = 1.0
 
-def gen_block(city, neighborhood, rooms,
-              base_size=70, n_recent=20, years_back=10, bucket_span_days=720):
+        # log price level per city at Jan 1st of each year (curve rate + per-city offset)
+        self.today = np.datetime64(today.date())
+        self.years_back = years_back
+        self.first_year = today.year - years_back - 1
+        years = np.arange(self.first_year, today.year + 1)
+        curve_years = sorted(curve)
+        rates = np.array([curve[max([y for y in curve_years if y <= yr], default=curve_years[0])]
+                          for yr in years])
+        offsets = rng.normal(0.0, growth_jitter, size=n_cities) if growth_jitter else np.zeros(n_cities)
+        log_growth = np.log1p(rates[None, :] + offsets[:, None])                 # cities × years
+        self.log_level = np.concatenate([np.zeros((n_cities, 1)), np.cumsum(log_growth, axis=1)], axis=1)
+        self.log_today = self._log_level(np.arange(n_cities), np.full(n_cities, self.today))
+
+        # drawn last, so datasets without coords are unchanged
+        self.neigh_center = None
+        if coords:
+            center = np.array([CITY_CENTERS.get(c) or (rng.uniform(29.6, 33.2), rng.uniform(34.3, 35.6))
+                               for c in names])
+            city_of_neigh = np.repeat(np.arange(n_cities), self.n_neigh)
+            self.neigh_center = center[city_of_neigh] + rng.normal(0.0, NEIGH_SPREAD_DEG, size=(len(city_of_neigh), 2))
+
+    def _log_level(self, city, dates) -> np.ndarray:
+        year_start = dates.astype("datetime64[Y]")
+        i = np.clip(year_start.astype(np.int64) + 1970 - self.first_year, 0, self.log_level.shape[1] - 2)
+        frac = (dates - year_start.astype("datetime64[D]")).astype(np.int64) / 365.25
+        lo, hi = self.log_level[city, i], self.log_level[city, i + 1]
+        return lo + (hi - lo) * frac
+
+    def price_index(self, city, dates) -> np.ndarray:
+        """Price multiplier vs today for deals of `city` (codes) on `dates`."""
+        return np.exp(self._log_level(city, dates) - self.log_today[city])
+
+def generate_chunk(u: Universe, rng, start: int, n: int, rooms_values, rooms_p,
+                   outlier_rate: float, recent_bias: float) -> pd.DataFrame:
+    city = rng.choice(len(u.cities), size=n, p=u.city_p)
+    neigh_global = np.searchsorted(u.neigh_cdf, city + rng.random(n), side="right")
+
+    rooms = rng.choice(rooms_values, size=n, p=rooms_p)
+    base_size = np.where(rooms == 3.0, 70, np.where(rooms == 2.0, 60, np.where(rooms == 4.0, 85, 22 * rooms + 10)))
+    size = np.round(np.maximum(35, rng.normal(base_size, 8.5)), 1)
+
+    # deal age: Beta(1, recent_bias) over years_back → denser in recent years
+    age_days = (rng.beta(1.0, recent_bias, size=n) * u.years_back * 365).astype(np.int64)
+    dates = u.today - age_days.astype("timedelta64[D]")
+
+    room_factor = _ROOM_VALUES[np.searchsorted(_ROOM_KEYS, rooms)]
+    ppsqm = (u.base[city] * u.neigh_factor[neigh_global] * room_factor
+             * u.price_index(city, dates) * rng.normal(1.0, 0.065, size=n))
+    ppsqm = np.maximum(ppsqm, 12_000)
+    price = ppsqm * size
+    if outlier_rate > 0:
+        out = rng.random(n) < outlier_rate
+        price[out] *= rng.choice([0.1, 0.35, 2.5, 10.0], size=int(out.sum()))
+    prefix = np.where(age_days < 2 * 365, "R", "L")
+
+    neigh_names = np.concatenate(u.neigh_names)
+    df = pd.DataFrame({
+        "tx_id": np.char.add(prefix, np.arange(start + 1, start + n + 1).astype(str)),
+        "deal_date": np.datetime_as_string(dates, unit="D"),
+        "city": u.cities[city],
+        "neighborhood": neigh_names[neigh_global],
+        "address": np.char.add(np.char.add(STREETS[rng.integers(0, len(STREETS), size=n)], " "),
+                               rng.integers(1, 251, size=n).astype(str)),
+        "size_sqm": size,
+        "rooms": rooms,
+        "floor": rng.integers(0, 8, size=n),
+        "year_built": rng.integers(1945, 2020, size=n),
+        "price_ils": np.round(price).astype(np.int64),
+    })
+    if u.neigh_center is not None:
+        latlon = u.neigh_center[neigh_global] + rng.normal(0.0, DEAL_SPREAD_DEG, size=(n, 2))
+        df["lat"], df["lon"] = np.round(latlon[:, 0], 6), np.round(latlon[:, 1], 6)
+    return df
+
+def generate(rows: int, cities: int = 5, max_neighborhoods: int = 3, chunk_rows: int = 1_000_000,
+             seed: int = 7, curve: dict | None = None, growth_jitter: float = 0.0,
+             outlier_rate: float = 0.0, years_back: int = 10, recent_bias: float = 1.2,
+             city_skew: float = 0.0, neigh_skew: float = 0.0, wide_rooms: bool = False,
+             coords: bool = False, today: datetime = TODAY):
+    """
+    Yield DataFrame chunks of at most chunk_rows rows (rows in total).
+    Chunk k is drawn from its own child seed, so a chunk does not depend on
+    how many were generated before it.
+    """
+    seq = np.random.SeedSequence(seed)
+    u_seed, *chunk_seeds = seq.spawn(1 + max(1, -(-rows // chunk_rows)))
+    u = Universe(np.random.default_rng(u_seed), cities, max_neighborhoods, city_skew, neigh_skew,
+                 curve or DEFAULT_CURVE, growth_jitter, years_back, today, coords)
+    rooms_values, rooms_p = (ROOMS_WIDE, ROOMS_WIDE_P) if wide_rooms else (ROOMS, ROOMS_P)
+    for k, start in enumerate(range(0, rows, chunk_rows)):
+        rng = np.random.default_rng(chunk_seeds[k])
+        yield generate_chunk(u, rng, start, min(chunk_rows, rows - start), rooms_values, rooms_p,
+                             outlier_rate, recent_bias)
+
+def _write(df: pd.DataFrame, path: Path, fmt: str, append: bool = False) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if fmt == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, mode="a" if append else "w", header=not append, index=False)
+
+def write_dataset(chunks, out: str | Path, fmt: str = "csv", partition_by: str = "none") -> Path:
     """
-    Build a block of transactions for (city, neighborhood, rooms).
-    - Recent: n_recent deals in the last 2 years
-    - Long-term: up to ~10 years back, buckets ~ every 2 years, 1–5 deals per bucket
+    Stream chunks to `out` (see layouts at the top of this file); only one
+    chunk is in memory at a time. Written to a temp path, then renamed.
+    Returns the output path.
     """
-    rows = []
-    base_ppsqm = BASE_PPSQM[city]
-
-    # Adjust per-room price tendency (purely synthetic):
-    # 2-room slightly cheaper per sqm, 4-room slightly higher per sqm.
-    def room_factor(r):
-        return 1.00 if r == 3.0 else (0.90 if r == 2.0 else 1.08)
-
-    # Recent (within 2 years)
-    for i in range(n_recent):
-        d = TODAY - timedelta(days=int(np.random.randint(0, 2*365)))
-        size = float(max(35, round(np.random.normal(base_size, 8), 1)))
-        ppsqm = float(max(18000, round(np.random.normal(base_ppsqm * room_factor(rooms),
-                                                        0.06 * base_ppsqm), 2)))
-        price = int(round(ppsqm * size))
-        rows.append(dict(
-            tx_id=f"R_{city[:2]}_{neighborhood[:2]}_{rooms}_{i+1}",
-            deal_date=d.strftime("%Y-%m-%d"),
-            city=city,
-            neighborhood=neighborhood,
-            address=random_address(),
-            size_sqm=size,
-            rooms=float(rooms),
-            floor=int(np.random.randint(0, 8)),
-            year_built=int(np.random.randint(1950, 2020)),
-            price_ils=price
-        ))
-
-    # Long-term (up to 10 years back), buckets ~ every 2 years
-    bucket_end = TODAY - timedelta(days=2*365)  # start before recent window
-    start_limit = TODAY - timedelta(days=years_back*365)
-    while bucket_end > start_limit:
-        bucket_start = bucket_end - timedelta(days=bucket_span_days)
-        # 1..5 deals per bucket to avoid outlier reliance
-        for _ in range(np.random.randint(1, 6)):
-            d = bucket_start + timedelta(days=int(np.random.randint(0, bucket_span_days)))
-            if d < start_limit or d >= TODAY - timedelta(days=2*365):
-                continue
-            years_ago = (TODAY - d).days / 365.25
-            # ~1.6% annual appreciation forward → older deals slightly cheaper
-            trend = (1 - 0.016) ** years_ago
-            size = float(max(35, round(np.random.normal(base_size, 9), 1)))
-            ppsqm = float(max(16000, round(np.random.normal(base_ppsqm * room_factor(rooms) * trend,
-                                                            0.07 * base_ppsqm), 2)))
-            price = int(round(ppsqm * size))
-            rows.append(dict(
-                tx_id=f"L_{city[:2]}_{neighborhood[:2]}_{rooms}_{int(d.timestamp())}",
-                deal_date=d.strftime("%Y-%m-%d"),
-                city=city,
-                neighborhood=neighborhood,
-                address=random_address(),
-                size_sqm=size,
-                rooms=float(rooms),
-                floor=int(np.random.randint(0, 8)),
-                year_built=int(np.random.randint(1945, 2015)),
-                price_ils=price
-            ))
-        bucket_end = bucket_start
-
-    return rows
+    out = Path(out)
+    single = out.suffix in (".csv", ".parquet") and partition_by == "none"
+    if single and fmt == "parquet":
+        raise SystemExit("Single-file output is CSV only; use a directory for parquet.")
+    if fmt == "parquet":
+        try:
+            pd.io.parquet.get_engine("auto")
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow).")
+    tmp = out.with_name(out.name + ".tmp")
+    if tmp.is_dir():
+        shutil.rmtree(tmp)
+    ext = "parquet" if fmt == "parquet" else "csv"
+
+    total = 0
+    for k, df in enumerate(chunks):
+        total += len(df)
+        if single:
+            _write(df, tmp, fmt, append=k > 0)
+        elif partition_by == "none":
+            _write(df, tmp / f"part-{k:05d}.{ext}", fmt)
+        else:
+            if partition_by == "year":
+                key = df["deal_date"].str[:4]
+            else:
+                key = df[partition_by]
+            for value, part in df.groupby(key, sort=True):
+                safe = str(value).replace("/", "_")
+                _write(part, tmp / f"{partition_by}={safe}" / f"part-{k:05d}.{ext}", fmt)
+
+    if out.is_dir():
+        shutil.rmtree(out)
+    elif out.exists():
+        out.unlink()
+    tmp.replace(out)
+    print(f"Saved {total} rows → {out}")
+    return out
 
 def main():
-    rows = []
-    for city, n_list in CITIES:
-        for nhood in n_list:
-            for r in ROOMS:
-                base_size = 70 if r == 3.0 else (60 if r == 2.0 else 85)
-                rows.extend(gen_block(city, nhood, r,
-                                      base_size=base_size,
-                                      n_recent=20, years_back=10, bucket_span_days=720))
-    df = pd.DataFrame(rows).sample(frac=1, random_state=7)\
-                           .sort_values("deal_date", ascending=False)\
-                           .reset_index(drop=True)
-
-    out_dir = Path(__file__).resolve().parents[1] / "data"
-    out_dir.mkdir(parents=True, exist_ok=True)
-    out_path = out_dir / "transactions.csv"   # overwrite your current CSV
-    df.to_csv(out_path, index=False)
-    print(f"Saved {len(df)} rows → {out_path}")
+    p = argparse.ArgumentParser(description="Synthetic real-estate transactions generator")
+    p.add_argument("--rows", type=int, default=1_400)
+    p.add_argument("--cities", type=int, default=5)
+    p.add_argument("--neighborhoods", type=int, default=3, help="max neighborhoods per city (most popular city)")
+    p.add_argument("--city-skew", type=float, default=0.0, help="Zipf exponent of city popularity (0 = uniform)")
+    p.add_argument("--neigh-skew", type=float, default=0.0, help="Zipf exponent of neighborhood popularity")
+    p.add_argument("--wide-rooms", action="store_true", help="rooms 1–6 incl. halves instead of 2/3/4")
+    p.add_argument("--coords", action="store_true", help="add lat/lon columns (deals clustered per neighborhood)")
+    p.add_argument("--curve", type=parse_curve, default=None,
+                   help="appreciation curve 'year:rate,...' (default 1.6%%/year)")
+    p.add_argument("--growth-jitter", type=float, default=0.0, help="stdev of per-city annual rate offset")
+    p.add_argument("--outlier-rate", type=float, default=0.0, help="share of rows with a mis-keyed price")
+    p.add_argument("--years-back", type=int, default=10)
+    p.add_argument("--recent-bias", type=float, default=1.2, help=">1 puts more deals in recent years")
+    p.add_argument("--chunk-rows", type=int, default=1_000_000)
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--format", choices=("csv", "parquet"), default="csv")
+    p.add_argument("--partition-by", choices=("none", "year", "city"), default="none")
+    p.add_argument("--out", default=str(Path(__file__).resolve().parents[1] / "data" / "transactions.csv"))
+    args = p.parse_args()
+
+    chunks = generate(args.rows, cities=args.cities, max_neighborhoods=args.neighborhoods,
+                      chunk_rows=args.chunk_rows, seed=args.seed, curve=args.curve,
+                      growth_jitter=args.growth_jitter, outlier_rate=args.outlier_rate,
+                      years_back=args.years_back, recent_bias=args.recent_bias,
+                      city_skew=args.city_skew, neigh_skew=args.neigh_skew, wide_rooms=args.wide_rooms,
+                      coords=args.coords)
+    write_dataset(chunks, args.out, fmt=args.format, partition_by=args.partition_by)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
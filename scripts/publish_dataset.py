@@ -0,0 +1,20 @@
+# scripts/publish_dataset.py
+# Prepare the shared dataset once, before starting the API workers:
+#   python scripts/publish_dataset.py [data/transactions.csv]
+#   DATASET_MODE=shared uvicorn api.real_estate_api:app --workers 8
+# Every worker then memory-maps the same snapshot + index read-only.
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from dataset import publish_dataset
+
+def main():
+    default = Path(__file__).resolve().parents[1] / "data" / "transactions.csv"
+    csv_path = Path(sys.argv[1]) if len(sys.argv) > 1 else default
+    snap_dir = publish_dataset(csv_path)
+    print(f"Published {csv_path} → {snap_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# scripts/refresh_nadlan.py
+# Daily refresh of the Nadlan CloudFront JSONs (neighborhood index + settlement
+# pages) into the on-disk cache of gov_data_client. Unchanged pages are
+# revalidated with ETag / Last-Modified and cost a 304, not a download.
+#
+#   NADLAN_CACHE_DIR=data/nadlan_cache python scripts/refresh_nadlan.py [--settlements 5000 3000]
+#
+# Without --settlements, every settlement_id listed in the neighborhood index is refreshed.
+import argparse
+import os
+import sys
+from pathlib import Path
+
+root = Path(__file__).resolve().parents[1]
+os.environ.setdefault("NADLAN_CACHE_DIR", str(root / "data" / "nadlan_cache"))
+sys.path.append(str(root / "archived_providers"))
+
+from gov_data_client import _session_gov, nadlan_cache, list_neighborhood_index, get_settlement_page
+
+def main():
+    p = argparse.ArgumentParser(description="Refresh cached Nadlan index / settlement pages")
+    p.add_argument("--settlements", nargs="*", default=None, help="settlement ids (default: from the index)")
+    args = p.parse_args()
+
+    with _session_gov() as session:
+        index = list_neighborhood_index(session)
+        if index is None:
+            raise SystemExit("Could not fetch the neighborhood index.")
+        ids = args.settlements
+        if ids is None:
+            entries = index if isinstance(index, list) else []
+            ids = sorted({e["settlement_id"] for e in entries if isinstance(e, dict) and "settlement_id" in e})
+        failed = sum(get_settlement_page(i, session) is None for i in ids)
+
+    stats = nadlan_cache().stats
+    print(f"{len(ids)} settlement pages + index: {stats['fetched']} downloaded ({stats['bytes']} bytes), "
+          f"{stats['not_modified']} not modified, {failed} failed → {os.environ['NADLAN_CACHE_DIR']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# scripts/run_backtest.py
+# Backtest the fair-price band against history:
+#   python scripts/run_backtest.py [data/transactions.csv] [--since 2020-01-01] [--by year|city|scope] [--out scores.csv]
+# Every deal is re-scored as of its own date from the deals dated before it
+# (backtest.backtest_scores, O(n log n)); prints the hit rate of the
+# cheap / fair / expensive band and the fair-price error as JSON.
+# --out writes the per-deal scores.
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from backtest import backtest_report, backtest_scores
+from data_loader import load_transactions_csv
+
+def main():
+    p = argparse.ArgumentParser(description="Backtest fair prices against historical deals")
+    p.add_argument("csv", nargs="?", default=str(Path(__file__).resolve().parents[1] / "data" / "transactions.csv"))
+    p.add_argument("--since", type=datetime.fromisoformat, help="only re-score deals dated on or after (YYYY-MM-DD)")
+    p.add_argument("--by", choices=("year", "city", "scope"), help="also report per group")
+    p.add_argument("--out", help="write the per-deal scores to this CSV")
+    args = p.parse_args()
+
+    df = load_transactions_csv(args.csv)
+    t = time.perf_counter()
+    scores = backtest_scores(df, since=args.since)
+    print(f"[backtest] {len(scores)} deals re-scored in {time.perf_counter() - t:.1f}s", file=sys.stderr)
+    if args.out:
+        scores.to_csv(args.out, index=False)
+        print(f"[backtest] wrote {args.out}", file=sys.stderr)
+    print(json.dumps(backtest_report(scores, by=args.by), ensure_ascii=False, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# scripts/sync_ckan.py
+# Bulk / incremental sync of a data.gov.il (CKAN) datastore resource into a local CSV
+# plus its columnar snapshot (see src/ckan_sync.py). Safe to interrupt and re-run:
+# it resumes from the checkpoint next to the CSV (<out>.sync.json).
+#
+#   python scripts/sync_ckan.py --resource-id <id> [--out data/ckan/transactions.csv]
+#   python scripts/sync_ckan.py --resource-id <id> --mode watermark --watermark-field deal_date   # daily
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from ckan_sync import sync_resource
+from config import CKAN_PAGE_SIZE, CKAN_SYNC_CONCURRENCY
+
+def main():
+    p = argparse.ArgumentParser(description="Sync a CKAN datastore resource into a local CSV + snapshot")
+    p.add_argument("--resource-id", required=True)
+    p.add_argument("--out", default=str(Path(__file__).resolve().parents[1] / "data" / "ckan" / "transactions.csv"))
+    p.add_argument("--base-url", default=None, help="CKAN action API (default: DATA_GOV_BASE or data.gov.il)")
+    p.add_argument("--page-size", type=int, default=CKAN_PAGE_SIZE)
+    p.add_argument("--concurrency", type=int, default=CKAN_SYNC_CONCURRENCY)
+    p.add_argument("--mode", choices=("offset", "watermark"), default="offset",
+                   help="offset: concurrent bulk paging; watermark: only records newer than the last sync")
+    p.add_argument("--watermark-field", default="_id", help="_id or a date column such as deal_date")
+    p.add_argument("--no-snapshot", action="store_true", help="only update the CSV")
+    args = p.parse_args()
+
+    out = sync_resource(args.resource_id, args.out, base_url=args.base_url, page_size=args.page_size,
+                        concurrency=args.concurrency, snapshot=not args.no_snapshot,
+                        mode=args.mode, watermark_field=args.watermark_field)
+    if out["total"] is not None:
+        print(f"+{out['rows_added']} rows → {args.out} ({out['offset']}/{out['total']} synced)")
+    else:
+        print(f"+{out['rows_added']} rows → {args.out} ({out['offset']} rows, watermark {out['watermark']})")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,23 @@
 __all__ = [
     "config",
     "gov_data_client",
+    "ckan_sync",
     "data_loader",
+    "snapshot",
+    "sql_store",
+    "autocomplete",
+    "dataset",
+    "cache",
+    "metrics",
     "comps",
+    "segment_index",
+    "spatial_index",
+    "aggregates",
     "growth",
+    "heatmap",
     "pricing",
+    "context",
     "orchestrator",
+    "backtest",
     "utils_text",
 ]
\ No newline at end of file
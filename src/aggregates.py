@@ -0,0 +1,302 @@
+"""
+Aggregate cube: per (city_norm, neigh_norm, rooms, quarter) totals of
+count / sum / sum of squares of price_ils and price_per_sqm, plus the
+price_per_sqm quantile sketch buckets (sketches.QuantileSketch) of the same cell.
+Built once per dataset (groupbys), extended on ingest, and answers
+activity counts, area-level averages and area quantiles by lookup instead
+of row scans. Periods are encoded as year * 4 + (quarter - 1).
+"""
+from __future__ import annotations
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from segment_index import SegmentIndex, to_ns
+from sketches import QuantileSketch, bucket_of
+
+# columns of each cell array
+PERIOD, COUNT, SUM_PRICE, SUMSQ_PRICE, SUM_PPSQM, SUMSQ_PPSQM = range(6)
+_WIDTH = 6
+# columns of each sketch array
+S_PERIOD, S_BUCKET, S_COUNT = range(3)
+
+def period_of(ts) -> int:
+    ts = pd.Timestamp(ts)
+    return ts.year * 4 + (ts.quarter - 1)
+
+def period_start(period: int) -> datetime:
+    return datetime(period // 4, 3 * (period % 4) + 1, 1)
+
+def _opt_str(value) -> str | None:
+    return None if value is None or (isinstance(value, float) and np.isnan(value)) else str(value)
+
+class AggregateCube:
+    """
+    cells[(city, neigh, rooms)] → float64 array (n_periods × 6), sorted by period.
+    sketch_cells[key] → int64 array (n × 3) of (period, bucket, count), sorted.
+    Instances are not modified after construction; extend() returns a new cube.
+    """
+
+    def __init__(self, df: pd.DataFrame | None = None):
+        self.cells: dict[tuple, np.ndarray] = {}
+        self.sketch_cells: dict[tuple, np.ndarray] = {}
+        self.tag = None
+        if df is not None and len(df):
+            self.cells, self.sketch_cells = _build_cells(df)
+        self._by_city = _by_city(self.cells)
+
+    @classmethod
+    def from_frames(cls, frames) -> "AggregateCube":
+        """
+        Cube of all the rows of `frames`, built one frame at a time. Every
+        segment's rows must be in a single frame (e.g. one frame per city).
+        """
+        obj = cls()
+        for rows in frames:
+            cells, sketch_cells = _build_cells(rows)
+            obj.cells.update(cells)
+            obj.sketch_cells.update(sketch_cells)
+        obj._by_city = _by_city(obj.cells)
+        return obj
+
+    # ---------- maintenance ----------
+
+    def extend(self, rows: pd.DataFrame) -> "AggregateCube":
+        """New cube = self + rows (cost proportional to rows and the segments they touch)."""
+        if len(rows) == 0:
+            return self
+        cells, sketch_cells = dict(self.cells), dict(self.sketch_cells)
+        new_cells, new_sketches = _build_cells(rows)
+        for key, add in new_sketches.items():
+            cur = sketch_cells.get(key)
+            sketch_cells[key] = add if cur is None else _merge_sketch_rows(np.concatenate([cur, add]))
+        for key, add in new_cells.items():
+            cur = cells.get(key)
+            if cur is None:
+                cells[key] = add
+                continue
+            periods = np.union1d(cur[:, PERIOD], add[:, PERIOD])
+            merged = np.zeros((len(periods), _WIDTH))
+            merged[:, PERIOD] = periods
+            for part in (cur, add):
+                at = np.searchsorted(periods, part[:, PERIOD])
+                merged[at, 1:] += part[:, 1:]
+            cells[key] = merged
+        out = AggregateCube.__new__(AggregateCube)
+        out.cells = cells
+        out.sketch_cells = sketch_cells
+        out.tag = None
+        out._by_city = _by_city(cells)
+        return out
+
+    def save(self, path: str | Path, tag: dict | None = None) -> Path:
+        path = Path(path)
+        tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        keys = list(self.cells)
+        lengths = np.array([len(self.cells[k]) for k in keys], dtype=np.int64)
+        data = np.concatenate([self.cells[k] for k in keys]) if keys else np.zeros((0, _WIDTH))
+        np.save(tmp / "cells.npy", data, allow_pickle=False)
+        np.save(tmp / "lengths.npy", lengths, allow_pickle=False)
+        sketches = [self.sketch_cells.get(k, np.zeros((0, 3), dtype=np.int64)) for k in keys]
+        np.save(tmp / "sketch.npy", np.concatenate(sketches) if keys else np.zeros((0, 3), dtype=np.int64),
+                allow_pickle=False)
+        np.save(tmp / "sketch_lengths.npy", np.array([len(a) for a in sketches], dtype=np.int64), allow_pickle=False)
+        (tmp / "meta.json").write_text(json.dumps({"keys": keys, "tag": tag}, ensure_ascii=False))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path) -> "AggregateCube":
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text())
+        data = np.load(path / "cells.npy", allow_pickle=False)
+        lengths = np.load(path / "lengths.npy", allow_pickle=False)
+        bounds = np.r_[0, np.cumsum(lengths)]
+        obj = cls.__new__(cls)
+        obj.cells = {tuple(k): data[bounds[i]:bounds[i + 1]] for i, k in enumerate(meta["keys"])}
+        sketch = np.load(path / "sketch.npy", allow_pickle=False)
+        sbounds = np.r_[0, np.cumsum(np.load(path / "sketch_lengths.npy", allow_pickle=False))]
+        obj.sketch_cells = {tuple(k): sketch[sbounds[i]:sbounds[i + 1]] for i, k in enumerate(meta["keys"])}
+        obj.tag = meta.get("tag")
+        obj._by_city = _by_city(obj.cells)
+        return obj
+
+    # ---------- queries ----------
+
+    def keys(self, city_norm: str, neigh_norm: str | None = None, rooms: float | None = None) -> list[tuple]:
+        """Cell keys of a city, optionally narrowed to a neighborhood and/or rooms."""
+        return [k for k in self._by_city.get(city_norm, [])
+                if (neigh_norm is None or k[1] == neigh_norm) and (rooms is None or k[2] == rooms)]
+
+    def rollup(self, keys: list[tuple], period_from: int | None = None, period_to: int | None = None,
+               by: str | None = None) -> dict | list[dict]:
+        """
+        Totals over `keys` and periods [period_from, period_to] (inclusive).
+        by=None → one summary; by="year"/"quarter" → list of summaries, newest first.
+        Summary: n, mean/std of price_ils and price_per_sqm.
+        """
+        acc = {}
+        for k in keys:
+            cell = self.cells[k]
+            lo = 0 if period_from is None else np.searchsorted(cell[:, PERIOD], period_from, side="left")
+            hi = len(cell) if period_to is None else np.searchsorted(cell[:, PERIOD], period_to, side="right")
+            part = cell[lo:hi]
+            if by is None:
+                groups = np.zeros(len(part), dtype=np.int64)
+            elif by == "year":
+                groups = part[:, PERIOD].astype(np.int64) // 4
+            else:
+                groups = part[:, PERIOD].astype(np.int64)
+            for g in np.unique(groups):
+                tot = part[groups == g, 1:].sum(axis=0)
+                acc[int(g)] = acc[int(g)] + tot if int(g) in acc else tot
+        if by is None:
+            return _summary(acc.get(0, np.zeros(_WIDTH - 1)))
+        label = "year" if by == "year" else "quarter"
+        out = []
+        for g in sorted(acc, reverse=True):
+            s = _summary(acc[g])
+            s[label] = g if by == "year" else f"{g // 4}Q{g % 4 + 1}"
+            out.append(s)
+        return out
+
+    def sketch(self, keys: list[tuple], period_from: int | None = None,
+               period_to: int | None = None) -> QuantileSketch:
+        """price_per_sqm sketch over `keys` and periods [period_from, period_to], merged."""
+        parts = []
+        for k in keys:
+            cell = self.sketch_cells.get(k)
+            if cell is None:
+                continue
+            lo = 0 if period_from is None else np.searchsorted(cell[:, S_PERIOD], period_from, side="left")
+            hi = len(cell) if period_to is None else np.searchsorted(cell[:, S_PERIOD], period_to, side="right")
+            parts.append(cell[lo:hi])
+        if not parts:
+            return QuantileSketch()
+        rows = np.concatenate(parts)
+        return QuantileSketch.from_buckets(rows[:, S_BUCKET], rows[:, S_COUNT])
+
+    def area_sketch(self, city: str, neighborhood: str, rooms: float, period_from: int,
+                    min_n: int) -> tuple[str | None, QuantileSketch]:
+        """
+        Narrowest area with at least min_n deals since period_from, widening
+        neighborhood+rooms → neighborhood → city+rooms → city.
+        Returns (scope name, sketch); (None, empty sketch) when even the city has too few.
+        """
+        c, n, r = city.strip().lower(), neighborhood.strip().lower(), float(rooms)
+        for scope, neigh, rooms_ in (("neighborhood_rooms", n, r), ("neighborhood", n, None),
+                                     ("city_rooms", None, r), ("city", None, None)):
+            sk = self.sketch(self.keys(c, neigh, rooms_), period_from=period_from)
+            if sk.n >= min_n:
+                return scope, sk
+        return None, QuantileSketch()
+
+    def sales_counts(self, index: SegmentIndex, city: str, neighborhood: str, rooms: float,
+                     today: datetime | None = None) -> dict:
+        """
+        Same result as stats.sales_counts_at (deals in the last 5 years,
+        per year, newest first): whole quarters after the cutoff come from the
+        cube; the quarter containing the cutoff is counted exactly with the index.
+        """
+        today = today or datetime.utcnow()
+        cutoff = today - timedelta(days=5 * 365)
+        c, n, r = city.strip().lower(), neighborhood.strip().lower(), float(rooms)
+        cell = self.cells.get((c, n, r))
+        if cell is None:
+            return {"total": 0, "per_year": []}
+
+        first = period_of(cutoff)
+        per_year = {}
+        partial = index.count_dates(c, n, (r, r), to_ns(cutoff), to_ns(period_start(first + 1)))
+        if partial:
+            per_year[first // 4] = partial
+        lo = np.searchsorted(cell[:, PERIOD], first + 1, side="left")
+        for period, count in cell[lo:, [PERIOD, COUNT]]:
+            year = int(period) // 4
+            per_year[year] = per_year.get(year, 0) + int(count)
+
+        years = sorted((y for y in per_year if per_year[y] > 0), reverse=True)
+        return {
+            "total": int(sum(per_year[y] for y in years)),
+            "per_year": [{"year": y, "count": per_year[y]} for y in years],
+        }
+
+def _summary(tot: np.ndarray) -> dict:
+    n = int(tot[COUNT - 1])
+    if n == 0:
+        return {"n": 0, "mean_price_ils": None, "std_price_ils": None,
+                "mean_ppsqm": None, "std_ppsqm": None}
+    def mean_std(s, sq):
+        mean = s / n
+        var = max(sq / n - mean * mean, 0.0)
+        return float(mean), float(np.sqrt(var * n / (n - 1))) if n > 1 else 0.0
+    mp, sp = mean_std(tot[SUM_PRICE - 1], tot[SUMSQ_PRICE - 1])
+    mq, sq = mean_std(tot[SUM_PPSQM - 1], tot[SUMSQ_PPSQM - 1])
+    return {"n": n, "mean_price_ils": mp, "std_price_ils": sp, "mean_ppsqm": mq, "std_ppsqm": sq}
+
+def _merge_sketch_rows(rows: np.ndarray) -> np.ndarray:
+    """(period, bucket, count) rows → one row per (period, bucket), sorted."""
+    order = np.lexsort((rows[:, S_BUCKET], rows[:, S_PERIOD]))
+    rows = rows[order]
+    new = np.r_[True, (rows[1:, :2] != rows[:-1, :2]).any(axis=1)]
+    starts = np.flatnonzero(new)
+    out = rows[starts].copy()
+    out[:, S_COUNT] = np.add.reduceat(rows[:, S_COUNT], starts)
+    return out
+
+def _build_cells(df: pd.DataFrame) -> tuple[dict, dict]:
+    dates = pd.to_datetime(df["deal_date"], errors="coerce")
+    neigh = df["neigh_norm"] if "neigh_norm" in df.columns else pd.Series(None, index=df.index, dtype=object)
+    frame = pd.DataFrame({
+        "c": df["city_norm"].astype(object),
+        "n": neigh.astype(object),
+        "r": df["rooms"].astype(np.float64),
+        "p": dates.dt.year * 4 + dates.dt.quarter - 1,
+        "price": df["price_ils"].astype(np.float64),
+        "ppsqm": df["price_per_sqm"].astype(np.float64),
+    })
+    frame = frame.dropna(subset=["c", "r", "p", "price", "ppsqm"])
+    if "neigh_norm" in df.columns:
+        frame = frame.dropna(subset=["n"])
+    else:
+        frame["n"] = "\0"  # groupby drops None keys; mapped back to None below
+    frame["price2"] = frame["price"] ** 2
+    frame["ppsqm2"] = frame["ppsqm"] ** 2
+    agg = frame.groupby(["c", "n", "r", "p"], sort=True).agg(
+        count=("price", "size"), sum_price=("price", "sum"), sumsq_price=("price2", "sum"),
+        sum_ppsqm=("ppsqm", "sum"), sumsq_ppsqm=("ppsqm2", "sum"),
+    ).reset_index()
+
+    values = np.column_stack([agg["p"].to_numpy(np.float64), agg["count"].to_numpy(np.float64),
+                              agg[["sum_price", "sumsq_price", "sum_ppsqm", "sumsq_ppsqm"]].to_numpy(np.float64)])
+    cells = _split_by_key(agg, values)
+
+    pos = frame["ppsqm"] > 0
+    frame = frame[pos].assign(b=bucket_of(frame.loc[pos, "ppsqm"]))
+    sk = frame.groupby(["c", "n", "r", "p", "b"], sort=True).size().reset_index(name="count")
+    sketch_values = sk[["p", "b", "count"]].to_numpy(np.int64)
+    return cells, _split_by_key(sk, sketch_values)
+
+def _split_by_key(agg: pd.DataFrame, values: np.ndarray) -> dict:
+    """Rows of a frame sorted by (c, n, r, ...) → {(city, neigh, rooms): values[run]}."""
+    if len(agg) == 0:
+        return {}
+    cols = agg[["c", "n", "r"]]
+    starts = np.flatnonzero((cols != cols.shift()).any(axis=1).to_numpy())
+    out = {}
+    for a, b, c, n, r in zip(starts, np.r_[starts[1:], len(agg)], agg["c"].to_numpy()[starts],
+                             agg["n"].to_numpy()[starts], agg["r"].to_numpy()[starts]):
+        out[(str(c), None if n == "\0" else _opt_str(n), float(r))] = values[a:b]
+    return out
+
+def _by_city(cells: dict) -> dict:
+    out = {}
+    for key in cells:
+        out.setdefault(key[0], []).append(key)
+    return out
@@ -0,0 +1,251 @@
+"""
+Autocomplete for city and neighborhood names, so listings are entered with
+the exact names comps match on (city_norm / neigh_norm).
+Built once per dataset from its distinct (city, neighborhood) pairs:
+  - a prefix trie over every word-start of every folded name and alias
+    ("tel av", "aviv", "yafo" all reach Tel Aviv-Yafo); each node keeps the
+    places below it in rank order (deal count), so a lookup walks the typed
+    prefix and reads the first matches
+  - a trigram index over the folded names, for misspellings the trie cannot
+    reach (scored by trigram Jaccard similarity)
+Names are folded like utils_text.norm plus: niqqud / accents dropped,
+Hebrew final letters unified, punctuation (maqaf, geresh, quotes, dots)
+removed, whitespace collapsed. ALIAS_GROUPS lists equivalent Hebrew /
+English spellings; a place whose name is in a group gets the others as aliases.
+"""
+from __future__ import annotations
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+from config import AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_MIN_SIMILARITY
+from segment_index import group_codes
+from sql_store import SQLiteStore
+from utils_text import norm
+
+# Equivalent names (any language / spelling); matched on the folded form.
+ALIAS_GROUPS = [
+    # cities
+    ("Tel Aviv-Yafo", "Tel Aviv", "Tel Aviv Jaffa", "TLV", "תל אביב-יפו", "תל אביב יפו", "תל אביב"),
+    ("Jerusalem", "Yerushalayim", "ירושלים"),
+    ("Haifa", "Hefa", "חיפה"),
+    ("Rishon LeZion", "Rishon Lezion", "Rishon", "ראשון לציון"),
+    ("Ramat Gan", "רמת גן"),
+    ("Beer Sheva", "Be'er Sheva", "Beersheba", "באר שבע"),
+    ("Petah Tikva", "Petach Tikva", "פתח תקווה", "פתח תקוה"),
+    ("Netanya", "נתניה"),
+    ("Ashdod", "אשדוד"),
+    ("Holon", "חולון"),
+    ("Bnei Brak", "בני ברק"),
+    ("Herzliya", "הרצליה"),
+    ("Kfar Saba", "כפר סבא"),
+    ("Raanana", "Ra'anana", "רעננה"),
+    ("Rehovot", "רחובות"),
+    ("Bat Yam", "בת ים"),
+    ("Modiin", "Modi'in", "Modiin-Maccabim-Reut", "מודיעין", "מודיעין-מכבים-רעות"),
+    # neighborhoods
+    ("Old North", "Tzafon Yashan", "הצפון הישן"),
+    ("Florentin", "פלורנטין"),
+    ("Neve Tzedek", "Neve Zedek", "נווה צדק", "נוה צדק"),
+    ("Rehavia", "Rechavia", "רחביה"),
+    ("Katamon", "Qatamon", "קטמון"),
+    ("Talbiya", "Talbieh", "טלביה"),
+    ("Carmel Center", "Merkaz HaCarmel", "מרכז הכרמל"),
+    ("Hadar", "Hadar HaCarmel", "הדר", "הדר הכרמל"),
+    ("German Colony", "HaMoshava HaGermanit", "המושבה הגרמנית"),
+    ("Neve Dekalim", "נווה דקלים"),
+    ("Ramat Eliyahu", "רמת אליהו"),
+    ("Merom Nave", "מרום נווה"),
+    ("Ramat Chen", "Ramat Hen", "רמת חן"),
+    ("Borochov", "Borokhov", "בורוכוב"),
+]
+
+_FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+_DROP = re.compile(r"[\"'`׳״.,()]")           # quotes / geresh / gershayim glue letters together
+_SPACE = re.compile(r"[\s\-־–—_/]+")           # hyphens and maqaf separate words
+
+def fold(text: str) -> str:
+    """utils_text.norm plus the folding described in the module docstring."""
+    s = unicodedata.normalize("NFKD", norm(text))
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    s = _DROP.sub("", s.translate(_FINAL_LETTERS))
+    return _SPACE.sub(" ", s).strip()
+
+def trigrams(folded: str) -> set[str]:
+    """Word trigrams with two leading / one trailing blank per word (as pg_trgm)."""
+    out = set()
+    for word in folded.split():
+        padded = f"  {word} "
+        out.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return out
+
+def place_counts(df: pd.DataFrame | SQLiteStore) -> pd.DataFrame:
+    """
+    One row per distinct (city_norm, neigh_norm) of a transactions frame
+    (or SQLiteStore): city / neighborhood display names (first row's) and deal count n.
+    """
+    if isinstance(df, SQLiteStore):
+        return df.places()
+    keys = [k for k in ("city_norm", "neigh_norm") if k in df.columns]
+    valid = df[keys].notna().all(axis=1).to_numpy()
+    rows = df[keys].iloc[np.flatnonzero(valid)]
+    g, table = group_codes(rows, keys)
+    first = np.full(len(table), len(g))
+    np.minimum.at(first, g, np.arange(len(g)))
+    pos = np.flatnonzero(valid)[first]
+    out = table.reindex(columns=["city_norm", "neigh_norm"])
+    for name, key in (("city", "city_norm"), ("neighborhood", "neigh_norm")):
+        out[name] = df[name].to_numpy(dtype=object)[pos] if name in df.columns else out[key]
+    out["n"] = np.bincount(g, minlength=len(table))
+    return out
+
+class PlaceIndex:
+    """
+    Cities and neighborhoods of one dataset (see place_counts).
+    Entry ids are ranks: more deals first, then name.
+    """
+
+    def __init__(self, places: pd.DataFrame, alias_groups=ALIAS_GROUPS):
+        aliases = {}
+        for group in alias_groups:
+            for name in group:
+                aliases.setdefault(fold(name), []).extend(n for n in group if fold(n) != fold(name))
+
+        entries = {}
+        for r in places.itertuples(index=False):
+            city = (r.city_norm, None)
+            c = entries.setdefault(city, {"kind": "city", "city": r.city, "neighborhood": None,
+                                          "city_norm": r.city_norm, "neigh_norm": None, "n": 0})
+            c["n"] += int(r.n)
+            if r.neigh_norm is not None and r.neigh_norm == r.neigh_norm and r.neigh_norm not in ("", "nan"):
+                entries[(r.city_norm, r.neigh_norm)] = {
+                    "kind": "neighborhood", "city": r.city, "neighborhood": r.neighborhood,
+                    "city_norm": r.city_norm, "neigh_norm": r.neigh_norm, "n": int(r.n)}
+        self.entries = sorted(entries.values(), key=lambda e: (-e["n"], e["kind"], str(e["neigh_norm"] or e["city_norm"])))
+
+        # searchable names: (folded, as written, entry id, is_alias)
+        self.names = []
+        for i, e in enumerate(self.entries):
+            own = str(e["neighborhood"] if e["kind"] == "neighborhood" else e["city"])
+            seen = set()
+            for text, is_alias in [(own, False)] + [(a, True) for a in aliases.get(fold(own), [])]:
+                key = fold(text)
+                if key and key not in seen:
+                    seen.add(key)
+                    self.names.append((key, text, i, is_alias))
+
+        self._cities = {}  # folded city name or alias → city_norm
+        for key, _, i, _ in self.names:
+            if self.entries[i]["kind"] == "city":
+                self._cities.setdefault(key, self.entries[i]["city_norm"])
+
+        # per name / per entry arrays, so filtering and scoring are vectorized
+        self._name_entry = np.array([i for _, _, i, _ in self.names], dtype=np.int64)
+        self._entry_kind = np.array([e["kind"] == "neighborhood" for e in self.entries], dtype=np.int8)
+        city_codes, self._city_norms = pd.factorize(pd.Series([e["city_norm"] for e in self.entries], dtype=object))
+        self._entry_city = city_codes.astype(np.int64)
+
+        self._trie = {}  # char → child node; "" → name ids below (one per entry, in rank order)
+        for name_id, (key, _, i, _) in enumerate(self.names):
+            words = key.split(" ")
+            for w in range(len(words)):
+                node = self._trie
+                for ch in " ".join(words[w:]):
+                    node = node.setdefault(ch, {})
+                    node.setdefault("", []).append(name_id)
+        self._finish(self._trie)
+
+        postings = {}  # trigram → name ids
+        n_trigrams = []
+        for name_id, (key, _, _, _) in enumerate(self.names):
+            grams = trigrams(key)
+            n_trigrams.append(len(grams))
+            for t in grams:
+                postings.setdefault(t, []).append(name_id)
+        self._trigrams = {t: np.array(ids, dtype=np.int64) for t, ids in postings.items()}
+        self._n_trigrams = np.array(n_trigrams, dtype=np.int64)
+
+    def _finish(self, root: dict) -> None:
+        """Name ids per node → one name id per entry (its first name reaching the node), in rank order."""
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if "" in node:
+                best = {}
+                for name_id in node[""]:
+                    best.setdefault(self.names[name_id][2], name_id)
+                node[""] = np.array([best[i] for i in sorted(best)], dtype=np.int64)
+            stack.extend(v for k, v in node.items() if k)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _accepts(self, name_ids: np.ndarray, kind: str | None, city_code: int | None) -> np.ndarray:
+        """Mask of the names whose entry passes the kind / city filters."""
+        entries = self._name_entry[name_ids]
+        keep = np.ones(len(name_ids), dtype=bool)
+        if kind is not None:
+            keep &= self._entry_kind[entries] == (kind == "neighborhood")
+        if city_code is not None:
+            keep &= self._entry_city[entries] == city_code
+        return keep
+
+    def _result(self, name_id: int, match: str, score: float) -> dict:
+        _, text, i, _ = self.names[name_id]
+        return {**self.entries[i], "matched": text, "match": match, "score": score}
+
+    def resolve_city(self, text: str) -> str | None:
+        """city_norm of the city whose folded name or alias equals fold(text), else None."""
+        return self._cities.get(fold(text))
+
+    def suggest(self, query: str, kind: str | None = None, city: str | None = None,
+                limit: int = AUTOCOMPLETE_LIMIT) -> list[dict]:
+        """
+        Up to `limit` places for a partly typed name: prefix matches of any word
+        (rank order), then misspelling matches with trigram similarity
+        >= AUTOCOMPLETE_MIN_SIMILARITY (best first). kind: "city" | "neighborhood";
+        city restricts neighborhoods to one city (name or alias).
+        Each result is the entry plus "matched" (the name or alias that matched),
+        "match" ("prefix" | "fuzzy") and "score".
+        """
+        key = fold(query)
+        if not key or limit <= 0:
+            return []
+        city_code = None
+        if city:
+            city_norm = self.resolve_city(city)
+            if city_norm is None:
+                return []
+            city_code = int(self._city_norms.get_loc(city_norm))
+
+        node = self._trie
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                break
+        prefix = node[""] if node is not None else np.array([], dtype=np.int64)
+        prefix = prefix[self._accepts(prefix, kind, city_code)][:limit]
+        out = [self._result(n, "prefix", 1.0) for n in prefix.tolist()]
+        if len(out) >= limit:
+            return out
+
+        grams = trigrams(key)
+        hits = [self._trigrams[t] for t in grams if t in self._trigrams]
+        if not hits:
+            return out
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.names))
+        cand = np.flatnonzero(shared)
+        score = shared[cand] / (len(grams) + self._n_trigrams[cand] - shared[cand])
+        keep = (score >= AUTOCOMPLETE_MIN_SIMILARITY) & self._accepts(cand, kind, city_code)
+        keep &= ~np.isin(self._name_entry[cand], self._name_entry[prefix])
+        cand, score = cand[keep], score[keep]
+        order = np.lexsort((self._name_entry[cand], -score))  # best score, then rank
+        seen = set()
+        for j in order.tolist():
+            i = int(self._name_entry[cand[j]])
+            if i not in seen:  # an entry's best-scoring name only
+                seen.add(i)
+                out.append(self._result(int(cand[j]), "fuzzy", round(float(score[j]), 3)))
+                if len(out) >= limit:
+                    break
+        return out
@@ -0,0 +1,248 @@
+"""
+Historical backtest of the fair-price band.
+Every dated deal is re-scored as a listing (its city, neighborhood, rooms and
+size; asking = its price) as of its own date, from the deals dated before it
+only: what evaluate_listing(..., as_of=deal date) gives with the default
+pipeline (RECENT_SEARCH_MODE "fixed", exact rooms, no nearby or area fallback).
+
+One evaluate_listing per deal would rescan its segment every time (O(n²)
+over a long history). Here all deals are scored in one time-ordered pass:
+  - every deal gets a time rank (deal_date, same day by position as
+    recent_comps orders them), so "dated in [date - RECENT_YEARS, date)" is a
+    rank interval
+  - deals are laid out by (segment, size_sqm), so a listing's size-matching
+    candidates are one contiguous range
+  - a wavelet matrix over the time ranks in that layout counts the ranks of an
+    interval inside a range and returns the k-th largest rank below a bound
+    in O(log n), vectorized over all deals
+so picking the newest RECENT_MAX comps costs O(RECENT_MAX · log n) per deal and
+the backtest O(n log n). Fair ppsqm and the decision use the grouped / batch
+pricing functions (pricing.summarize_fair_ppsqm_grouped, decision_vs_asking_batch).
+"""
+from __future__ import annotations
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from config import (
+    SIZE_TOL, RECENT_YEARS, RECENT_MIN, RECENT_MAX, MARGIN_PCT,
+    ROOMS_MATCH_MODE, REQUIRE_SAME_NEIGHBORHOOD, BACKTEST_CHUNK_ROWS,
+)
+from pricing import summarize_fair_ppsqm_grouped, decision_vs_asking_batch
+from segment_index import NAT_NS, to_ns, _date_ns
+
+_DAY_NS = 86_400 * 10**9
+
+class _WaveletMatrix:
+    """
+    Wavelet matrix over ints in [0, 2**bits): per bit level (high to low) the
+    prefix count of 1 bits, values stably partitioned by that bit for the next.
+    Queries take arrays of position ranges [a, b) and run level by level.
+    """
+
+    def __init__(self, values: np.ndarray, bits: int):
+        n = len(values)
+        self.levels = list(range(bits - 1, -1, -1))
+        self.ones, self.zeros = [], []
+        cur = values
+        for level in self.levels:
+            bit = (cur >> level) & 1
+            ones = np.zeros(n + 1, dtype=np.int32 if n < 2**31 else np.int64)
+            np.cumsum(bit, out=ones[1:])
+            self.ones.append(ones)
+            self.zeros.append(n - int(ones[-1]))
+            cur = np.concatenate([cur[bit == 0], cur[bit == 1]])
+
+    def count_less(self, a: np.ndarray, b: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """Number of values < x among positions [a, b)."""
+        out = np.zeros(len(a), dtype=np.int64)
+        for level, ones, zeros in zip(self.levels, self.ones, self.zeros):
+            oa, ob = ones[a], ones[b]
+            up = ((x >> level) & 1).astype(bool)
+            out += np.where(up, (b - a) - (ob - oa), 0)  # this bit 0 → below x
+            a = np.where(up, zeros + oa, a - oa)
+            b = np.where(up, zeros + ob, b - ob)
+        return out
+
+    def kth_smallest(self, a: np.ndarray, b: np.ndarray, k: np.ndarray) -> np.ndarray:
+        """k-th smallest value (0-based) among positions [a, b); requires k < b - a."""
+        out = np.zeros(len(a), dtype=np.int64)
+        for level, ones, zeros in zip(self.levels, self.ones, self.zeros):
+            oa, ob = ones[a], ones[b]
+            n_zero = (b - a) - (ob - oa)
+            up = k >= n_zero
+            k = np.where(up, k - n_zero, k)
+            out |= up.astype(np.int64) << level
+            a = np.where(up, zeros + oa, a - oa)
+            b = np.where(up, zeros + ob, b - ob)
+        return out
+
+def _newest_comps(p_seg, p_size, p_rank, q_seg, q_size, q_from, q_to) -> tuple[np.ndarray, np.ndarray]:
+    """
+    For each query: the points of segment q_seg within ±SIZE_TOL of q_size whose
+    time rank is in [q_from, q_to), newest first, RECENT_MAX if there are that
+    many, else RECENT_MIN, else all (recent_comps' rule).
+    Returns (point ids (n_queries, RECENT_MAX), -1 padded, n_comps).
+    """
+    order = np.lexsort((p_size, p_seg))
+    seg_s, size_s, rank_s = p_seg[order], p_size[order], p_rank[order]
+    lo, hi = q_size * (1 - SIZE_TOL), q_size * (1 + SIZE_TOL)
+    # sizes and bounds ranked together, so (segment, size) is one exact int key
+    grid = np.unique(np.concatenate([size_s, lo, hi]))
+    key_s = seg_s * len(grid) + np.searchsorted(grid, size_s)
+    a = np.searchsorted(key_s, q_seg * len(grid) + np.searchsorted(grid, lo), side='left')
+    b = np.searchsorted(key_s, q_seg * len(grid) + np.searchsorted(grid, hi), side='right')
+
+    # chunks of whole segments (queries never cross one), bounding the matrix size
+    seg_starts = np.flatnonzero(np.r_[True, seg_s[1:] != seg_s[:-1]]) if len(seg_s) else np.array([], dtype=np.int64)
+    bounds, last = [0], 0
+    for s in seg_starts[1:]:
+        if s - last >= BACKTEST_CHUNK_ROWS:
+            bounds.append(int(s))
+            last = s
+    bounds.append(len(seg_s))
+
+    comps = np.full((len(q_seg), RECENT_MAX), -1, dtype=np.int64)
+    n_comps = np.zeros(len(q_seg), dtype=np.int64)
+    chunk_of = np.searchsorted(bounds, a, side='right') - 1
+    for c, (c0, c1) in enumerate(zip(bounds[:-1], bounds[1:])):
+        q = np.flatnonzero((chunk_of == c) & (b > a))
+        if len(q) == 0:
+            continue
+        ranks = np.sort(rank_s[c0:c1])
+        wm = _WaveletMatrix(np.searchsorted(ranks, rank_s[c0:c1]), max(1, (c1 - c0).bit_length()))
+        qa, qb = a[q] - c0, b[q] - c0
+        below_to = wm.count_less(qa, qb, np.searchsorted(ranks, q_to[q]))
+        n = below_to - wm.count_less(qa, qb, np.searchsorted(ranks, q_from[q]))
+        take = np.where(n >= RECENT_MAX, RECENT_MAX, np.where(n >= RECENT_MIN, RECENT_MIN, n))
+        n_comps[q] = take
+        for j in range(RECENT_MAX):
+            act = np.flatnonzero(take > j)
+            if len(act) == 0:
+                break
+            local = wm.kth_smallest(qa[act], qb[act], below_to[act] - 1 - j)
+            comps[q[act], j] = ranks[local]
+    return comps, n_comps
+
+def backtest_scores(df: pd.DataFrame, since: datetime | None = None) -> pd.DataFrame:
+    """
+    Re-score every deal with a date, size and price (dated on or after `since`,
+    if given) as of its own date. One row per deal:
+      position, deal_date, city, neighborhood, rooms, size_sqm, price_ils,
+      scope ("segment", or "city" when the neighborhood had no earlier deal),
+      n_comps, fair_ppsqm, fair_price, label, diff_pct (price vs fair, as in
+      the decision), error_pct ((fair_price - price) / price).
+    Deals without comps get n_comps 0, no label and NaN prices.
+    """
+    if ROOMS_MATCH_MODE != "exact":
+        raise ValueError("backtest_scores supports ROOMS_MATCH_MODE='exact' only.")
+    n = len(df)
+    city, _ = pd.factorize(df['city_norm'])
+    if 'neigh_norm' in df.columns:
+        neigh, neigh_uni = pd.factorize(df['neigh_norm'])
+    else:
+        neigh, neigh_uni = np.zeros(n, dtype=np.int64), [None]
+    room, room_uni = pd.factorize(df['rooms'])
+    city, neigh, room = city.astype(np.int64), neigh.astype(np.int64), room.astype(np.int64)
+    size = df['size_sqm'].to_numpy(dtype=np.float64)
+    price = df['price_ils'].to_numpy(dtype=np.float64)
+    ppsqm = df['price_per_sqm'].to_numpy(dtype=np.float64)
+    dates = _date_ns(df)
+
+    # rows a SegmentIndex holds, with a date; comps also need a size
+    valid = (city >= 0) & (neigh >= 0) & (room >= 0) & (dates != NAT_NS)
+    points = np.flatnonzero(valid & ~np.isnan(size))
+    queries = np.flatnonzero(valid & (size > 0) & (price > 0)
+                             & (dates >= (to_ns(since) if since is not None else NAT_NS + 1)))
+
+    # time rank: deal_date, same day by position descending (so newest first = rank descending, position ascending)
+    by_time = points[np.lexsort((-points, dates[points]))]
+    rank = np.empty(n, dtype=np.int64)
+    rank[by_time] = np.arange(len(by_time))
+    time_sorted = dates[by_time]
+    q_date = dates[queries]
+    q_to = np.searchsorted(time_sorted, q_date, side='left')
+    q_from = np.searchsorted(time_sorted, q_date - RECENT_YEARS * 365 * _DAY_NS, side='left')
+
+    # neighborhood known as of the deal: any earlier dated deal of it (any rooms, any size)
+    n_neigh, n_rooms = max(len(neigh_uni), 1), max(len(room_uni), 1)
+    neigh_key = city * n_neigh + neigh
+    held = np.flatnonzero(valid)
+    first_date = pd.Series(dates[held]).groupby(neigh_key[held]).min()
+    first = first_date.reindex(neigh_key[queries]).to_numpy()
+    known = REQUIRE_SAME_NEIGHBORHOOD & (first < q_date)
+
+    comps = np.full((len(queries), RECENT_MAX), -1, dtype=np.int64)
+    n_comps = np.zeros(len(queries), dtype=np.int64)
+    for scoped, seg_key in ((known, neigh_key * n_rooms + room), (~known, city * n_rooms + room)):
+        q = np.flatnonzero(scoped)
+        if len(q) == 0:
+            continue
+        codes, _ = pd.factorize(np.concatenate([seg_key[points], seg_key[queries[q]]]))
+        p_seg, q_seg = codes[:len(points)], codes[len(points):]
+        found, n_found = _newest_comps(p_seg, size[points], rank[points], q_seg, size[queries[q]],
+                                       q_from[q], q_to[q])
+        comps[q] = np.where(found >= 0, by_time[np.maximum(found, 0)], -1)
+        n_comps[q] = n_found
+
+    comp_ppsqm = np.where(comps >= 0, ppsqm[np.maximum(comps, 0)], np.nan)
+    summary = summarize_fair_ppsqm_grouped(np.repeat(np.arange(len(queries)), RECENT_MAX), comp_ppsqm.ravel(),
+                                           len(queries))
+    q_size, q_price = size[queries], price[queries]
+    dec = decision_vs_asking_batch(summary["fair_ppsqm"], q_size, q_price, MARGIN_PCT)
+    scored = summary["n"] > 0
+    fair_price = np.where(scored, summary["fair_ppsqm"] * q_size, np.nan)
+
+    def names(*columns):
+        found = [c for c in columns if c in df.columns]
+        return df[found[0]].to_numpy(dtype=object)[queries] if found else None
+
+    return pd.DataFrame({
+        "position": queries,
+        "deal_date": pd.to_datetime(df['deal_date'], errors='coerce').to_numpy()[queries],
+        "city": names('city', 'city_norm'),
+        "neighborhood": names('neighborhood', 'neigh_norm'),
+        "rooms": df['rooms'].to_numpy(dtype=np.float64)[queries],
+        "size_sqm": q_size,
+        "price_ils": q_price,
+        "scope": np.where(known, "segment", "city"),
+        "n_comps": n_comps,
+        "fair_ppsqm": np.where(scored, summary["fair_ppsqm"], np.nan),
+        "fair_price": fair_price,
+        "label": np.where(scored, dec["label"], None),
+        "diff_pct": np.where(scored, dec["diff_pct"], np.nan),
+        "error_pct": (fair_price - q_price) / q_price * 100.0,
+    })
+
+def _summary(scores: pd.DataFrame) -> dict:
+    scored = scores[scores["label"].notna()]
+    out = {"n_deals": len(scores), "n_scored": len(scored),
+           "coverage": round(len(scored) / len(scores), 4) if len(scores) else None}
+    if len(scored) == 0:
+        return out
+    labels = scored["label"].value_counts(normalize=True)
+    err = scored["error_pct"].to_numpy(dtype=np.float64)
+    out["band"] = {
+        "hit_rate": round(float(labels.get("fair", 0.0)), 4),   # price inside the fair range
+        "cheap": round(float(labels.get("cheap", 0.0)), 4),     # price below it
+        "expensive": round(float(labels.get("expensive", 0.0)), 4),
+    }
+    out["fair_price"] = {
+        "mape_pct": round(float(np.mean(np.abs(err))), 3),
+        "median_ape_pct": round(float(np.median(np.abs(err))), 3),
+        "bias_pct": round(float(np.median(err)), 3),            # > 0: fair price above the deal price
+        "within_10pct": round(float(np.mean(np.abs(err) <= 10.0)), 4),
+    }
+    return out
+
+def backtest_report(scores: pd.DataFrame, by: str | None = None) -> dict:
+    """
+    Hit rate of the cheap / fair / expensive band (share of deals whose price
+    falls inside the fair range) and error of the fair price over backtest_scores,
+    overall and, with by="year" | "city" | "scope", per group.
+    """
+    report = _summary(scores)
+    if by is not None:
+        key = scores["deal_date"].dt.year if by == "year" else scores[by]
+        report["by_" + by] = [{by: k if not isinstance(k, np.generic) else k.item(), **_summary(g)}
+                              for k, g in scores.groupby(key, sort=True)]
+    return report
@@ -0,0 +1,283 @@
+"""
+Bulk, resumable sync of a CKAN datastore resource (data.gov.il) into a local CSV.
+
+mode="offset" (bulk):
+Pages of datastore_search (sorted by _id) are fetched concurrently by asyncio
+workers over one pooled, retrying requests.Session, at most CKAN_SYNC_CONCURRENCY
+at a time and never more than a few pages ahead of what is written. Pages are
+appended to the CSV in offset order as soon as they are contiguous, and a
+checkpoint (offset, last _id, file size) is saved after every write, so an
+interrupted sync resumes where it stopped and a finished one only fetches rows
+added since. The columnar snapshot is then built from the CSV by the chunked
+loader (data_loader.load_transactions_csv), so no full DataFrame is ever held.
+
+mode="watermark" (daily refresh): datastore_search_sql with keyset paging
+from the checkpoint's watermark, so only newer records are read and the server
+never skips over an OFFSET. The watermark is the last _id, or the latest value
+of a date field (e.g. deal_date) seen so far: then records on that date are
+fetched again and the ones already stored (row hashes kept in the checkpoint)
+are skipped, which also catches deals reported late for the boundary day and
+survives a republished resource whose _ids changed. Pages are sequential here
+(each one starts after the previous page's last key).
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import json
+import os
+from collections import Counter
+from pathlib import Path
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import CKAN_PAGE_SIZE, CKAN_SYNC_CONCURRENCY, CKAN_TIMEOUT_S
+
+DATA_GOV_BASE = os.getenv("DATA_GOV_BASE", "https://data.gov.il/api/3/action").rstrip("/")
+SKIP_FIELDS = {"_id", "_full_text", "rank"}
+WINDOW_PAGES = 4  # pages a worker may run ahead of the write position, per worker
+
+def checkpoint_path_for(out_csv: str | Path) -> Path:
+    p = Path(out_csv)
+    return p.with_name(p.name + ".sync.json")
+
+def pooled_session(pool_size: int = CKAN_SYNC_CONCURRENCY) -> requests.Session:
+    """Session whose pool keeps one connection per worker, retrying transient errors."""
+    s = requests.Session()
+    retry = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+def fetch_page(session: requests.Session, base_url: str, resource_id: str, offset: int,
+               limit: int, include_total: bool = False) -> dict:
+    """One datastore_search page in _id order (the CKAN "result" object)."""
+    params = {"resource_id": resource_id, "offset": offset, "limit": limit, "sort": "_id asc",
+              "include_total": str(include_total).lower()}
+    r = session.get(f"{base_url}/datastore_search", params=params, timeout=CKAN_TIMEOUT_S)
+    r.raise_for_status()
+    data = r.json()
+    if not data.get("success"):
+        raise RuntimeError(f"CKAN success=false. Payload: {data}")
+    return data["result"]
+
+def fetch_sql(session: requests.Session, base_url: str, sql: str) -> dict:
+    """datastore_search_sql (the CKAN "result" object)."""
+    r = session.get(f"{base_url}/datastore_search_sql", params={"sql": sql}, timeout=CKAN_TIMEOUT_S)
+    r.raise_for_status()
+    data = r.json()
+    if not data.get("success"):
+        raise RuntimeError(f"CKAN success=false. Payload: {data}")
+    return data["result"]
+
+def _quote(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _row_key(record: dict) -> str:
+    """Content hash of a record without its _id (stable across republishing)."""
+    raw = json.dumps({k: v for k, v in record.items() if k not in SKIP_FIELDS}, sort_keys=True,
+                     ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+def _load_checkpoint(path: Path, resource_id: str) -> dict | None:
+    try:
+        ckpt = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+    return ckpt if ckpt.get("resource_id") == resource_id else None
+
+def _save_checkpoint(path: Path, ckpt: dict) -> None:
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    tmp.write_text(json.dumps(ckpt, ensure_ascii=False))
+    os.replace(tmp, path)
+
+def _columns(fields: list[dict]) -> list[str]:
+    """CSV header from the resource fields; _id becomes tx_id unless the resource has one."""
+    names = [f["id"] for f in fields if f["id"] not in SKIP_FIELDS]
+    return names if "tx_id" in names else ["tx_id"] + names
+
+def _frame(records: list[dict], columns: list[str]) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(records)
+    if "tx_id" not in df.columns and "_id" in df.columns:
+        df["tx_id"] = "ckan-" + df["_id"].astype(str)
+    return df.reindex(columns=columns)
+
+class _Writer:
+    """
+    Appends pages in offset order and checkpoints after each write, keeping
+    the last _id and, with watermark_field, that field's latest value plus the
+    row hashes stored for it (in any page order: the watermark is a running max).
+    """
+
+    def __init__(self, out_csv: Path, ckpt_path: Path, ckpt: dict, page_size: int,
+                 watermark_field: str | None = None):
+        self.out_csv = out_csv
+        self.ckpt_path = ckpt_path
+        self.ckpt = ckpt
+        self.page_size = page_size
+        self.watermark_field = watermark_field if watermark_field != "_id" else None
+        self.pending = {}  # offset → records fetched ahead of the write position
+        self.rows = 0
+        self.finished = False
+
+    def add(self, offset: int, records: list[dict]) -> None:
+        self.pending[offset] = records
+        while not self.finished and self.ckpt["offset"] in self.pending:
+            recs = self.pending.pop(self.ckpt["offset"])
+            if recs:
+                self.append(recs)
+            if len(recs) < self.page_size:  # short page: the end of the resource
+                self.finished = True
+                self.pending.clear()
+
+    def append(self, records: list[dict]) -> None:
+        df = _frame(records, self.ckpt["columns"])
+        with open(self.out_csv, "a", encoding="utf-8", newline="") as f:
+            df.to_csv(f, header=self.ckpt["bytes"] == 0, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+            self.ckpt["bytes"] = f.tell()
+        self.ckpt["offset"] += len(records)
+        ids = [r["_id"] for r in records if r.get("_id") is not None]
+        if ids:
+            self.ckpt["last_id"] = max(ids + [self.ckpt["last_id"] or 0])
+        if self.watermark_field:
+            self._advance_watermark(records)
+        self.rows += len(records)
+        _save_checkpoint(self.ckpt_path, self.ckpt)
+
+    def _advance_watermark(self, records: list[dict]) -> None:
+        field = self.watermark_field
+        values = [r.get(field) for r in records if r.get(field) not in (None, "")]
+        if not values:
+            return
+        top = max(values)
+        wm = self.ckpt.get("watermarks", {}).get(field)
+        keys = Counter(_row_key(r) for r in records if r.get(field) == top)
+        if wm is None or top > wm["value"]:
+            wm = {"value": top, "boundary": dict(keys)}
+        elif top == wm["value"]:
+            wm["boundary"] = dict(Counter(wm["boundary"]) + keys)
+        self.ckpt.setdefault("watermarks", {})[field] = wm
+
+async def _sync(session: requests.Session, base_url: str, resource_id: str, writer: _Writer,
+                total: int, concurrency: int) -> None:
+    page_size = writer.page_size
+    state = {"next": writer.ckpt["offset"]}
+    window = concurrency * WINDOW_PAGES * page_size
+    cond = asyncio.Condition()
+
+    def done() -> bool:
+        return writer.finished or state["next"] >= total or writer.ckpt["offset"] >= total
+
+    async def worker():
+        while True:
+            async with cond:
+                await cond.wait_for(lambda: done() or state["next"] < writer.ckpt["offset"] + window)
+                if done():
+                    return
+                offset = state["next"]
+                state["next"] += page_size
+            result = await asyncio.to_thread(fetch_page, session, base_url, resource_id, offset, page_size)
+            async with cond:
+                writer.add(offset, result["records"])
+                cond.notify_all()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+
+def _sync_watermark(session: requests.Session, base_url: str, resource_id: str, writer: _Writer,
+                    field: str) -> None:
+    """Keyset-paged datastore_search_sql from the checkpoint's watermark on `field`."""
+    table, page_size = f'"{resource_id}"', writer.page_size
+    if field == "_id":
+        where, order = f'"_id" > {int(writer.ckpt["last_id"] or 0)}', '"_id"'
+        wm = None
+    else:
+        wm = writer.ckpt.get("watermarks", {}).get(field)
+        where = f'"{field}" >= {_quote(wm["value"])}' if wm else f'"{field}" IS NOT NULL'
+        order = f'"{field}", "_id"'
+    skip = Counter(wm["boundary"]) if wm else Counter()
+    while True:
+        records = fetch_sql(session, base_url, f"SELECT * FROM {table} WHERE {where} ORDER BY {order} "
+                                               f"LIMIT {page_size}")["records"]
+        new = []
+        for r in records:
+            key = _row_key(r) if skip and r.get(field) == wm["value"] else None
+            if key is not None and skip[key] > 0:
+                skip[key] -= 1  # stored by an earlier sync
+            else:
+                new.append(r)
+        if new:
+            writer.append(new)
+        if len(records) < page_size:
+            return
+        last = records[-1]
+        if field == "_id":
+            where = f'"_id" > {int(last["_id"])}'
+        else:
+            v = _quote(last[field])
+            where = f'("{field}" > {v} OR ("{field}" = {v} AND "_id" > {int(last["_id"])}))'
+
+def sync_resource(resource_id: str, out_csv: str | Path, base_url: str | None = None,
+                  page_size: int = CKAN_PAGE_SIZE, concurrency: int = CKAN_SYNC_CONCURRENCY,
+                  snapshot: bool = True, mode: str = "offset", watermark_field: str = "_id") -> dict:
+    """
+    Fetch the rows of `resource_id` not yet in out_csv (all of them on the first
+    run) and append them.
+      - mode="offset": concurrent datastore_search pages after the checkpoint
+        offset; assumes an append-only resource whose rows are never reordered.
+      - mode="watermark": records after the checkpoint's watermark on
+        watermark_field ("_id" or a date column, see the module docstring).
+    Either mode keeps the watermark of watermark_field up to date, so a bulk
+    offset sync can be followed by watermark refreshes.
+    With snapshot=True the columnar snapshot of out_csv is refreshed afterwards.
+    Returns {"rows_added", "total" (offset mode), "offset" (rows stored), "last_id", "watermark"}.
+    """
+    if mode not in ("offset", "watermark"):
+        raise ValueError(f"Unknown sync mode: {mode!r}")
+    base_url = (base_url or DATA_GOV_BASE).rstrip("/")
+    out_csv = Path(out_csv)
+    out_csv.parent.mkdir(parents=True, exist_ok=True)
+    ckpt_path = checkpoint_path_for(out_csv)
+    ckpt = _load_checkpoint(ckpt_path, resource_id) if out_csv.exists() else None
+
+    with pooled_session(concurrency) as session:
+        first = fetch_page(session, base_url, resource_id, ckpt["offset"] if ckpt else 0, 0, include_total=True)
+        total = int(first.get("total", 0))
+        if ckpt is None:
+            ckpt = {"resource_id": resource_id, "offset": 0, "bytes": 0,
+                    "last_id": None, "columns": _columns(first.get("fields", []))}
+            out_csv.unlink(missing_ok=True)
+        elif out_csv.stat().st_size != ckpt["bytes"]:
+            # a write interrupted after its last checkpoint: drop the partial tail
+            with open(out_csv, "r+b") as f:
+                f.truncate(ckpt["bytes"])
+        writer = _Writer(out_csv, ckpt_path, ckpt, page_size, watermark_field)
+        if mode == "watermark":
+            if watermark_field != "_id" and ckpt["offset"] and watermark_field not in ckpt.get("watermarks", {}):
+                raise ValueError(f"{out_csv} has no {watermark_field!r} watermark yet; "
+                                 f"run one sync with watermark_field={watermark_field!r} first.")
+            _sync_watermark(session, base_url, resource_id, writer, watermark_field)
+        elif ckpt["offset"] < total:
+            asyncio.run(_sync(session, base_url, resource_id, writer, total, concurrency))
+        _save_checkpoint(ckpt_path, ckpt)
+
+    if snapshot and writer.rows:
+        from data_loader import load_transactions_csv
+        load_transactions_csv(str(out_csv))
+    wm = ckpt.get("watermarks", {}).get(watermark_field)
+    return {"rows_added": writer.rows, "total": total if mode == "offset" else None, "offset": ckpt["offset"],
+            "last_id": ckpt["last_id"], "watermark": ckpt["last_id"] if watermark_field == "_id" else wm and wm["value"]}
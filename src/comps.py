@@ -1,97 +1,396 @@
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
 from typing import List, Dict
 from config import (
     SIZE_TOL, RECENT_YEARS, RECENT_MIN, RECENT_MAX,
     BUCKET_SPAN_DAYS, REQUIRE_SAME_NEIGHBORHOOD,
     ROOMS_MATCH_MODE, ROOMS_TOL,
-    LONGTERM_YEARS, BUCKET_SAMPLES_PER_BUCKET
+    LONGTERM_YEARS, BUCKET_SAMPLES_PER_BUCKET,
+    SPATIAL_K, SPATIAL_RADIUS_M,
+    WIDEN_ORDER, WIDEN_SIZE_TOLS, WIDEN_ROOMS_TOLS, WIDEN_RECENT_YEARS
 )
+from segment_index import NAT_NS, SegmentIndex, to_ns, _date_ns, before, dates_at, equals_at
+from sql_store import SQLiteStore
 
-def _apply_match_filters(df: pd.DataFrame, city: str, neighborhood: str,
-                         rooms: float, size_sqm: float) -> pd.DataFrame:
+_BATCH_CELLS = 4_000_000
+
+def _rooms_range(rooms: float) -> tuple[float, float]:
+    if ROOMS_MATCH_MODE == "exact":
+        return rooms, rooms
+    return rooms - ROOMS_TOL, rooms + ROOMS_TOL
+
+def segment_positions(df: pd.DataFrame, city: str, neighborhood: str, rooms: float,
+                      index: SegmentIndex | None = None, as_of: datetime | None = None) -> np.ndarray:
+    """
+    Positions of the segment_rows rows, ascending (frame order).
+    Without an index the filters run on the columns' arrays; no rows are copied.
+    With as_of only rows dated before it count, for the neighborhood fallback too.
+    """
+    city_norm = str(city).lower().strip()
+    neigh_norm = str(neighborhood).lower().strip()
+    if index is not None:
+        return index.lookup(city_norm, _neighborhood_scope(index, city_norm, neigh_norm, as_of), _rooms_range(rooms),
+                            date_to=as_of)
+
+    pos = np.flatnonzero(equals_at(df['city_norm'], city_norm))
+    if as_of is not None:
+        pos = pos[before(dates_at(df, pos), as_of)]
+    if REQUIRE_SAME_NEIGHBORHOOD and 'neigh_norm' in df.columns:
+        sub = pos[equals_at(df['neigh_norm'], neigh_norm, pos)]
+        if len(sub) >= 1:
+            pos = sub
+
+    r = df['rooms'].to_numpy()[pos]
+    lo, hi = _rooms_range(rooms)
+    if ROOMS_MATCH_MODE == "exact":
+        return pos[r == rooms]
+    return pos[(r >= lo) & (r <= hi)]
+
+def segment_rows(df: pd.DataFrame, city: str, neighborhood: str, rooms: float,
+                 index: SegmentIndex | None = None) -> pd.DataFrame:
     """
-    Core comparable filters:
+    Segment filters (everything except size):
       - City: must match (normalized)
       - Neighborhood: keep if configured and available (fallback to city if none)
-      - Size within ±SIZE_TOL
       - Rooms: **EXACT** (per requirement), unless config changed
+    Rows keep the frame order of `df`.
     """
+    if isinstance(df, SQLiteStore):
+        city_norm = str(city).lower().strip()
+        neigh_norm = str(neighborhood).lower().strip()
+        return df.rows(city_norm, _neighborhood_scope(df, city_norm, neigh_norm), _rooms_range(rooms))
+    return df.iloc[segment_positions(df, city, neighborhood, rooms, index=index)]
+
+def size_positions(rows: pd.DataFrame, pos: np.ndarray, size_sqm: float) -> np.ndarray:
+    """The positions in pos whose row is within ±SIZE_TOL of size_sqm."""
+    sizes = rows['size_sqm'].to_numpy()[pos]
+    return pos[(sizes >= size_sqm * (1 - SIZE_TOL)) & (sizes <= size_sqm * (1 + SIZE_TOL))]
+
+def neighborhood_has_deals(df: pd.DataFrame, city: str, neighborhood: str,
+                           index: SegmentIndex | None = None, as_of: datetime | None = None) -> bool:
     city_norm = str(city).lower().strip()
     neigh_norm = str(neighborhood).lower().strip()
+    if index is not None:
+        return index.has_neighborhood(city_norm, neigh_norm, date_to=as_of)
+    if isinstance(df, SQLiteStore):
+        return df.has_neighborhood(city_norm, neigh_norm, date_to=as_of)
+    if 'neigh_norm' not in df.columns:
+        return False
+    pos = np.flatnonzero(equals_at(df['city_norm'], city_norm) & equals_at(df['neigh_norm'], neigh_norm))
+    return bool(len(pos) if as_of is None else before(dates_at(df, pos), as_of).any())
 
-    base = df[df['city_norm'] == city_norm].copy()
-    if REQUIRE_SAME_NEIGHBORHOOD and 'neigh_norm' in base.columns:
-        sub = base[base['neigh_norm'] == neigh_norm]
-        if len(sub) >= 1:
-            base = sub
+def nearby_positions(spatial, city: str, rooms: float, size_sqm: float,
+                     lat: float, lon: float, today: datetime | None = None,
+                     as_of: datetime | None = None) -> np.ndarray:
+    """
+    Size-matching deals of the city nearest to (lat, lon), via a SpatialIndex
+    built from the frame: the SPATIAL_K nearest within SPATIAL_RADIUS_M of the recent
+    window plus the SPATIAL_K nearest of the long-term window (so both recent
+    and long-term comps get the closest deals). Positions ascending (frame order).
+    With as_of only deals dated before it.
+    """
+    today = today or datetime.utcnow()
+    city_norm = str(city).lower().strip()
+    size_range = (size_sqm * (1 - SIZE_TOL), size_sqm * (1 + SIZE_TOL))
+    pos = [spatial.nearest(city_norm, _rooms_range(rooms), lat, lon, SPATIAL_K, SPATIAL_RADIUS_M,
+                           size_range, date_from=today - timedelta(days=years * 365), date_to=as_of)[0]
+           for years in (RECENT_YEARS, LONGTERM_YEARS)]
+    return np.union1d(*pos)
 
-    size_low, size_high = size_sqm * (1 - SIZE_TOL), size_sqm * (1 + SIZE_TOL)
-    base = base[(base['size_sqm'] >= size_low) & (base['size_sqm'] <= size_high)]
+def _neighborhood_scope(index: SegmentIndex | SQLiteStore, city_norm: str, neigh_norm: str,
+                        as_of: datetime | None = None) -> str | None:
+    if REQUIRE_SAME_NEIGHBORHOOD and index.has_neighborhood(city_norm, neigh_norm, date_to=as_of):
+        return neigh_norm
+    return None
 
-    if ROOMS_MATCH_MODE == "exact":
-        base = base[base['rooms'] == rooms]
-    else:
-        base = base[base['rooms'].between(rooms - ROOMS_TOL, rooms + ROOMS_TOL, inclusive='both')]
+def _apply_match_filters(df: pd.DataFrame, city: str, neighborhood: str,
+                         rooms: float, size_sqm: float,
+                         index: SegmentIndex | None = None,
+                         date_from: datetime | None = None, as_of: datetime | None = None) -> pd.DataFrame:
+    """
+    Core comparable filters: segment_positions + size_positions, optionally deal_date >= date_from
+    and (as_of, see segment_positions) deal_date < as_of.
+    With a SegmentIndex built from `df`, this is a range lookup instead of a scan;
+    with a SQLiteStore as `df`, an indexed query.
+    """
+    city_norm = str(city).lower().strip()
+    neigh_norm = str(neighborhood).lower().strip()
+    size_range = (size_sqm * (1 - SIZE_TOL), size_sqm * (1 + SIZE_TOL))
+    if isinstance(df, SQLiteStore):
+        return df.rows(city_norm, _neighborhood_scope(df, city_norm, neigh_norm, as_of), _rooms_range(rooms),
+                       size_range=size_range, date_from=date_from, date_to=as_of)
+    if index is not None:
+        pos = index.lookup(city_norm, _neighborhood_scope(index, city_norm, neigh_norm, as_of), _rooms_range(rooms),
+                           size_range=size_range, date_from=date_from, date_to=as_of)
+        return df.iloc[pos]
 
-    return base
+    pos = size_positions(df, segment_positions(df, city, neighborhood, rooms, as_of=as_of), size_sqm)
+    if date_from is not None:
+        pos = pos[dates_at(df, pos) >= np.datetime64(to_ns(date_from), 'ns')]
+    return df.iloc[pos]
+
+def recent_positions(rows: pd.DataFrame, pos: np.ndarray, today: datetime | None = None,
+                     years: float = RECENT_YEARS) -> np.ndarray:
+    """
+    Positions (into rows) of the comps recent_from_candidates(rows.iloc[pos]) returns,
+    in its order; only the deal_date values at pos are read.
+    """
+    today = today or datetime.utcnow()
+    dates = dates_at(rows, pos).astype('datetime64[ns]').view('i8')
+    keep = dates >= to_ns(today - timedelta(days=years * 365))
+    pos, dates = pos[keep], dates[keep]
+    order = np.lexsort((np.arange(len(pos)), -dates))  # newest first, same day in pos order
+
+    if len(pos) >= RECENT_MAX:
+        return pos[order[:RECENT_MAX]]
+    if len(pos) >= RECENT_MIN:
+        return pos[order[:RECENT_MIN]]
+    return pos[order]
+
+def recent_from_candidates(cand: pd.DataFrame, today: datetime | None = None,
+                           years: float = RECENT_YEARS) -> pd.DataFrame:
+    """
+    Recent comps from rows that already passed the match filters
+    (see recent_comps for the selection rules). Same-day deals keep dataset order.
+    """
+    return cand.iloc[recent_positions(cand, np.arange(len(cand)), today, years)].reset_index(drop=True)
 
 def recent_comps(df: pd.DataFrame, city: str, neighborhood: str,
-                 rooms: float, size_sqm: float, today: datetime | None = None) -> pd.DataFrame:
+                 rooms: float, size_sqm: float, today: datetime | None = None,
+                 index: SegmentIndex | None = None) -> pd.DataFrame:
     """
     Return up to RECENT_MAX (12) most recent comps from the last RECENT_YEARS,
-    newest first. Requires exact rooms and ±size tolerance (handled upstream).    """
+    newest first. Requires exact rooms and ±size tolerance (handled upstream).
+    With a SQLiteStore as `df` only the newest RECENT_MAX matches are read.
+    """
     today = today or datetime.utcnow()
     cutoff = today - timedelta(days=RECENT_YEARS * 365)
 
-    cand = _apply_match_filters(df, city, neighborhood, rooms, size_sqm)
-    cand = cand[cand['deal_date'] >= cutoff].sort_values('deal_date', ascending=False)
+    if isinstance(df, SQLiteStore):
+        city_norm = str(city).lower().strip()
+        neigh_norm = str(neighborhood).lower().strip()
+        cand = df.rows(city_norm, _neighborhood_scope(df, city_norm, neigh_norm), _rooms_range(rooms),
+                       size_range=(size_sqm * (1 - SIZE_TOL), size_sqm * (1 + SIZE_TOL)), date_from=cutoff,
+                       newest_first=True, limit=RECENT_MAX)
+        return recent_from_candidates(cand, today)
+    cand = _apply_match_filters(df, city, neighborhood, rooms, size_sqm, index=index, date_from=cutoff)
+    return recent_from_candidates(cand, today)
+
+def widened_recent_comps(df: pd.DataFrame, city: str, neighborhood: str,
+                         rooms: float, size_sqm: float, today: datetime | None = None,
+                         index: SegmentIndex | None = None,
+                         as_of: datetime | None = None) -> tuple[pd.DataFrame, list[dict]]:
+    """
+    recent_comps, with the criteria widened one step at a time while fewer than
+    RECENT_MIN rows match: in WIDEN_ORDER, size tolerance (WIDEN_SIZE_TOLS),
+    rooms tolerance (WIDEN_ROOMS_TOLS), neighborhood → whole city, recent window
+    (WIDEN_RECENT_YEARS). Criteria only ever grow, so with an index each step
+    reads just the rows it adds (the edges of every segment's size range, or
+    new segments) and a longer window only relaxes the date filter on the rows
+    already read; without one the city's rows are filtered once and re-masked
+    (with a SQLiteStore as `df`, only those within the widest criteria are read).
+    With as_of only deals dated before it are considered.
+    Returns (comps, steps): one {"step", "value", "n"} per widening taken.
+    """
+    today = today or datetime.utcnow()
+    city_norm = str(city).lower().strip()
+    neigh_norm = str(neighborhood).lower().strip()
+    known = REQUIRE_SAME_NEIGHBORHOOD and neighborhood_has_deals(df, city, neighborhood, index=index, as_of=as_of)
+    d1 = to_ns(as_of) if as_of is not None else None
+    lo, hi = _rooms_range(rooms)
+    crit = {"size": SIZE_TOL, "rooms": (hi - lo) / 2, "neighborhood": neigh_norm if known else None,
+            "time": RECENT_YEARS}
 
-    if len(cand) >= RECENT_MAX:
-        return cand.head(RECENT_MAX).reset_index(drop=True)
-    if len(cand) >= RECENT_MIN:
-        return cand.head(RECENT_MIN).reset_index(drop=True)
-    return cand.reset_index(drop=True)
+    covered = {}  # index path: segment id → [lo, hi) size-order range already read
+    pos_parts, date_parts = [], []
+    if index is None and isinstance(df, SQLiteStore):
+        rooms_tol = max(WIDEN_ROOMS_TOLS + (crit["rooms"],))
+        size_tol = max(WIDEN_SIZE_TOLS + (SIZE_TOL,))
+        base = df.rows(city_norm, None, (rooms - rooms_tol, rooms + rooms_tol),
+                       size_range=(size_sqm * (1 - size_tol), size_sqm * (1 + size_tol)),
+                       date_from=today - timedelta(days=max(WIDEN_RECENT_YEARS + (RECENT_YEARS,)) * 365),
+                       date_to=as_of)
+        base_dates = _date_ns(base)
+    elif index is None:
+        pos = np.flatnonzero(equals_at(df['city_norm'], city_norm))
+        if as_of is not None:
+            pos = pos[before(dates_at(df, pos), as_of)]
+        base = df.iloc[pos]
+        base_dates = _date_ns(base)
 
-def longterm_buckets(df: pd.DataFrame, city: str, neighborhood: str,
-                     rooms: float, size_sqm: float, today: datetime | None = None) -> pd.DataFrame:
+    def matches() -> tuple[np.ndarray, np.ndarray]:
+        """Positions and dates of the rows matching crit, except for the date window."""
+        size_range = (size_sqm * (1 - crit["size"]), size_sqm * (1 + crit["size"]))
+        rooms_range = (rooms - crit["rooms"], rooms + crit["rooms"])
+        if index is None:
+            m = base['size_sqm'].between(*size_range) & base['rooms'].between(*rooms_range)
+            if crit["neighborhood"] is not None:
+                m &= base['neigh_norm'] == crit["neighborhood"]
+            m = m.to_numpy()
+            return np.flatnonzero(m), base_dates[m]
+        for seg in index.segments(city_norm, crit["neighborhood"], rooms_range):
+            a, b = index.size_bounds(seg, size_range)
+            old = covered.get(seg)
+            for x, y in ([(a, b)] if old is None else [(a, old[0]), (old[1], b)]):
+                if y > x:
+                    p, d = index.size_slice(x, y)
+                    if d1 is not None:
+                        keep = (d >= NAT_NS + 1) & (d < d1)
+                        p, d = p[keep], d[keep]
+                    pos_parts.append(p)
+                    date_parts.append(d)
+            covered[seg] = (a, b)
+        if not pos_parts:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        return np.concatenate(pos_parts), np.concatenate(date_parts)
+
+    def count(dates) -> int:
+        return int((dates >= to_ns(today - timedelta(days=crit["time"] * 365))).sum())
+
+    levels = {"size": WIDEN_SIZE_TOLS, "rooms": WIDEN_ROOMS_TOLS, "neighborhood": (None,),
+              "time": WIDEN_RECENT_YEARS}
+    steps = []
+    pos, dates = matches()
+    n = count(dates)
+    for dim in WIDEN_ORDER:
+        for value in levels[dim]:
+            if n >= RECENT_MIN:
+                break
+            widens = crit[dim] is not None if dim == "neighborhood" else value > crit[dim]
+            if not widens:
+                continue
+            crit[dim] = value
+            if dim != "time":
+                pos, dates = matches()
+            n = count(dates)
+            steps.append({"step": dim, "value": "city" if dim == "neighborhood" else value, "n": n})
+
+    keep = np.sort(pos[dates >= to_ns(today - timedelta(days=crit["time"] * 365))])
+    rows = base.iloc[keep] if index is None else df.iloc[keep]
+    return recent_from_candidates(rows, today, years=crit["time"]), steps
+
+def recent_ppsqm_matrix(segment: pd.DataFrame, sizes, today: datetime | None = None):
     """
-    Build long-term comparables over the last LONGTERM_YEARS.
-    For each ~BUCKET_SPAN_DAYS (~2 years) window going backward,
-    pick up to BUCKET_SAMPLES_PER_BUCKET most recent deals in that window.
-    Returns a concatenated DataFrame, newest → oldest.
+    Vectorized recent_comps for many listings of the same segment.
+    Returns (ppsqm, n_comps):
+      - ppsqm: (len(sizes), RECENT_MAX) price_per_sqm of the comps recent_comps
+        would pick for each size, newest first, NaN-padded
+      - n_comps: number of comps picked per listing
+    Same-day deals are ordered by dataset position.
     """
     today = today or datetime.utcnow()
-    cutoff_longterm = today - timedelta(days=LONGTERM_YEARS * 365)
+    cutoff = today - timedelta(days=RECENT_YEARS * 365)
 
-    # Apply core filters (city/neighborhood/size tolerance/rooms exact)
-    cand = _apply_match_filters(df, city, neighborhood, rooms, size_sqm).copy()
-    if cand.empty:
-        return pd.DataFrame(columns=df.columns)
+    rows = segment[segment['deal_date'] >= cutoff]
+    dates = rows['deal_date'].to_numpy(dtype='datetime64[ns]').view('i8')
+    order = np.lexsort((np.arange(len(rows)), -dates))
+    s = rows['size_sqm'].to_numpy(dtype=np.float64)[order]
+    p = rows['price_per_sqm'].to_numpy(dtype=np.float64)[order]
+
+    sizes = np.asarray(sizes, dtype=np.float64)
+    out = np.full((len(sizes), RECENT_MAX), np.nan)
+    n_comps = np.zeros(len(sizes), dtype=np.int64)
+    step = max(1, _BATCH_CELLS // max(len(s), 1))  # bound the (listings × rows) mask
+    for a in range(0, len(sizes), step):
+        x = sizes[a:a + step, None]
+        m = (s >= x * (1 - SIZE_TOL)) & (s <= x * (1 + SIZE_TOL))
+        cnt = m.sum(axis=1)
+        take = np.where(cnt >= RECENT_MAX, RECENT_MAX, np.where(cnt >= RECENT_MIN, RECENT_MIN, cnt))
+        rank = np.cumsum(m, axis=1)
+        r, c = np.nonzero(m & (rank <= take[:, None]))
+        out[a + r, rank[r, c] - 1] = p[c]
+        n_comps[a:a + step] = take
+    return out, n_comps
+
+def _span_ns(span: timedelta) -> int:
+    return int(pd.Timedelta(span).value)
+
+def _bucket_ids(dates: pd.Series, anchor: datetime, span: timedelta) -> np.ndarray:
+    """
+    Integer bucket id per row for the windows (anchor - (k+1)*span, anchor - k*span].
+    Rows after the anchor get -1.
+    """
+    delta = to_ns(anchor) - dates.to_numpy(dtype='datetime64[ns]').view('i8')
+    return np.where(delta >= 0, delta // _span_ns(span), -1)
+
+def _runs(ids: np.ndarray) -> list[tuple[int, int]]:
+    """(start, end) of each run of equal consecutive ids."""
+    if len(ids) == 0:
+        return []
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    return list(zip(starts.tolist(), np.r_[starts[1:], len(ids)].tolist()))
+
+def _desc_order(values: np.ndarray) -> np.ndarray:
+    """
+    Permutation that sort_values(ascending=False) applies to non-null values,
+    so ties come out in exactly the same order as a per-bucket sort.
+    """
+    n = len(values)
+    return (n - 1 - values[::-1].argsort(kind='quicksort'))[::-1]
 
-    cand = cand.dropna(subset=['deal_date']).sort_values('deal_date', ascending=False)
-    cand = cand[cand['deal_date'] >= cutoff_longterm]
+def _run_mean(values: np.ndarray) -> float:
+    """Series.mean() of a contiguous slice (NaN-skipping, same summation)."""
+    if values.dtype.kind == 'f':
+        valid = ~np.isnan(values)
+        count = int(valid.sum())
+        values = values if count == len(values) else np.where(valid, values, 0.0)
+    else:
+        count = len(values)
+    if count == 0:
+        return float('nan')
+    return float(values.sum(dtype=np.float64) / count)
+
+def longterm_positions(rows: pd.DataFrame, pos: np.ndarray, today: datetime | None = None) -> np.ndarray:
+    """
+    Positions (into rows) of the comps longterm_from_candidates(rows.iloc[pos])
+    returns, in its order; the selection runs on a Series of the deal_date
+    values at pos only (same sorts, so ties come out the same).
+    """
+    today = today or datetime.utcnow()
+    cutoff_longterm = today - timedelta(days=LONGTERM_YEARS * 365)
+
+    cand = pd.Series(dates_at(rows, pos), index=pos)
+    cand = cand.dropna().sort_values(ascending=False)
+    cand = cand[cand >= cutoff_longterm]
     if cand.empty:
-        return pd.DataFrame(columns=df.columns)
+        return np.array([], dtype=np.int64)
 
-    all_rows = []
-    bucket_end = today
+    # One pass assigns a bucket id to every row. cand is newest → oldest, so each
+    # bucket is a contiguous run; take the newest BUCKET_SAMPLES_PER_BUCKET of each.
     span = timedelta(days=BUCKET_SPAN_DAYS)
+    ids = _bucket_ids(cand, today, span)
+    ids[ids * _span_ns(span) >= to_ns(today) - to_ns(cutoff_longterm)] = -1
+    dates = cand.to_numpy()
+    picks = [a + _desc_order(dates[a:b])[:BUCKET_SAMPLES_PER_BUCKET]
+             for a, b in _runs(ids) if ids[a] >= 0]
+    if not picks:
+        return np.array([], dtype=np.int64)
+    picks = cand.iloc[np.concatenate(picks)]
+    return picks.sort_values(ascending=False).index.to_numpy()
 
-    while bucket_end > cutoff_longterm:
-        bucket_start = bucket_end - span
-        in_bucket = cand[(cand['deal_date'] <= bucket_end) & (cand['deal_date'] > bucket_start)]
-        if len(in_bucket) > 0:
-            picks = in_bucket.sort_values('deal_date', ascending=False).head(BUCKET_SAMPLES_PER_BUCKET)
-            all_rows.append(picks)
-        bucket_end = bucket_start
-
-    if not all_rows:
-        return pd.DataFrame(columns=df.columns)
+def longterm_from_candidates(cand: pd.DataFrame, today: datetime | None = None) -> pd.DataFrame:
+    """
+    Long-term comps from rows that already passed the match filters
+    (see longterm_buckets for the bucketing rules).
+    """
+    pos = longterm_positions(cand, np.arange(len(cand)), today)
+    if len(pos) == 0:
+        return pd.DataFrame(columns=cand.columns)
+    return cand.iloc[pos].reset_index(drop=True)
 
-    out = pd.concat(all_rows, ignore_index=True)
-    out = out.sort_values('deal_date', ascending=False).reset_index(drop=True)
-    return out
+def longterm_buckets(df: pd.DataFrame, city: str, neighborhood: str,
+                     rooms: float, size_sqm: float, today: datetime | None = None,
+                     index: SegmentIndex | None = None) -> pd.DataFrame:
+    """
+    Build long-term comparables over the last LONGTERM_YEARS.
+    For each ~BUCKET_SPAN_DAYS (~2 years) window going backward,
+    pick up to BUCKET_SAMPLES_PER_BUCKET most recent deals in that window.
+    Returns a concatenated DataFrame, newest → oldest.
+    """
+    # Apply core filters (city/neighborhood/size tolerance/rooms exact)
+    cand = _apply_match_filters(df, city, neighborhood, rooms, size_sqm, index=index)
+    return longterm_from_candidates(cand, today)
 
 def longterm_bucket_summary(
     df_longterm: pd.DataFrame,
@@ -112,33 +411,38 @@ def longterm_bucket_summary(
         return []
 
     today = today or datetime.utcnow()
-    df = df_longterm.copy()
-    df = df.dropna(subset=["deal_date"]).sort_values("deal_date", ascending=False)
+    df = df_longterm.dropna(subset=["deal_date"]).sort_values("deal_date", ascending=False)
 
-    # Build contiguous rolling windows backward from `today - RECENT_YEARS`
-    out = []
+    # Contiguous windows backward from the newest deal; one vectorized pass assigns
+    # bucket ids (non-decreasing down the newest → oldest frame), then per-bucket
+    # counts and means come from reductions over each contiguous run.
     bucket_end = df["deal_date"].max() + timedelta(seconds=1)  # make the max inclusive
     span = timedelta(days=bucket_span_days)
     cutoff_oldest = today - timedelta(days=LONGTERM_YEARS * 365)
 
-    while bucket_end > cutoff_oldest:
-        bucket_start = bucket_end - span
-        in_bucket = df[(df["deal_date"] <= bucket_end) & (df["deal_date"] > bucket_start)]
-        if len(in_bucket) > 0:
-            mean_ppsqm = float(in_bucket["price_per_sqm"].mean())
-            mean_price = float(in_bucket["price_ils"].mean())
-            center = bucket_start + (span / 2)
-            years_ago = (today - center).days / 365.25
-            out.append(dict(
-                bucket_start=bucket_start,
-                bucket_end=bucket_end,
-                center_date=center,
-                years_ago=years_ago,
-                n=int(len(in_bucket)),
-                mean_ppsqm=mean_ppsqm,
-                mean_price_ils=mean_price,
-            ))
-        bucket_end = bucket_start
+    ids = _bucket_ids(df["deal_date"], bucket_end, span)
+    ppsqm = df["price_per_sqm"].to_numpy()
+    price = df["price_ils"].to_numpy()
+    horizon = to_ns(bucket_end) - to_ns(cutoff_oldest)
+
+    out = []
+    for a, b in _runs(ids):
+        k = int(ids[a])
+        if k * _span_ns(span) >= horizon:
+            break
+        b_end = bucket_end - span * k
+        b_start = b_end - span
+        center = b_start + (span / 2)
+        years_ago = (today - center).days / 365.25
+        out.append(dict(
+            bucket_start=b_start,
+            bucket_end=b_end,
+            center_date=center,
+            years_ago=years_ago,
+            n=b - a,
+            mean_ppsqm=_run_mean(ppsqm[a:b]),
+            mean_price_ils=_run_mean(price[a:b]),
+        ))
 
     # newest → oldest (already so), convert datetimes to str so it's JSON-friendly (or let caller json.dumps(..., default=str))
     for b in out:
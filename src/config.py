@@ -22,3 +22,54 @@ LONGTERM_MIN = 3  # <-- חשוב! מינימום נקודות למגמה
 
 # --- pricing margin for 'fair range' ---
 MARGIN_PCT = 0.04
+
+# --- dataset hot reload (seconds between source checks; 0 disables the watcher) ---
+DATASET_RELOAD_INTERVAL_S = 60
+
+# --- /evaluate result cache (market part per normalized inputs + dataset version) ---
+EVAL_CACHE_MAX_ENTRIES = 10_000
+EVAL_CACHE_TTL_S = 3600
+
+# --- loader: chunked read with compact dtypes (categoricals, lossless downcasts) ---
+COMPACT_DTYPES = True
+CSV_CHUNK_ROWS = 500_000
+
+# --- area-level ppsqm sketches (aggregates.AggregateCube) ---
+SKETCH_RELATIVE_ACCURACY = 0.01  # quantile estimates within ±1% of a real value
+AREA_FALLBACK_MIN_COMPS = 3      # fewer recent comps → fair price from the area sketch
+AREA_FALLBACK_MIN_N = 10         # deals an area scope needs before it is used
+
+# --- appreciation: precomputed per-segment trend (growth.GrowthTable) or per-request from comps ---
+GROWTH_SOURCE = "segment"        # "segment" | "comps"
+GROWTH_ESTIMATOR = "ols"         # "ols" | "theil_sen"
+THEIL_SEN_MAX_PAIRS = 50_000     # exact Theil–Sen up to this many pairs per segment, sampled above
+
+# --- /market/heatmap: full segment table cached per dataset version and day ---
+HEATMAP_CACHE_ENTRIES = 4
+
+# --- nearest-deal comps when the listing's neighborhood has no deals (spatial_index.SpatialIndex) ---
+SPATIAL_CELL_M = 250             # grid cell side
+SPATIAL_K = 60                   # nearest size-matching deals used as the segment
+SPATIAL_RADIUS_M = 1500          # ... within this distance of the listing
+
+# --- recent comps: "fixed" filters, or "adaptive" widening while fewer than RECENT_MIN match ---
+RECENT_SEARCH_MODE = "fixed"     # "fixed" | "adaptive"
+WIDEN_ORDER = ("size", "rooms", "neighborhood", "time")
+WIDEN_SIZE_TOLS = (0.12, 0.20)   # successive size tolerances (after SIZE_TOL)
+WIDEN_ROOMS_TOLS = (0.5, 1.0)    # successive rooms tolerances
+WIDEN_RECENT_YEARS = (3, 5)      # successive recent windows (after RECENT_YEARS)
+
+# --- bulk CKAN datastore sync (ckan_sync.sync_resource) ---
+CKAN_PAGE_SIZE = 5_000           # rows per datastore_search call (CKAN caps at 32k)
+CKAN_SYNC_CONCURRENCY = 8        # pages in flight / pooled connections
+CKAN_TIMEOUT_S = 30
+
+# --- embedded SQL backend (sql_store.SQLiteStore, DATASET_MODE=sqlite) ---
+SQLITE_CACHE_MB = 64             # page cache and mmap window per connection
+
+# --- /places/autocomplete (autocomplete.PlaceIndex) ---
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MIN_SIMILARITY = 0.3   # trigram Jaccard similarity for misspelled names
+
+# --- historical backtest (backtest.backtest_scores) ---
+BACKTEST_CHUNK_ROWS = 1_000_000  # deals per wavelet matrix (whole segments), bounds its memory
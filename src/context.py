@@ -0,0 +1,102 @@
+from __future__ import annotations
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from comps import (
+    segment_positions, size_positions, neighborhood_has_deals, nearby_positions, _apply_match_filters,
+    recent_positions, longterm_positions,
+)
+from config import RECENT_MIN
+from segment_index import SegmentIndex
+from sql_store import SQLiteStore
+from stats import sales_counts_at, sales_counts_last5_years
+
+class EvaluationContext:
+    """
+    Per-listing state shared by the evaluate_listing stages.
+    The segment (city / neighborhood-or-fallback / rooms) is filtered from the
+    full dataset exactly once; every stage works on these rows, kept as
+    positions into a frame rather than copies:
+      - segment_pos:   positions in segment_rows of the listing's segment (any size, any date)
+      - candidate_pos: positions in candidate_rows within ±SIZE_TOL (input to recent / long-term comps)
+    Only the comps that end up in the result are materialized (recent_comps,
+    longterm_comps); `segment` / `candidates` build frames on demand.
+    Activity counts use the segment, which is a superset of their exact
+    city + neighborhood + rooms filter.
+    Pass `segment` to reuse rows already selected for the same segment (batch evaluation).
+    With the listing's lat / lon and a spatial_index.SpatialIndex, a neighborhood
+    without deals (or with fewer than RECENT_MIN size-matching ones) uses the
+    nearest size-matching deals of the city as candidates (comps.nearby_positions)
+    when they are more; scope is then "nearby" (segment, and so the activity
+    counts, are unchanged).
+    With a sql_store.SQLiteStore as transactions_df (and no `segment`) only the
+    candidates are queried; segment_pos stays None and the activity counts are
+    a grouped query of their own (stats.sales_counts_last5_years).
+    With as_of the listing is evaluated as on that date: today is as_of and
+    only deals dated before it are used (the neighborhood fallback and nearby
+    deals included). Not combined with `segment`.
+    """
+
+    def __init__(self, transactions_df: pd.DataFrame, city: str, neighborhood: str,
+                 rooms: float, size_sqm: float, today: datetime | None = None,
+                 index: SegmentIndex | None = None, segment: pd.DataFrame | None = None,
+                 lat: float | None = None, lon: float | None = None, spatial=None,
+                 as_of: datetime | None = None):
+        self.city = city
+        self.neighborhood = neighborhood
+        self.rooms = rooms
+        self.size_sqm = size_sqm
+        self.as_of = as_of
+        self.today = as_of or today or datetime.utcnow()
+        self.df = transactions_df
+        self.index = index
+        if segment is None and isinstance(transactions_df, SQLiteStore):
+            self.segment_rows, self.segment_pos = None, None
+            self.candidate_rows = _apply_match_filters(transactions_df, city, neighborhood, rooms, size_sqm,
+                                                       as_of=as_of)
+            self.candidate_pos = np.arange(len(self.candidate_rows))
+        else:
+            if segment is None:
+                self.segment_rows = transactions_df
+                self.segment_pos = segment_positions(transactions_df, city, neighborhood, rooms, index=index,
+                                                     as_of=as_of)
+            else:
+                self.segment_rows, self.segment_pos = segment, np.arange(len(segment))
+            self.candidate_rows = self.segment_rows
+            self.candidate_pos = size_positions(self.segment_rows, self.segment_pos, size_sqm)
+        self.scope = "segment"
+        if spatial is not None and lat is not None and lon is not None:
+            known = neighborhood_has_deals(transactions_df, city, neighborhood, index=index, as_of=as_of)
+            if not known or len(self.candidate_pos) < RECENT_MIN:
+                near = nearby_positions(spatial, city, rooms, size_sqm, lat, lon, self.today, as_of=as_of)
+                if len(near) and (not known or len(near) > len(self.candidate_pos)):
+                    self.candidate_rows, self.candidate_pos = transactions_df, near
+                    self.scope = "nearby"
+
+    @property
+    def segment(self) -> pd.DataFrame | None:
+        return None if self.segment_pos is None else self.segment_rows.iloc[self.segment_pos]
+
+    @property
+    def candidates(self) -> pd.DataFrame:
+        return self.candidate_rows.iloc[self.candidate_pos]
+
+    def recent_comps(self) -> pd.DataFrame:
+        """comps.recent_from_candidates(self.candidates), copying only the comps."""
+        pos = recent_positions(self.candidate_rows, self.candidate_pos, self.today)
+        return self.candidate_rows.iloc[pos].reset_index(drop=True)
+
+    def longterm_comps(self) -> pd.DataFrame:
+        """comps.longterm_from_candidates(self.candidates), copying only the comps."""
+        pos = longterm_positions(self.candidate_rows, self.candidate_pos, self.today)
+        if len(pos) == 0:
+            return pd.DataFrame(columns=self.candidate_rows.columns)
+        return self.candidate_rows.iloc[pos].reset_index(drop=True)
+
+    def sales_counts(self) -> dict:
+        """5-year activity of the exact city + neighborhood + rooms (see stats.sales_counts_last5_years)."""
+        if self.segment_pos is None:
+            return sales_counts_last5_years(self.df, self.city, self.neighborhood, self.rooms, today=self.today,
+                                            as_of=self.as_of)
+        return sales_counts_at(self.segment_rows, self.segment_pos, self.city, self.neighborhood, self.rooms,
+                               today=self.today)
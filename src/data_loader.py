@@ -1,33 +1,223 @@
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+from pandas.tseries.api import guess_datetime_format
+from config import COMPACT_DTYPES, CSV_CHUNK_ROWS
+from metrics import stage
+from snapshot import snapshot_dir_for, source_fingerprint, is_fresh, read_snapshot, write_snapshot
 
-def load_transactions_csv(path: str) -> pd.DataFrame:
+# Stored as categoricals in compact mode (few distinct values, repeated on every row);
+# other text columns become categoricals when at most half their values are distinct.
+CATEGORY_COLUMNS = ['city', 'neighborhood', 'city_norm', 'neigh_norm']
+UNIQUE_TEXT_COLUMNS = ['tx_id']
+
+def load_transactions_csv(path: str, snapshot: bool = True, compact: bool = COMPACT_DTYPES,
+                          chunksize: int = CSV_CHUNK_ROWS) -> pd.DataFrame:
     """
     Fallback loader if a resource is only published as CSV (official).
     Expected/rename mapping can be adjusted here.
+    With snapshot=True the prepared table (derived columns included) is cached
+    next to the CSV as a columnar snapshot and reused while the CSV's size,
+    mtime and content hash are unchanged.
+    With compact=True the file is read and cleaned `chunksize` rows at a time
+    and stored with compact dtypes (see compact_dtypes); values are unchanged.
+    """
+    options = {"compact": True} if compact else None
+    if snapshot:
+        snap_dir = snapshot_dir_for(path)
+        if is_fresh(snap_dir, path, options):
+            with stage("load_snapshot"):
+                return read_snapshot(snap_dir)
+
+    fingerprint = source_fingerprint(path) if snapshot else None
+    with stage("load_csv"):
+        if compact:
+            df = _read_compact(path, chunksize)
+        else:
+            df = clean_transactions(pd.read_csv(path))
+
+    if snapshot:
+        try:
+            with stage("write_snapshot"):
+                write_snapshot(df, snap_dir, fingerprint, options)
+        except OSError as e:
+            print(f"[data_loader] could not write snapshot {snap_dir}: {e}")
+    return df
+
+def load_transactions_delta(path: str) -> pd.DataFrame:
+    """
+    Parse a delta file (new deals only) with the same cleaning and derived
+    columns as the full load. Never snapshotted: deltas are small and read once.
+    """
+    with stage("load_delta"):
+        return clean_transactions(pd.read_csv(path))
+
+def _read_compact(path: str, chunksize: int) -> pd.DataFrame:
     """
-    df = pd.read_csv(path)
-    rename_map = {
-        'תאריך עסקה': 'deal_date',
-        'עיר': 'city',
-        'שכונה': 'neighborhood',
-        'כתובת': 'address',
-        'מספר חדרים': 'rooms',
-        'שטח': 'size_sqm',
-        'מחיר': 'price_ils'
-    }
-    for k, v in rename_map.items():
+    Clean each chunk as it is read and store it compactly right away
+    (text → categoricals, lossless numeric downcasts), so the full table never
+    exists as object strings / 64-bit columns. Each chunk is split into
+    per-column pieces and dropped; columns are then combined one at a time.
+    """
+    pieces = {}
+    date_format = None
+    with pd.read_csv(path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            date_format = date_format or deal_date_format(chunk)
+            df = clean_transactions(chunk, date_format)
+            del chunk
+            for c in df.columns:
+                if c not in UNIQUE_TEXT_COLUMNS and _is_text(df[c]):
+                    df[c] = df[c].astype('category')
+            df = compact_dtypes(df)
+            for c in df.columns:
+                s = df[c]
+                # own copy of numeric columns, so the chunk's 2-D blocks are freed with df
+                pieces.setdefault(c, []).append(s.to_numpy().copy() if s.dtype.kind in 'biufM' else s)
+            del df, s
+    if not pieces:
+        return clean_transactions(pd.read_csv(path))
+
+    columns = {}
+    for c, parts in pieces.items():
+        if all(isinstance(getattr(p, 'dtype', None), pd.CategoricalDtype) for p in parts):
+            columns[c] = pd.Series(union_categoricals(parts))
+        elif all(isinstance(p, np.ndarray) for p in parts):
+            columns[c] = pd.Series(np.concatenate(parts))
+        else:
+            columns[c] = pd.concat([pd.Series(p) for p in parts], ignore_index=True)
+        parts.clear()
+    return compact_dtypes(pd.DataFrame(columns, copy=False))
+
+def _is_text(s: pd.Series) -> bool:
+    return s.dtype == object or pd.api.types.is_string_dtype(s.dtype) and not isinstance(s.dtype, pd.CategoricalDtype)
+
+def _lossless(values: np.ndarray, dtype) -> bool:
+    cast = values.astype(dtype)
+    return bool(np.array_equal(cast.astype(values.dtype), values, equal_nan=values.dtype.kind == 'f'))
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Smallest dtype per column that holds exactly the same values:
+      - CATEGORY_COLUMNS → category; other text → category when ≤ 50% distinct
+      - integers → int8/16/32 when in range
+      - floats → float32 only when every value round-trips (e.g. whole sqm, half rooms)
+    deal_date stays datetime64 (growth/stats/comps use datetime ops on it)
+    and price_per_sqm stays float64 (derived ratio, never exact in float32).
+    """
+    for c in df.columns:
+        s = df[c]
+        if c in CATEGORY_COLUMNS:
+            if not isinstance(s.dtype, pd.CategoricalDtype):
+                df[c] = s.astype('category')
+        elif isinstance(s.dtype, pd.CategoricalDtype):
+            if len(s.cat.categories) > len(s) // 2:
+                df[c] = s.astype(s.cat.categories.dtype)
+        elif _is_text(s):
+            if c not in UNIQUE_TEXT_COLUMNS and s.nunique() <= len(s) // 2:
+                df[c] = s.astype('category')
+        elif s.dtype.kind == 'i':
+            for dt in (np.int8, np.int16, np.int32):
+                info = np.iinfo(dt)
+                if len(s) == 0 or (info.min <= s.min() and s.max() <= info.max):
+                    df[c] = s.astype(dt)
+                    break
+        elif s.dtype == np.float64 and c != 'price_per_sqm':
+            if _lossless(s.to_numpy(), np.float32):
+                df[c] = s.astype(np.float32)
+    return df
+
+def conform_dtypes(rows: pd.DataFrame, like: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast new rows to the dtypes of `like` where that loses nothing, so that
+    concatenating them keeps like's compact dtypes. Categoricals get the union
+    of both category sets (like's categories come first, its codes stay valid).
+    Returns (rows, like) with like's categoricals extended as needed.
+    """
+    like = like.copy(deep=False)
+    for c in rows.columns.intersection(like.columns):
+        target = like[c].dtype
+        if isinstance(target, pd.CategoricalDtype):
+            new = pd.Index(rows[c].dropna().unique()).difference(target.categories)
+            if len(new):
+                like[c] = like[c].cat.add_categories(new)
+            rows[c] = pd.Categorical(rows[c], categories=like[c].cat.categories)
+        elif rows[c].dtype.kind in 'iuf' and target.kind in 'iuf' and rows[c].dtype != target:
+            if _lossless(rows[c].to_numpy(), target):
+                rows[c] = rows[c].astype(target)
+    return rows, like
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-column footprint (deep, so object strings are counted), largest first."""
+    usage = df.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'mb': usage / 2**20,
+        'bytes_per_row': usage / max(len(df), 1),
+    })
+    report['share'] = report['mb'] / report['mb'].sum()
+    return report.sort_values('mb', ascending=False).round(3)
+
+RENAME_MAP = {
+    'תאריך עסקה': 'deal_date',
+    'עיר': 'city',
+    'שכונה': 'neighborhood',
+    'כתובת': 'address',
+    'מספר חדרים': 'rooms',
+    'שטח': 'size_sqm',
+    'מחיר': 'price_ils',
+    'latitude': 'lat',
+    'longitude': 'lon',
+    'lng': 'lon',
+}
+
+def _renamed(df: pd.DataFrame) -> pd.DataFrame:
+    for k, v in RENAME_MAP.items():
         if k in df.columns and v not in df.columns:
             df = df.rename(columns={k: v})
+    return df
+
+def deal_date_format(df: pd.DataFrame) -> str | None:
+    """
+    The deal_date format pd.to_datetime infers for raw rows (from the first
+    non-null value; "mixed" when it cannot be guessed), None when df has no
+    date yet. Chunked loads take it from the first chunk that has one and
+    pass it to clean_transactions for every chunk, so they parse dates like a
+    whole-file load instead of re-inferring per chunk.
+    """
+    dates = _renamed(df).get('deal_date')
+    first = dates.dropna() if dates is not None else ()
+    if len(first) == 0:
+        return None
+    value = first.iloc[0]
+    if not isinstance(value, str):
+        return "mixed"
+    return guess_datetime_format(value) or "mixed"
+
+def clean_transactions(df: pd.DataFrame, date_format: str | None = None) -> pd.DataFrame:
+    """
+    Raw rows (official or English headers) → typed, filtered rows with
+    price_per_sqm, city_norm and neigh_norm. Index is reset to 0..n-1.
+    lat / lon (or latitude / longitude) are optional and kept as float degrees.
+    date_format: deal_date format (see deal_date_format); None → inferred from df.
+    """
+    df = _renamed(df)
 
-    df['deal_date'] = pd.to_datetime(df['deal_date'], errors='coerce')
+    df['deal_date'] = pd.to_datetime(df['deal_date'], errors='coerce', format=date_format)
     for c in ['size_sqm', 'rooms', 'price_ils']:
         if c in df.columns:
             df[c] = pd.to_numeric(df[c], errors='coerce')
 
+    # optional WGS84 coordinates; out-of-range values are treated as missing
+    for c, limit in (('lat', 90), ('lon', 180)):
+        if c in df.columns:
+            v = pd.to_numeric(df[c], errors='coerce')
+            df[c] = v.where(v.abs() <= limit)
+
     df = df.dropna(subset=['deal_date', 'city', 'size_sqm', 'price_ils'])
     df = df[(df['size_sqm'] > 0) & (df['price_ils'] > 0)]
 
     df['price_per_sqm'] = df['price_ils'] / df['size_sqm']
     df['city_norm'] = df['city'].astype(str).str.lower().str.strip()
     df['neigh_norm'] = df.get('neighborhood', '').astype(str).str.lower().str.strip()
-    return df
+    return df.reset_index(drop=True)
@@ -0,0 +1,365 @@
+"""
+What the API serves from: the transactions frame, its SegmentIndex, its
+AggregateCube, its per-segment GrowthTable, its SpatialIndex (when the
+deals have lat / lon) and, in shared mode, the out-of-frame text columns.
+
+Two ways to get one:
+  - load_dataset(csv):     private copy per process (loader + index in RAM)
+  - attach_dataset(snap):  read-only view of a published snapshot; workers
+                           share the mapped pages instead of holding copies.
+publish_dataset(csv) prepares the snapshot, index, cube, growth table and
+spatial index once for attach_dataset.
+open_sql_dataset(db) serves from a sql_store.SQLiteStore instead of a frame
+(history larger than RAM): comps and activity counts become indexed queries;
+the cube and growth table are built from the store a city at a time. There
+is no spatial index (lat / lon do not select nearby comps).
+
+DatasetStore holds the active Dataset and swaps in a rebuilt one when the
+source changes (watcher thread or explicit reload()).
+"""
+from __future__ import annotations
+import copy
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from data_loader import load_transactions_csv, load_transactions_delta, conform_dtypes
+from segment_index import SegmentIndex
+from aggregates import AggregateCube
+from growth import GrowthTable
+from spatial_index import SpatialIndex
+from metrics import stage
+from snapshot import snapshot_dir_for, snapshot_source, source_fingerprint, attach_snapshot, TextColumns
+from sql_store import SQLiteStore
+from config import LONGTERM_YEARS, GROWTH_ESTIMATOR
+
+INDEX_DIRNAME = "index"
+CUBE_DIRNAME = "cube"
+GROWTH_DIRNAME = "growth"
+SPATIAL_DIRNAME = "spatial"
+
+def _version(fingerprint: dict | None) -> str | None:
+    if not fingerprint:
+        return None
+    return fingerprint.get("sha256", "")[:12] or f"{fingerprint['size']}-{fingerprint['mtime_ns']}"
+
+def _delta_version(base: str | None, n_deltas: int) -> str | None:
+    return f"{base}+{n_deltas}" if base and n_deltas else base
+
+class Dataset:
+    def __init__(self, df: pd.DataFrame | SQLiteStore, index: SegmentIndex | None,
+                 text: TextColumns | None = None, source: str | None = None,
+                 version: str | None = None, cube: AggregateCube | None = None,
+                 growth: GrowthTable | None = None, spatial: SpatialIndex | None = None):
+        self.df = df
+        self.index = index
+        self.cube = cube
+        self.growth = growth
+        self.spatial = spatial
+        self.text = text
+        self.source = source
+        self.version = version
+        self.loaded_at = datetime.utcnow()
+
+    @property
+    def in_memory(self) -> bool:
+        """False when df is a SQLiteStore (whole-frame features are unavailable)."""
+        return isinstance(self.df, pd.DataFrame)
+
+def _has_coords(df: pd.DataFrame) -> bool:
+    return "lat" in df.columns and "lon" in df.columns
+
+def load_dataset(csv_path: str | Path) -> Dataset:
+    df = load_transactions_csv(str(csv_path))
+    fingerprint = snapshot_source(snapshot_dir_for(csv_path)) or source_fingerprint(csv_path)
+    with stage("build_index"):
+        index = SegmentIndex(df)
+    with stage("build_cube"):
+        cube = AggregateCube(df)
+    with stage("build_growth"):
+        growth = GrowthTable.build(df)
+    with stage("build_spatial"):
+        spatial = SpatialIndex(df) if _has_coords(df) else None
+    return Dataset(df, index, source=str(csv_path), version=_version(fingerprint), cube=cube, growth=growth,
+                   spatial=spatial)
+
+def publish_dataset(csv_path: str | Path) -> Path:
+    """
+    Build (or refresh) the snapshot next to csv_path and persist its SegmentIndex,
+    AggregateCube, GrowthTable and (with lat / lon) SpatialIndex inside it, tagged
+    with the snapshot's source fingerprint. Returns the snapshot dir.
+    """
+    snap_dir = snapshot_dir_for(csv_path)
+    df = load_transactions_csv(str(csv_path))
+    tag = snapshot_source(snap_dir)
+    SegmentIndex(df).save(snap_dir / INDEX_DIRNAME, tag=tag)
+    AggregateCube(df).save(snap_dir / CUBE_DIRNAME, tag=tag)
+    GrowthTable.build(df).save(snap_dir / GROWTH_DIRNAME, tag=tag)
+    if _has_coords(df):
+        SpatialIndex(df).save(snap_dir / SPATIAL_DIRNAME, tag=tag)
+    return snap_dir
+
+def attach_dataset(snap_dir: str | Path) -> Dataset:
+    """Attach to a snapshot published by publish_dataset (no parsing, no copies)."""
+    snap_dir = Path(snap_dir)
+    df, text = attach_snapshot(snap_dir)
+    index = SegmentIndex.load(snap_dir / INDEX_DIRNAME)
+    if index.n_rows != len(df) or index.tag != snapshot_source(snap_dir):
+        raise RuntimeError(f"Index in {snap_dir} does not match the snapshot; run publish_dataset again.")
+    cube_dir = snap_dir / CUBE_DIRNAME
+    cube = AggregateCube.load(cube_dir) if (cube_dir / "meta.json").exists() else None
+    if cube is None or cube.tag != index.tag:
+        print(f"[dataset] no current cube in {snap_dir}, building it in this process")
+        cube = AggregateCube(df)
+    growth_dir = snap_dir / GROWTH_DIRNAME
+    growth = GrowthTable.load(growth_dir) if (growth_dir / "meta.json").exists() else None
+    if growth is None or growth.tag != index.tag:
+        print(f"[dataset] no current growth table in {snap_dir}, building it in this process")
+        growth = GrowthTable.build(df)
+    spatial_dir = snap_dir / SPATIAL_DIRNAME
+    spatial = SpatialIndex.load(spatial_dir) if (spatial_dir / "meta.json").exists() else None
+    if _has_coords(df) and (spatial is None or spatial.tag != index.tag):
+        print(f"[dataset] no current spatial index in {snap_dir}, building it in this process")
+        spatial = SpatialIndex(df)
+    return Dataset(df, index, text=text, source=str(snap_dir), version=_version(index.tag),
+                   cube=cube, growth=growth, spatial=spatial if _has_coords(df) else None)
+
+# columns AggregateCube / GrowthTable read from a SQLiteStore
+_AGGREGATE_COLUMNS = ["city_norm", "neigh_norm", "rooms", "deal_date", "price_ils", "price_per_sqm"]
+
+def open_sql_dataset(db_path: str | Path) -> Dataset:
+    """
+    Serve from a database built by SQLiteStore.build (read-only). The rows stay
+    in the database; the cube and growth table are built from it one city at a
+    time, so they equal the ones load_dataset builds from the same data.
+    """
+    store = SQLiteStore(db_path)
+    with stage("build_cube"):
+        cube = AggregateCube.from_frames(store.city_frames(_AGGREGATE_COLUMNS))
+    with stage("build_growth"):
+        growth = build_growth(store)
+    return Dataset(store, None, source=str(db_path), version=_version(store.source), cube=cube, growth=growth)
+
+def build_growth(df: pd.DataFrame | SQLiteStore, today: datetime | None = None,
+                 estimator: str = GROWTH_ESTIMATOR) -> GrowthTable:
+    """GrowthTable.build for a frame or a SQLiteStore (only the long-term window is read)."""
+    if not isinstance(df, SQLiteStore):
+        return GrowthTable.build(df, today, estimator)
+    today = today or datetime.utcnow()
+    cutoff = today - timedelta(days=LONGTERM_YEARS * 365)
+    columns = [c for c in _AGGREGATE_COLUMNS if c != "price_ils"]
+    return GrowthTable.from_frames(df.city_frames(columns, date_from=cutoff), today, estimator)
+
+def _loaded_ids(df: pd.DataFrame, ids: pd.Series) -> np.ndarray:
+    """
+    Mask of the (few, str) ids already in df's tx_id: one vectorized isin over
+    the column against the ids, so no per-row Python work on the dataset.
+    """
+    col = df["tx_id"]
+    if not pd.api.types.is_string_dtype(col):
+        col = col.astype(str)
+    present = col[col.isin(ids)].astype(str)
+    return ids.isin(present).to_numpy()
+
+def append_rows(ds: Dataset, rows: pd.DataFrame) -> tuple[Dataset, int]:
+    """
+    New Dataset = ds + cleaned `rows` (see data_loader.clean_transactions).
+    Rows whose tx_id is already loaded (or repeated within `rows`) are dropped.
+    The indexes and cube are extended and the growth table is refreshed for the
+    touched segments only, rather than rebuilt. Returns (dataset, n_added).
+    """
+    if ds.text is not None:
+        raise ValueError("Attached (shared) datasets are read-only; publish a new snapshot instead.")
+    if not ds.in_memory:
+        raise ValueError("SQLite datasets are read-only; rebuild the database instead.")
+    if "tx_id" in ds.df.columns and "tx_id" in rows.columns:
+        ids = rows["tx_id"].astype(str)
+        rows = rows[~_loaded_ids(ds.df, ids) & ~ids.duplicated().to_numpy()]
+    if len(rows) == 0:
+        return ds, 0
+
+    rows = rows.reindex(columns=ds.df.columns).reset_index(drop=True)
+    rows, base = conform_dtypes(rows, ds.df)
+    start = len(ds.df)
+    df = pd.concat([base, rows], ignore_index=True)
+    index = ds.index.extend(rows, start)
+    cube = ds.cube.extend(rows) if ds.cube is not None else None
+    growth = ds.growth.refresh(df, index, rows) if ds.growth is not None else None
+    spatial = ds.spatial.extend(rows, start) if ds.spatial is not None else None
+    return Dataset(df, index, source=ds.source, version=ds.version, cube=cube, growth=growth,
+                   spatial=spatial), len(rows)
+
+class DatasetStore:
+    """
+    The Dataset currently being served, replaced atomically on reload.
+    Request handlers read `store.current` once and use that object to the end,
+    so in-flight requests finish on the version they started with; the old
+    Dataset is freed when the last of them drops it.
+      - local mode:  watches the CSV (size/mtime), rebuilds with load_dataset
+      - shared mode: watches the published snapshot, re-attaches with attach_dataset
+      - sqlite mode: watches the database file, re-opens it with open_sql_dataset
+    Local mode also accepts delta files (ingest); on a full reload the rows
+    the new source does not contain yet are re-applied in one append.
+    """
+
+    def __init__(self, source: str | Path, mode: str = "local"):
+        self.source = Path(source)
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+        self.reloads = 0
+        self._deltas = []  # cleaned delta rows, in ingest order
+        self._base_version = None
+        self._seen = self._probe()
+        self.current = self._build()
+
+    def _probe(self):
+        """Cheap change marker for the watched source (None if unreadable)."""
+        try:
+            if self.mode == "shared":
+                return snapshot_source(self.source)
+            fp = source_fingerprint(self.source, with_hash=False)
+            return fp["size"], fp["mtime_ns"]
+        except OSError:
+            return None
+
+    def _build(self) -> Dataset:
+        if self.mode == "shared":
+            return attach_dataset(self.source)
+        if self.mode == "sqlite":
+            return open_sql_dataset(self.source)
+        ds = load_dataset(self.source)
+        base = ds.version
+        deltas = self._pending_deltas(ds, base)
+        if deltas:
+            ds, _ = append_rows(ds, pd.concat(deltas, ignore_index=True))
+        ds.version = _delta_version(base, len(deltas))
+        self._deltas = deltas
+        self._base_version = base
+        return ds
+
+    def _pending_deltas(self, ds: Dataset, base: str | None) -> list:
+        """
+        Ingested rows the freshly loaded source does not contain yet: rows whose
+        tx_id is in the source are dropped, and so are deltas left empty.
+        Without a tx_id column nothing can be matched, so all deltas are
+        dropped once the source content changes.
+        """
+        if not self._deltas:
+            return []
+        if "tx_id" not in ds.df.columns:
+            if base == self._base_version:
+                return self._deltas
+            print(f"[dataset] {self.source} changed and has no tx_id; dropping {len(self._deltas)} ingested delta(s)")
+            return []
+        pending = []
+        for rows in self._deltas:
+            if "tx_id" not in rows.columns:  # ingested before the source had tx_id
+                pending.append(rows)
+                continue
+            ids = rows["tx_id"].astype(str)
+            rows = rows[~_loaded_ids(ds.df, ids)]
+            if len(rows):
+                pending.append(rows)
+        return pending
+
+    def ingest(self, delta_path: str | Path) -> dict:
+        """
+        Parse a delta file, drop tx_ids already loaded, and swap in the extended
+        dataset. Work is proportional to the delta (plus one copy of the columns).
+        """
+        if self.mode == "shared":
+            raise ValueError("Shared datasets are read-only; ingest in the publisher and republish.")
+        if self.mode == "sqlite":
+            raise ValueError("SQLite datasets are read-only; rebuild the database with the new deals.")
+        rows = load_transactions_delta(str(delta_path))
+        with self._lock:
+            ds = self.current
+            new, added = append_rows(ds, rows)
+            if added:
+                self._deltas.append(new.df.iloc[len(ds.df):].copy())
+                new.version = _delta_version(self._base_version, len(self._deltas))
+                self.current = new
+        return {"parsed": len(rows), "added": added, "duplicates": len(rows) - added}
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Rebuild and swap in the dataset if the source changed (always when force=True).
+        Returns True when a new Dataset was swapped in. A failed build keeps
+        the current one and is recorded in last_error.
+        """
+        with self._lock:
+            seen = self._probe()
+            if not force and (seen is None or seen == self._seen):
+                return False
+            try:
+                new = self._build()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"[dataset] reload of {self.source} failed, keeping {self.current.version}: {self.last_error}")
+                return False
+            if not force and new.version == self.current.version:
+                self._seen = seen  # touched but same content
+                return False
+            self.current = new
+            self._seen = seen
+            self.last_error = None
+            self.reloads += 1
+            return True
+
+    def rewindow(self, today: datetime | None = None) -> bool:
+        """
+        Recompute the growth table once the day has moved past its as_of: its
+        LONGTERM_YEARS window is anchored on that day, while the dataset is only
+        rebuilt when the source changes. The version is kept (caches are keyed
+        by version and day). Returns True when a new table was swapped in.
+        """
+        today = today or datetime.utcnow()
+        with self._lock:
+            ds = self.current
+            if ds.growth is None or ds.growth.as_of.date() >= today.date():
+                return False
+            new = copy.copy(ds)
+            with stage("build_growth"):
+                new.growth = build_growth(ds.df, today, ds.growth.estimator)
+            self.current = new
+            return True
+
+    def start_watcher(self, interval_s: float) -> None:
+        """Poll the source (and the growth table's day) every interval_s seconds in a daemon thread."""
+        if self._thread is not None or interval_s <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, args=(interval_s,),
+                                        name="dataset-watcher", daemon=True)
+        self._thread.start()
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self, interval_s: float) -> None:
+        while not self._stop.wait(interval_s):
+            self.reload()
+            self.rewindow()
+
+    def status(self) -> dict:
+        ds = self.current
+        return {
+            "mode": self.mode,
+            "version": ds.version,
+            "loaded_at": ds.loaded_at.isoformat(timespec="seconds") + "Z",
+            "n_rows": len(ds.df),
+            "deltas": len(self._deltas),
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+            # what this dataset can serve (sqlite: no spatial comps or heatmap)
+            "features": {"cube": ds.cube is not None, "growth": ds.growth is not None,
+                         "spatial": ds.spatial is not None, "heatmap": ds.in_memory},
+            "growth_as_of": ds.growth.as_of.date().isoformat() if ds.growth is not None else None,
+        }
@@ -1,6 +1,12 @@
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
 import numpy as np
 import pandas as pd
-from config import LONGTERM_MIN
+from config import LONGTERM_MIN, LONGTERM_YEARS, GROWTH_ESTIMATOR, THEIL_SEN_MAX_PAIRS
+from segment_index import group_codes
 
 def estimate_annual_appreciation(longterm_df: pd.DataFrame) -> dict:
     """
@@ -29,3 +35,198 @@ def estimate_annual_appreciation(longterm_df: pd.DataFrame) -> dict:
 
     annual_pct = (np.exp(slope) - 1.0) * 100.0
     return dict(ok=True, annual_pct=float(annual_pct), n_points=int(n), message="ok")
+
+# ---------- precomputed per-segment appreciation ----------
+
+_GROWTH_COLUMNS = ["city_norm", "neigh_norm", "rooms", "annual_pct", "n_points", "span_years"]
+_NS_PER_DAY = 86_400 * 10**9
+
+def _trend_points(df: pd.DataFrame, cutoff: datetime) -> pd.DataFrame:
+    """Rows usable for a trend: in the window, positive ppsqm; x = years (whole days / 365.25), y = log ppsqm."""
+    dates = pd.to_datetime(df['deal_date'], errors='coerce').to_numpy(dtype='datetime64[ns]').view('i8')
+    ppsqm = df['price_per_sqm'].to_numpy(dtype=np.float64)
+    keep = (dates >= int(pd.Timestamp(cutoff).value)) & (ppsqm > 0)
+    neigh = df['neigh_norm'] if 'neigh_norm' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    pts = pd.DataFrame({
+        "city_norm": df['city_norm'].array[keep],   # keeps categoricals: grouping on codes
+        "neigh_norm": neigh.array[keep],
+        "rooms": df['rooms'].to_numpy(dtype=np.float64)[keep],
+        "x": (dates[keep] // _NS_PER_DAY) / 365.25,
+        "y": np.log(ppsqm[keep]),
+    })
+    return pts.dropna(subset=["city_norm", "rooms"])
+
+def _ols_slopes(g: np.ndarray, x: np.ndarray, y: np.ndarray, n_groups: int) -> np.ndarray:
+    """Closed-form least-squares slope of y on x per group (two bincount passes, centered)."""
+    n = np.bincount(g, minlength=n_groups).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        xm = np.bincount(g, x, minlength=n_groups) / n
+        ym = np.bincount(g, y, minlength=n_groups) / n
+        dx = x - xm[g]
+        sxx = np.bincount(g, dx * dx, minlength=n_groups)
+        sxy = np.bincount(g, dx * (y - ym[g]), minlength=n_groups)
+        return sxy / sxx
+
+def _theil_sen_slopes(g: np.ndarray, x: np.ndarray, y: np.ndarray, n_groups: int,
+                      max_pairs: int, seed: int = 0) -> np.ndarray:
+    """
+    Median of pairwise slopes per group. Exact up to max_pairs pairs per group;
+    larger groups use max_pairs random pairs (fixed seed, so results are stable).
+    """
+    rng = np.random.default_rng(seed)
+    order = np.argsort(g, kind="stable")
+    bounds = np.r_[0, np.cumsum(np.bincount(g, minlength=n_groups))]
+    out = np.full(n_groups, np.nan)
+    for k in range(n_groups):
+        idx = order[bounds[k]:bounds[k + 1]]
+        m = len(idx)
+        if m < 2:
+            continue
+        if m * (m - 1) // 2 <= max_pairs:
+            i, j = np.triu_indices(m, 1)
+        else:
+            i, j = rng.integers(0, m, size=(2, max_pairs))
+        dx = x[idx[j]] - x[idx[i]]
+        ok = dx != 0
+        if ok.any():
+            out[k] = np.median((y[idx[j]] - y[idx[i]])[ok] / dx[ok])
+    return out
+
+def segment_trends(df: pd.DataFrame, today: datetime | None = None, estimator: str = GROWTH_ESTIMATOR) -> pd.DataFrame:
+    """
+    Annual appreciation for every (city, neighborhood, rooms) segment and, with
+    neigh_norm None, every (city, rooms): log(ppsqm) trend over the last
+    LONGTERM_YEARS of all the segment's deals (any size).
+    Same validity rules as estimate_annual_appreciation (LONGTERM_MIN points,
+    time span >= 0.5 years); invalid segments get annual_pct NaN.
+    estimator: "ols" (grouped closed form) or "theil_sen".
+    """
+    today = today or datetime.utcnow()
+    pts = _trend_points(df, today - timedelta(days=LONGTERM_YEARS * 365))
+    frames = []
+    for keys in (["city_norm", "neigh_norm", "rooms"], ["city_norm", "rooms"]):
+        sub = pts.dropna(subset=keys)
+        if sub.empty:
+            continue
+        g, table = group_codes(sub, keys)
+        n_groups = len(table)
+        x, y = sub["x"].to_numpy(), sub["y"].to_numpy()
+        if estimator == "theil_sen":
+            slope = _theil_sen_slopes(g, x, y, n_groups, THEIL_SEN_MAX_PAIRS)
+        elif estimator == "ols":
+            slope = _ols_slopes(g, x, y, n_groups)
+        else:
+            raise ValueError(f"Unknown growth estimator: {estimator!r}")
+        n = np.bincount(g, minlength=n_groups)
+        xmin, xmax = np.full(n_groups, np.inf), np.full(n_groups, -np.inf)
+        np.minimum.at(xmin, g, x)
+        np.maximum.at(xmax, g, x)
+        span = xmax - xmin
+
+        table["rooms"] = table["rooms"].astype(np.float64)
+        if "neigh_norm" not in keys:
+            table.insert(1, "neigh_norm", None)
+        table["n_points"] = n
+        table["span_years"] = span
+        valid = (n >= LONGTERM_MIN) & (span >= 0.5)
+        table["annual_pct"] = np.where(valid, (np.exp(slope) - 1.0) * 100.0, np.nan)
+        frames.append(table[_GROWTH_COLUMNS])
+    if not frames:
+        return pd.DataFrame(columns=_GROWTH_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+class GrowthTable:
+    """
+    segment_trends for one dataset, as of one day: lookups by segment key,
+    partial refresh after an append, ranking, and save/load next to a snapshot.
+    """
+
+    def __init__(self, table: pd.DataFrame, as_of: datetime, estimator: str = GROWTH_ESTIMATOR):
+        self.table = table.reset_index(drop=True)
+        self.as_of = as_of
+        self.estimator = estimator
+        self.tag = None
+        self._rows = {(c, None if pd.isna(n) else n, float(r)): i
+                      for i, (c, n, r) in enumerate(zip(self.table["city_norm"], self.table["neigh_norm"], self.table["rooms"]))}
+        self._annual = self.table["annual_pct"].to_numpy(dtype=np.float64)
+        self._n = self.table["n_points"].to_numpy(dtype=np.int64)
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, today: datetime | None = None, estimator: str = GROWTH_ESTIMATOR) -> "GrowthTable":
+        today = today or datetime.utcnow()
+        return cls(segment_trends(df, today, estimator), today, estimator)
+
+    @classmethod
+    def from_frames(cls, frames, today: datetime | None = None,
+                    estimator: str = GROWTH_ESTIMATOR) -> "GrowthTable":
+        """
+        build() over all the rows of `frames`, one frame at a time. Every
+        (city, rooms) segment's rows must be in a single frame (e.g. one frame
+        per city); theil_sen then samples large segments' pairs differently.
+        """
+        today = today or datetime.utcnow()
+        parts = [t for t in (segment_trends(rows, today, estimator) for rows in frames) if len(t)]
+        table = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=_GROWTH_COLUMNS)
+        return cls(table, today, estimator)
+
+    def get(self, city_norm: str, neigh_norm: str | None, rooms: float) -> dict | None:
+        """estimate_annual_appreciation-shaped dict for a segment (None when unknown)."""
+        i = self._rows.get((city_norm, neigh_norm, float(rooms)))
+        if i is None:
+            return None
+        n = int(self._n[i])
+        if np.isnan(self._annual[i]):
+            return dict(ok=False, annual_pct=None, n_points=n,
+                        message=f"Not enough segment deals for a trend (need >= {LONGTERM_MIN} over >= 0.5 years).")
+        return dict(ok=True, annual_pct=float(self._annual[i]), n_points=n, message="ok")
+
+    def refresh(self, df: pd.DataFrame, index, rows: pd.DataFrame) -> "GrowthTable":
+        """
+        New table for `df` (the frame after appending `rows`, indexed by `index`):
+        only the segments `rows` fall into are recomputed, from their rows in df.
+        """
+        cutoff = self.as_of - timedelta(days=LONGTERM_YEARS * 365)
+        neigh = rows['neigh_norm'].astype(object) if 'neigh_norm' in rows.columns else pd.Series(None, index=rows.index)
+        touched = set(zip(rows['city_norm'].astype(object), neigh, rows['rooms'].astype(float)))
+        touched = {(str(c), None if pd.isna(n) else str(n), r) for c, n, r in touched if pd.notna(c) and pd.notna(r)}
+        pos = [index.lookup(c, n, (r, r), date_from=cutoff) for c, n, r in touched]
+        pos += [index.lookup(c, None, (r, r), date_from=cutoff) for c, r in {(c, r) for c, _, r in touched}]
+        sub = df.iloc[np.unique(np.concatenate(pos))] if pos else df.iloc[:0]
+        fresh = segment_trends(sub, self.as_of, self.estimator)
+        fresh_keys = set(zip(fresh["city_norm"], fresh["neigh_norm"], fresh["rooms"].astype(float)))
+        keep = [k not in fresh_keys for k in self._rows]
+        return GrowthTable(pd.concat([self.table[keep], fresh], ignore_index=True), self.as_of, self.estimator)
+
+    def ranking(self, city_norm: str | None = None, rooms: float | None = None, level: str = "neighborhood",
+                min_points: int = LONGTERM_MIN, ascending: bool = False) -> pd.DataFrame:
+        """Valid segments sorted by annual_pct; level "neighborhood" or "city" (city + rooms)."""
+        t = self.table[self.table["annual_pct"].notna() & (self.table["n_points"] >= min_points)]
+        t = t[t["neigh_norm"].notna()] if level == "neighborhood" else t[t["neigh_norm"].isna()]
+        if city_norm is not None:
+            t = t[t["city_norm"] == city_norm]
+        if rooms is not None:
+            t = t[t["rooms"] == float(rooms)]
+        return t.sort_values(["annual_pct", "city_norm", "rooms"], ascending=[ascending, True, True], kind="stable")
+
+    def save(self, path: str | Path, tag: dict | None = None) -> Path:
+        path = Path(path)
+        tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        self.table.to_csv(tmp / "table.csv", index=False)
+        meta = {"tag": tag, "as_of": self.as_of.isoformat(), "estimator": self.estimator}
+        (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path) -> "GrowthTable":
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text())
+        table = pd.read_csv(path / "table.csv", dtype={"city_norm": object, "neigh_norm": object},
+                            float_precision="round_trip")
+        table["neigh_norm"] = table["neigh_norm"].astype(object).where(table["neigh_norm"].notna(), None)
+        obj = cls(table, datetime.fromisoformat(meta["as_of"]), meta["estimator"])
+        obj.tag = meta.get("tag")
+        return obj
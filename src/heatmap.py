@@ -0,0 +1,69 @@
+"""
+Market heatmap: one row per (city, neighborhood, rooms) segment with the
+recent fair ppsqm (median / IQR, as summarize_recent_fair_ppsqm but over all
+the segment's deals in the recent window, any size), recent and 5-year deal
+counts and the segment's appreciation, from one grouped pass over the frame.
+"""
+from __future__ import annotations
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from config import RECENT_YEARS
+from growth import GrowthTable
+from pricing import summarize_fair_ppsqm_grouped
+from segment_index import group_codes
+
+SEGMENT_KEYS = ["city_norm", "neigh_norm", "rooms"]
+HEATMAP_COLUMNS = ["city", "neighborhood", "city_norm", "neigh_norm", "rooms",
+                   "fair_ppsqm", "q1", "q3", "iqr", "recent_n", "sales_last5",
+                   "annual_pct", "growth_n_points"]
+
+def _display(rows: pd.DataFrame, column: str, first: np.ndarray, fallback):
+    return rows[column].to_numpy(dtype=object)[first] if column in rows.columns else fallback
+
+def market_heatmap(df: pd.DataFrame, today: datetime | None = None,
+                   growth: GrowthTable | None = None) -> pd.DataFrame:
+    """
+    Segments with at least one deal in the last 5 years, sorted by city, neighborhood, rooms.
+    city / neighborhood are the display names of the segment's first row.
+    annual_pct / growth_n_points come from `growth` (NaN without it or for short series).
+    """
+    today = today or datetime.utcnow()
+    dates = pd.to_datetime(df["deal_date"], errors="coerce").to_numpy(dtype="datetime64[ns]").view("i8")
+    in_5y = dates >= pd.Timestamp(today - timedelta(days=5 * 365)).value
+    keys = [k for k in SEGMENT_KEYS if k in df.columns]
+    names = [c for c in ("city", "neighborhood") if c in df.columns]  # may be out-of-frame text in shared mode
+    pos = np.flatnonzero(in_5y)
+    rows = df[keys + names + ["price_per_sqm"]].iloc[pos]
+    valid = rows[keys].notna().all(axis=1).to_numpy()
+    pos, rows = pos[valid], rows[valid]
+    if rows.empty:
+        return pd.DataFrame(columns=HEATMAP_COLUMNS)
+
+    g, table = group_codes(rows, keys)
+    n_groups = len(table)
+    recent = dates[pos] >= pd.Timestamp(today - timedelta(days=RECENT_YEARS * 365)).value
+    ppsqm = rows["price_per_sqm"].to_numpy(dtype=np.float64)
+    summary = summarize_fair_ppsqm_grouped(g, np.where(recent, ppsqm, np.nan), n_groups)
+
+    first = np.full(n_groups, len(g))
+    np.minimum.at(first, g, np.arange(len(g)))
+    out = pd.DataFrame({
+        "city": _display(rows, "city", first, table["city_norm"]),
+        "neighborhood": _display(rows, "neighborhood", first, table.get("neigh_norm")),
+        "city_norm": table["city_norm"],
+        "neigh_norm": table.get("neigh_norm"),
+        "rooms": table["rooms"].astype(np.float64),
+        "fair_ppsqm": summary["fair_ppsqm"],
+        "q1": summary["q1"],
+        "q3": summary["q3"],
+        "iqr": summary["iqr"],
+        "recent_n": np.bincount(g, weights=recent, minlength=n_groups).astype(np.int64),
+        "sales_last5": np.bincount(g, minlength=n_groups),
+    })
+    out["annual_pct"], out["growth_n_points"] = np.nan, 0
+    if growth is not None:
+        found = [growth.get(c, n, r) for c, n, r in zip(out["city_norm"], out["neigh_norm"], out["rooms"])]
+        out["annual_pct"] = [f["annual_pct"] if f and f["ok"] else np.nan for f in found]
+        out["growth_n_points"] = [f["n_points"] if f else 0 for f in found]
+    return out.sort_values(["city_norm", "neigh_norm", "rooms"], kind="stable").reset_index(drop=True)
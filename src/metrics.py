@@ -0,0 +1,104 @@
+"""
+Lightweight latency instrumentation (no external dependency).
+  - Histogram: Prometheus-style cumulative buckets per label set
+  - stage(name): times a block into STAGE_SECONDS and, inside a request
+    opened with start_request_timings(), into that request's timings
+    (sent back as a Server-Timing header by the API)
+  - render(): all registered metrics in Prometheus text format
+Cost per timed block is two perf_counter calls, a bisect and a dict update.
+"""
+from __future__ import annotations
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_REGISTRY = []
+
+def _fmt_labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values → [bucket counts..., +Inf count], sum
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in sorted(snapshot):
+            cum = 0
+            for le, c in zip(self.buckets + ("+Inf",), counts):
+                cum += c
+                le_label = 'le="%s"' % le
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, labels, le_label)} {cum}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, labels)} {cum}")
+        return lines
+
+STAGE_SECONDS = Histogram("realestate_stage_seconds", "Time spent per evaluation/loader stage.", ("stage",))
+REQUEST_SECONDS = Histogram("realestate_http_request_seconds", "HTTP request latency.", ("method", "route", "status"))
+
+_request_timings: ContextVar[dict | None] = ContextVar("request_timings", default=None)
+
+def start_request_timings() -> dict:
+    """Collect stage timings for the current request (context) into a fresh dict."""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+@contextmanager
+def stage(name: str):
+    t0 = perf_counter()
+    try:
+        yield
+    finally:
+        dt = perf_counter() - t0
+        STAGE_SECONDS.observe(dt, name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + dt
+
+def server_timing(timings: dict, total: float | None = None) -> str:
+    """Server-Timing header value, durations in milliseconds."""
+    parts = [f"{name};dur={dt * 1000:.2f}" for name, dt in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+def gauge_lines(name: str, help: str, value, labels: dict | None = None, kind: str = "gauge") -> list[str]:
+    """Exposition lines for a single value computed at scrape time (e.g. cache counters)."""
+    labels = labels or {}
+    lbl = _fmt_labels(tuple(labels), tuple(labels.values()))
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name}{lbl} {value}"]
+
+def render(extra_lines: list[str] | None = None) -> str:
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(extra_lines or [])
+    return "\n".join(lines) + "\n"
@@ -1,43 +1,206 @@
-from comps import recent_comps, longterm_buckets, longterm_bucket_summary
-from pricing import summarize_recent_fair_ppsqm, decision_vs_asking
+from datetime import datetime, timedelta
+import numpy as np
+from comps import longterm_bucket_summary, segment_rows, recent_ppsqm_matrix, widened_recent_comps
+from pricing import (
+    summarize_recent_fair_ppsqm, decision_vs_asking,
+    summarize_recent_fair_ppsqm_batch, decision_vs_asking_batch,
+)
 from growth import estimate_annual_appreciation
-from stats import recent_two_years_stats, sales_counts_last5_years
-from config import RECENT_YEARS, MARGIN_PCT
+from stats import recent_two_years_stats
+from context import EvaluationContext
+from utils_text import norm
+from metrics import stage
+from aggregates import period_of
+from config import (
+    RECENT_YEARS, MARGIN_PCT, AREA_FALLBACK_MIN_COMPS, AREA_FALLBACK_MIN_N, GROWTH_SOURCE, SPATIAL_RADIUS_M,
+    RECENT_MIN, RECENT_SEARCH_MODE,
+)
 
-def evaluate_listing(transactions_df, city, neighborhood, rooms, size_sqm, asking_price_ils):
+def evaluate_listing(transactions_df, city, neighborhood, rooms, size_sqm, asking_price_ils,
+                     index=None, text=None, cache=None, version=None, cube=None, growth_table=None,
+                     lat=None, lon=None, spatial=None, as_of=None):
     """
     Orchestrate: recent comps → pricing decision → long-term trend → extra KPIs.
     Returns a single dict the frontend can consume.
+    Pass a SegmentIndex built from transactions_df to avoid full-frame scans,
+    and the TextColumns when transactions_df comes from snapshot.attach_snapshot.
+    With a cache (cache.LRUCache) the asking-price independent part is reused
+    for the same normalized inputs, dataset version and day; only the decision
+    is recomputed. With an aggregates.AggregateCube (and index) the 5-year
+    activity counts are looked up instead of counted over the segment rows,
+    and its price_per_sqm sketches give an area-level fair price when there
+    are fewer than AREA_FALLBACK_MIN_COMPS recent comps, plus the asking
+    price's percentile in the area. With a growth.GrowthTable (and
+    GROWTH_SOURCE = "segment") the appreciation is the segment's precomputed
+    trend instead of a regression over the long-term comps.
+    With the listing's lat / lon and a spatial_index.SpatialIndex, a neighborhood
+    with too few deals takes its comps from the nearest matching deals
+    (see EvaluationContext; comps_scope "nearby").
+    With RECENT_SEARCH_MODE = "adaptive", fewer than RECENT_MIN recent comps
+    widen the search (comps.widened_recent_comps); the steps taken are in
+    comps_widening.
+    transactions_df may be a sql_store.SQLiteStore (DATASET_MODE=sqlite): the
+    comps filters and activity counts are then indexed queries.
+    With as_of (a datetime) the listing is evaluated as on that date, from the
+    deals dated before it only (see EvaluationContext). The cube and growth
+    table summarize the whole history, so they are not used then.
     """
+    today = as_of or datetime.utcnow()
+    if as_of is not None:
+        cube, growth_table = None, None
+    key = market_key(city, neighborhood, rooms, size_sqm, version, today, lat, lon, as_of is not None)
+    market = None
+    if cache is not None:
+        with stage("cache"):
+            market = cache.get(key)
+    if market is None:
+        # 0) filter the listing's segment once; all stages below share it
+        with stage("segment"):
+            ctx = EvaluationContext(transactions_df, city, neighborhood, rooms, size_sqm, today=today, index=index,
+                                    lat=lat, lon=lon, spatial=spatial, as_of=as_of)
+        market = _market_part(ctx, text, cube, growth_table)
+        if cache is not None:
+            cache.put(key, market)
+    return _with_decision(market, city, neighborhood, rooms, size_sqm, asking_price_ils)
+
+def market_key(city, neighborhood, rooms, size_sqm, version, today, lat=None, lon=None, historical=False):
+    """Cache key of everything in a result that does not depend on the asking price."""
+    return (version, norm(city), norm(neighborhood), float(rooms), float(size_sqm), today.date(), lat, lon,
+            historical)
+
+def _records(df, text=None):
+    if df is None:
+        return []
+    return text.records(df) if text is not None else df.to_dict(orient="records")
+
+def _evaluate_context(ctx: EvaluationContext, asking_price_ils, text=None, cube=None, growth_table=None):
+    market = _market_part(ctx, text, cube, growth_table)
+    return _with_decision(market, ctx.city, ctx.neighborhood, ctx.rooms, ctx.size_sqm, asking_price_ils)
+
+def _market_part(ctx: EvaluationContext, text=None, cube=None, growth_table=None):
+    """Comps, fair price, trend and activity: the result minus inputs and decision."""
     messages = []
+    city, neighborhood, rooms = ctx.city, ctx.neighborhood, ctx.rooms
+    if ctx.scope == "nearby":
+        messages.append(f"Few deals in the neighborhood; comps are the {len(ctx.candidate_pos)} nearest "
+                        f"matching deals within {SPATIAL_RADIUS_M} m.")
 
     # 1) recent comps (last 2y)
-    rec = recent_comps(transactions_df, city, neighborhood, rooms, size_sqm)
+    with stage("recent_comps"):
+        rec = ctx.recent_comps()
+        widening = []
+        if _widens(len(rec)) and ctx.scope == "segment":
+            rec, widening = widened_recent_comps(ctx.df, city, neighborhood, rooms, ctx.size_sqm, ctx.today,
+                                                 index=ctx.index, as_of=ctx.as_of)
+    if widening:
+        messages.append(f"Fewer than {RECENT_MIN} recent comps matched; widened the search: "
+                        f"{', '.join(_describe_step(s) for s in widening)} ({widening[-1]['n']} matches).")
     recent_summary = None
-    decision = None
 
     if rec is None or len(rec) == 0:
         messages.append("No recent comps found with the given filters.")
     else:
-        recent_summary = summarize_recent_fair_ppsqm(rec)
+        with stage("fair_price"):
+            recent_summary = summarize_recent_fair_ppsqm(rec)
         if not recent_summary.get("ok"):
             messages.append("Not enough recent comps to compute a stable fair price.")
+
+    # 1b) area-level price distribution (recent quarters), widened until it has enough deals
+    area_summary, area_sketch = None, None
+    if cube is not None:
+        with stage("area_sketch"):
+            area_summary, area_sketch = _area_distribution(cube, city, neighborhood, rooms, ctx.today)
+    fair_source = _fair_price_source(recent_summary, area_summary, messages)
+
+    # 2) long term (exclude last RECENT_YEARS by design in comps.longterm_buckets)
+    with stage("longterm"):
+        lt = ctx.longterm_comps()
+    with stage("growth"):
+        growth = _segment_growth(growth_table, city, neighborhood, rooms)
+        if growth is None:
+            growth = {**estimate_annual_appreciation(lt), "source": "comps"}
+    with stage("longterm_summary"):
+        lt_summary = longterm_bucket_summary(lt, today=ctx.today)  # NEW: mean per bucket for charts
+
+    # 3) extra KPIs on top of recent comps + area activity
+    with stage("stats"):
+        recent_kpis = recent_two_years_stats(rec)
+        if cube is not None and ctx.index is not None:
+            activity_5y = cube.sales_counts(ctx.index, city, neighborhood, rooms, today=ctx.today)
         else:
+            activity_5y = ctx.sales_counts()
+
+    with stage("serialize"):
+        recent_records, lt_records = _records(rec, text), _records(lt, text)
+
+    return {
+        "as_of": ctx.as_of.date().isoformat() if ctx.as_of is not None else None,
+        "comps_scope": ctx.scope,
+        "comps_widening": widening,
+        "recent_comps": recent_records,
+        "recent_summary": recent_summary,
+        "recent_kpis": recent_kpis,                 # NEW (4,5,6)
+        "longterm_buckets": lt_records,
+        "longterm_bucket_summary": lt_summary,      # NEW (3)
+        "growth": growth,
+        "sales_last5": activity_5y,                 # NEW (7)
+        "area_summary": area_summary,
+        "fair_price_source": fair_source,
+        "area_sketch": area_sketch,                 # internal: asking percentile in _with_decision
+        "messages": messages,
+    }
+
+def _widens(n_recent: int) -> bool:
+    return RECENT_SEARCH_MODE == "adaptive" and n_recent < RECENT_MIN
+
+def _describe_step(step: dict) -> str:
+    value = step["value"]
+    return {"size": lambda: f"size ±{value:.0%}", "rooms": lambda: f"rooms ±{value:g}",
+            "neighborhood": lambda: "whole city", "time": lambda: f"last {value:g} years"}[step["step"]]()
+
+def _segment_growth(growth_table, city, neighborhood, rooms):
+    """Precomputed trend of the neighborhood segment, else of the city + rooms; None → use comps."""
+    if growth_table is None or GROWTH_SOURCE != "segment":
+        return None
+    c = norm(city)
+    for scope, n in (("neighborhood", norm(neighborhood)), ("city", None)):
+        found = growth_table.get(c, n, rooms)
+        if found is not None:
+            return {**found, "source": "segment", "scope": scope, "as_of": growth_table.as_of.date().isoformat()}
+    return None
+
+def _area_distribution(cube, city, neighborhood, rooms, today):
+    """(summary with scope, sketch) of recent area ppsqm, or (None, None) if no scope has enough deals."""
+    since = period_of(today - timedelta(days=365 * RECENT_YEARS))
+    scope, sketch = cube.area_sketch(city, neighborhood, rooms, since, AREA_FALLBACK_MIN_N)
+    if scope is None:
+        return None, None
+    return {**sketch.summary(), "scope": scope, "since": f"{since // 4}Q{since % 4 + 1}"}, sketch
+
+def _fair_price_source(recent_summary, area_summary, messages):
+    """'recent_comps', 'area' (too few comps, area distribution available) or None."""
+    source = "recent_comps" if recent_summary is not None and recent_summary.get("ok") else None
+    if area_summary is not None and (source is None or recent_summary["n"] < AREA_FALLBACK_MIN_COMPS):
+        source = "area"
+        messages.append(f"Few recent comps; fair price taken from the {area_summary['scope'].replace('_', ' + ')} "
+                        f"price distribution ({area_summary['n']} deals since {area_summary['since']}).")
+    return source
+
+def _with_decision(market, city, neighborhood, rooms, size_sqm, asking_price_ils):
+    """Full evaluate_listing dict from a (possibly cached, never modified) market part."""
+    recent_summary = market["recent_summary"]
+    fair = market["area_summary"] if market["fair_price_source"] == "area" else recent_summary
+    decision = None
+    if fair is not None and fair.get("ok"):
+        with stage("decision"):
             decision = decision_vs_asking(
-                fair_ppsqm=recent_summary["fair_ppsqm"],
+                fair_ppsqm=fair["fair_ppsqm"],
                 size_sqm=size_sqm,
                 asking_price_ils=asking_price_ils,
                 margin_pct=MARGIN_PCT,
             )
-
-    # 2) long term (exclude last RECENT_YEARS by design in comps.longterm_buckets)
-    lt = longterm_buckets(transactions_df, city, neighborhood, rooms, size_sqm)
-    growth = estimate_annual_appreciation(lt)
-    lt_summary = longterm_bucket_summary(lt)  # NEW: mean per bucket for charts
-
-    # 3) extra KPIs on top of recent comps + area activity
-    recent_kpis = recent_two_years_stats(rec)
-    activity_5y = sales_counts_last5_years(transactions_df, city, neighborhood, rooms)
+    sketch = market["area_sketch"]
+    asking_percentile = sketch.percentile_rank(asking_price_ils / size_sqm) if sketch is not None and size_sqm else None
 
     return {
         "inputs": {
@@ -47,13 +210,149 @@ def evaluate_listing(transactions_df, city, neighborhood, rooms, size_sqm, askin
             "size_sqm": size_sqm,
             "asking_price_ils": asking_price_ils,
         },
-        "recent_comps": rec.to_dict(orient="records") if rec is not None else [],
+        "as_of": market["as_of"],
+        "comps_scope": market["comps_scope"],
+        "comps_widening": market["comps_widening"],
+        "recent_comps": market["recent_comps"],
         "recent_summary": recent_summary,
         "decision": decision,
-        "recent_kpis": recent_kpis,                 # NEW (4,5,6)
-        "longterm_buckets": lt.to_dict(orient="records") if lt is not None else [],
-        "longterm_bucket_summary": lt_summary,      # NEW (3)
-        "growth": growth,
-        "sales_last5": activity_5y,                 # NEW (7)
-        "messages": messages,
-    }
\ No newline at end of file
+        "recent_kpis": market["recent_kpis"],
+        "longterm_buckets": market["longterm_buckets"],
+        "longterm_bucket_summary": market["longterm_bucket_summary"],
+        "growth": market["growth"],
+        "sales_last5": market["sales_last5"],
+        "area_summary": market["area_summary"],
+        "fair_price_source": market["fair_price_source"],
+        "asking_percentile": asking_percentile,     # % of recent area deals with a lower ppsqm
+        "messages": list(market["messages"]),
+    }
+
+_BATCH_KEYS = ("inputs", "as_of", "recent_summary", "fair_price_source", "decision", "messages")
+
+def evaluate_listings_batch(transactions_df, listings, index=None, detail=False, today=None, text=None,
+                            cube=None, growth_table=None, spatial=None):
+    """
+    Evaluate many listings at once.
+    Listings (dicts with the evaluate_listing inputs) are grouped by segment
+    (city, neighborhood, rooms); each segment is filtered once and the fair
+    price and decision for all its listings are computed over arrays.
+    Returns one result per listing, in input order:
+      - detail=False: inputs, as_of, recent_summary, fair_price_source, decision, messages
+      - detail=True:  the full evaluate_listing dict
+    Listings may carry lat / lon (used with `spatial` as in evaluate_listing);
+    those that end up with nearby comps, or whose comps are widened
+    (RECENT_SEARCH_MODE = "adaptive"), are evaluated one by one. So are those
+    with an as_of (a datetime, see evaluate_listing).
+    """
+    today = today or datetime.utcnow()
+    results = [None] * len(listings)
+
+    groups = {}
+    for i, listing in enumerate(listings):
+        if listing.get("as_of") is not None:
+            full = evaluate_listing(transactions_df, listing["city"], listing["neighborhood"], listing["rooms"],
+                                    listing["size_sqm"], listing["asking_price_ils"], index=index, text=text,
+                                    lat=listing.get("lat"), lon=listing.get("lon"), spatial=spatial,
+                                    as_of=listing["as_of"])
+            results[i] = full if detail else {k: full[k] for k in _BATCH_KEYS}
+            continue
+        key = (norm(listing["city"]), norm(listing["neighborhood"]), float(listing["rooms"]))
+        groups.setdefault(key, []).append(i)
+
+    for ids in groups.values():
+        first = listings[ids[0]]
+        with stage("segment"):
+            segment = segment_rows(transactions_df, first["city"], first["neighborhood"], first["rooms"], index=index)
+
+        if spatial is not None and not detail:
+            rest = []
+            for i in ids:
+                l = listings[i]
+                if l.get("lat") is None or l.get("lon") is None:
+                    rest.append(i)
+                    continue
+                ctx = EvaluationContext(transactions_df, l["city"], l["neighborhood"], l["rooms"], l["size_sqm"],
+                                        today=today, index=index, segment=segment,
+                                        lat=l["lat"], lon=l["lon"], spatial=spatial)
+                if ctx.scope != "nearby":
+                    rest.append(i)
+                    continue
+                full = _evaluate_context(ctx, l["asking_price_ils"], text=text, cube=cube, growth_table=growth_table)
+                results[i] = {k: full[k] for k in _BATCH_KEYS}
+            ids = rest
+            if not ids:
+                continue
+
+        if detail:
+            for i in ids:
+                l = listings[i]
+                ctx = EvaluationContext(transactions_df, l["city"], l["neighborhood"], l["rooms"],
+                                        l["size_sqm"], today=today, index=index, segment=segment,
+                                        lat=l.get("lat"), lon=l.get("lon"), spatial=spatial)
+                results[i] = _evaluate_context(ctx, l["asking_price_ils"], text=text, cube=cube,
+                                               growth_table=growth_table)
+            continue
+
+        sizes = np.array([listings[i]["size_sqm"] for i in ids], dtype=np.float64)
+        asking = np.array([listings[i]["asking_price_ils"] for i in ids], dtype=np.float64)
+        with stage("recent_comps"):
+            ppsqm, n_comps = recent_ppsqm_matrix(segment, sizes, today)
+        with stage("fair_price"):
+            summary = summarize_recent_fair_ppsqm_batch(ppsqm)
+        with stage("decision"):
+            dec = decision_vs_asking_batch(summary["fair_ppsqm"], sizes, asking, MARGIN_PCT)
+        area_summary = None
+        if cube is not None:
+            with stage("area_sketch"):
+                area_summary, _ = _area_distribution(cube, first["city"], first["neighborhood"], first["rooms"], today)
+
+        for j, i in enumerate(ids):
+            l = listings[i]
+            if _widens(n_comps[j]):
+                ctx = EvaluationContext(transactions_df, l["city"], l["neighborhood"], l["rooms"], l["size_sqm"],
+                                        today=today, index=index, segment=segment)
+                full = _evaluate_context(ctx, l["asking_price_ils"], text=text, cube=cube, growth_table=growth_table)
+                results[i] = {k: full[k] for k in _BATCH_KEYS}
+                continue
+            messages = []
+            recent_summary = None
+            decision = None
+            if n_comps[j] == 0:
+                messages.append("No recent comps found with the given filters.")
+            elif summary["n"][j] == 0:
+                recent_summary = dict(ok=False, fair_ppsqm=None, message="No valid ppsqm in comps.")
+                messages.append("Not enough recent comps to compute a stable fair price.")
+            else:
+                recent_summary = dict(
+                    ok=True,
+                    fair_ppsqm=float(summary["fair_ppsqm"][j]),
+                    q1=float(summary["q1"][j]),
+                    q3=float(summary["q3"][j]),
+                    iqr=float(summary["iqr"][j]),
+                    n=int(summary["n"][j]),
+                )
+                decision = {
+                    "label": str(dec["label"][j]),
+                    "diff_pct": float(dec["diff_pct"][j]),
+                    "fair_range": [float(dec["low"][j]), float(dec["high"][j])],
+                }
+            fair_source = _fair_price_source(recent_summary, area_summary, messages)
+            if fair_source == "area":
+                decision = decision_vs_asking(area_summary["fair_ppsqm"], l["size_sqm"],
+                                              l["asking_price_ils"], MARGIN_PCT)
+            results[i] = {
+                "inputs": {
+                    "city": l["city"],
+                    "neighborhood": l["neighborhood"],
+                    "rooms": l["rooms"],
+                    "size_sqm": l["size_sqm"],
+                    "asking_price_ils": l["asking_price_ils"],
+                },
+                "as_of": None,
+                "recent_summary": recent_summary,
+                "fair_price_source": fair_source,
+                "decision": decision,
+                "messages": messages,
+            }
+
+    return results
@@ -1,3 +1,4 @@
+import warnings
 import numpy as np
 import pandas as pd
 from config import MARGIN_PCT
@@ -15,6 +16,56 @@ def summarize_recent_fair_ppsqm(recent_df: pd.DataFrame) -> dict:
     q1, q3 = float(np.percentile(s, 25)), float(np.percentile(s, 75))
     return dict(ok=True, fair_ppsqm=fair, q1=q1, q3=q3, iqr=q3-q1, n=len(s))
 
+def summarize_recent_fair_ppsqm_batch(ppsqm: np.ndarray) -> dict:
+    """
+    summarize_recent_fair_ppsqm over many listings at once.
+    ppsqm: (n_listings, k) comps ppsqm, NaN-padded.
+    Returns arrays fair_ppsqm, q1, q3, iqr, n (NaN where a row has no valid value).
+    """
+    n = (~np.isnan(ppsqm)).sum(axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN rows
+        fair = np.nanmedian(ppsqm, axis=1)
+        q1 = np.nanpercentile(ppsqm, 25, axis=1)
+        q3 = np.nanpercentile(ppsqm, 75, axis=1)
+    return dict(fair_ppsqm=fair, q1=q1, q3=q3, iqr=q3 - q1, n=n)
+
+def _lerp(a, b, t):
+    # np.percentile's linear interpolation, term for term (same rounding)
+    diff = b - a
+    return np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+
+def summarize_fair_ppsqm_grouped(group_ids: np.ndarray, ppsqm: np.ndarray, n_groups: int) -> dict:
+    """
+    summarize_recent_fair_ppsqm for every group in one pass: one sort by
+    (group, ppsqm), then order statistics by position.
+    group_ids: group per value (0..n_groups-1); NaN values are ignored.
+    Returns arrays fair_ppsqm, q1, q3, iqr, n (NaN where a group has no value).
+    """
+    keep = ~np.isnan(ppsqm)
+    g, v = group_ids[keep], ppsqm[keep]
+    order = np.lexsort((v, g))
+    v = v[order]
+    n = np.bincount(g, minlength=n_groups)
+    start = np.r_[0, np.cumsum(n)[:-1]]
+    has = n > 0
+    s, m = start[has], n[has]
+
+    def at(q):
+        pos = q * (m - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, m - 1)
+        return _lerp(v[s + lo], v[s + hi], pos - lo)
+
+    out = {k: np.full(n_groups, np.nan) for k in ("fair_ppsqm", "q1", "q3")}
+    mid_lo, mid_hi = s + (m - 1) // 2, s + m // 2
+    out["fair_ppsqm"][has] = (v[mid_lo] + v[mid_hi]) / 2.0   # np.median: mean of the middle pair
+    out["q1"][has] = at(0.25)
+    out["q3"][has] = at(0.75)
+    out["iqr"] = out["q3"] - out["q1"]
+    out["n"] = n
+    return out
+
 def price_range_from_fair_ppsqm(fair_ppsqm: float, size_sqm: float,
                                 margin_pct: float = MARGIN_PCT) -> tuple[float, float]:
     base = fair_ppsqm * size_sqm
@@ -42,3 +93,17 @@ def decision_vs_asking(fair_ppsqm, size_sqm, asking_price_ils, margin_pct):
         "diff_pct": diff_pct,
         "fair_range": [low, high],
     }
+
+def decision_vs_asking_batch(fair_ppsqm, size_sqm, asking_price_ils, margin_pct) -> dict:
+    """
+    decision_vs_asking over arrays. Returns arrays label, diff_pct, low, high.
+    """
+    fair_price = np.asarray(fair_ppsqm, dtype=np.float64) * np.asarray(size_sqm, dtype=np.float64)
+    asking = np.asarray(asking_price_ils, dtype=np.float64)
+    low = fair_price * (1 - margin_pct)
+    high = fair_price * (1 + margin_pct)
+
+    label = np.where(asking < low, "cheap", np.where(asking > high, "expensive", "fair"))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        diff_pct = (asking - fair_price) / fair_price * 100.0
+    return dict(label=label, diff_pct=diff_pct, low=low, high=high)
@@ -0,0 +1,311 @@
+"""
+Prebuilt index for comparable lookups.
+Rows are grouped into segments keyed by (city_norm, neigh_norm, rooms).
+Inside each segment we keep row positions sorted by size_sqm and by deal_date,
+so size tolerance and date cutoffs become binary searches instead of
+boolean masks over the whole transactions table.
+"""
+from __future__ import annotations
+import json
+import os
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+NAT_NS = np.iinfo(np.int64).min
+_ARRAYS = ("by_size", "by_date", "size_sorted", "date_at_size", "date_sorted", "offsets")
+
+def _opt_str(value) -> str | None:
+    return None if value is None else str(value)
+
+def to_ns(value) -> int:
+    """Datetime-like → int64 nanoseconds (same scale as the index date arrays)."""
+    return int(pd.Timestamp(value).value)
+
+def _date_ns(df: pd.DataFrame) -> np.ndarray:
+    dates = pd.to_datetime(df['deal_date'], errors='coerce')
+    return dates.to_numpy(dtype='datetime64[ns]').view('i8')
+
+def dates_at(df: pd.DataFrame, pos: np.ndarray | None = None) -> np.ndarray:
+    """deal_date (at positions pos) as datetime64 in the column's own unit; the column itself is not copied."""
+    col = df['deal_date']
+    values = col.to_numpy() if col.dtype.kind == 'M' else pd.to_datetime(col, errors='coerce').to_numpy()
+    return values if pos is None else values[pos]
+
+def equals_at(col: pd.Series, value, pos: np.ndarray | None = None) -> np.ndarray:
+    """col == value as a bool array (over col at positions pos), on the codes when categorical."""
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        codes = col.array.codes  # read-only view (cat.codes copies)
+        codes = codes if pos is None else codes[pos]
+        code = col.cat.categories.get_indexer([value])[0]
+        return codes == code if code >= 0 else np.zeros(len(codes), dtype=bool)
+    values = col if pos is None else col.iloc[pos]
+    return (values == value).to_numpy()
+
+def on_or_after(dates: np.ndarray, when) -> np.ndarray:
+    """dates >= when, exactly: `when` is rounded up to the unit of dates rather than converting them."""
+    unit = np.datetime_data(dates.dtype)[0]
+    w = np.datetime64(to_ns(when), 'ns')
+    w_unit = w.astype(f'datetime64[{unit}]')
+    if w_unit.astype('datetime64[ns]') < w:
+        w_unit += np.timedelta64(1, unit)
+    return dates >= w_unit
+
+def before(dates: np.ndarray, when) -> np.ndarray:
+    """dates < when, exactly (NaT is not before anything); complement of on_or_after for dated rows."""
+    return ~on_or_after(dates, when) & ~np.isnat(dates)
+
+def group_codes(frame: pd.DataFrame, keys: list[str]) -> tuple[np.ndarray, pd.DataFrame]:
+    """
+    Group id per row of `frame` for the key columns (no NaN keys expected),
+    plus one row of key values (object dtype) per group, in first-seen order.
+    Hash-based (factorize), so no sort of the whole frame as in groupby(sort=True).
+    """
+    factors = [pd.factorize(frame[k]) for k in keys]
+    key = np.zeros(len(frame), dtype=np.int64)
+    for codes, uniques in factors:
+        key = key * len(uniques) + codes
+    g, uniq = pd.factorize(key)
+    first = np.full(len(uniq), len(g))
+    np.minimum.at(first, g, np.arange(len(g)))
+    table = pd.DataFrame({k: np.asarray(uniques, dtype=object)[codes[first]]
+                          for k, (codes, uniques) in zip(keys, factors)})
+    return g, table
+
+class SegmentIndex:
+    """
+    Positions (0..len(df)-1) of `df` grouped by segment.
+    The index is only valid for the exact frame it was built from.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.n_rows = len(df)
+        self.tag = None
+
+        city_codes, city_uni = pd.factorize(df['city_norm'])
+        if 'neigh_norm' in df.columns:
+            neigh_codes, neigh_uni = pd.factorize(df['neigh_norm'])
+        else:
+            neigh_codes, neigh_uni = np.zeros(len(df), dtype=np.int64), pd.Index([None])
+        room_codes, room_uni = pd.factorize(df['rooms'])
+
+        size = df['size_sqm'].to_numpy(dtype=np.float64)
+        dates = _date_ns(df)
+
+        n_neigh, n_rooms = max(len(neigh_uni), 1), max(len(room_uni), 1)
+        key = (city_codes.astype(np.int64) * n_neigh + neigh_codes) * n_rooms + room_codes
+        valid = (city_codes >= 0) & (neigh_codes >= 0) & (room_codes >= 0)
+
+        pos = np.flatnonzero(valid)
+        k = key[pos]
+        self._by_size = pos[np.lexsort((size[pos], k))]
+        self._by_date = pos[np.lexsort((dates[pos], k))]
+        self._size_sorted = size[self._by_size]
+        self._date_at_size = dates[self._by_size]
+        self._date_sorted = dates[self._by_date]
+
+        ks = key[self._by_size]
+        starts = np.flatnonzero(np.r_[True, ks[1:] != ks[:-1]]) if len(ks) else np.array([], dtype=np.int64)
+        self._offsets = np.r_[starts, len(ks)].astype(np.int64)
+
+        seg_keys = [(str(city_uni[city_codes[p]]), _opt_str(neigh_uni[neigh_codes[p]]), float(room_uni[room_codes[p]]))
+                    for p in self._by_size[starts]]
+
+        # neighborhoods that have any row at all (regardless of rooms)
+        has_neigh = (city_codes >= 0) & (neigh_codes >= 0)
+        pairs = np.unique(city_codes[has_neigh].astype(np.int64) * n_neigh + neigh_codes[has_neigh])
+        neighborhoods = [(str(city_uni[p // n_neigh]), _opt_str(neigh_uni[p % n_neigh])) for p in pairs]
+        self._init_tables(seg_keys, neighborhoods)
+
+    def _init_tables(self, seg_keys: list, neighborhoods: list) -> None:
+        self._seg_keys = seg_keys
+        # (city, neigh) → [(rooms, segment id), ...] sorted by rooms
+        self._segments: dict[tuple, list[tuple[float, int]]] = {}
+        self._city_neighs: dict[str, list] = {}
+        for seg_id, (c, n, r) in enumerate(seg_keys):
+            self._segments.setdefault((c, n), []).append((r, seg_id))
+        for (c, n), lst in self._segments.items():
+            lst.sort()
+            self._city_neighs.setdefault(c, []).append(n)
+        self._neighborhoods = {(c, n) for c, n in neighborhoods}
+
+    def save(self, path: str | Path, tag: dict | None = None) -> Path:
+        """
+        Persist the index as .npy arrays + meta.json (written to a temp dir, then renamed),
+        so other processes can memory-map it with SegmentIndex.load.
+        `tag` is stored as-is, e.g. to tie the index to a snapshot.
+        """
+        path = Path(path)
+        tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for name in _ARRAYS:
+            np.save(tmp / f"{name}.npy", getattr(self, f"_{name}"), allow_pickle=False)
+        meta = {"n_rows": self.n_rows, "tag": tag, "segments": self._seg_keys,
+                "neighborhoods": sorted(self._neighborhoods, key=str)}
+        (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "SegmentIndex":
+        """Attach to a saved index; arrays are memory-mapped read-only when mmap=True."""
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text())
+        obj = cls.__new__(cls)
+        obj.n_rows = meta["n_rows"]
+        obj.tag = meta.get("tag")
+        for name in _ARRAYS:
+            arr = np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None, allow_pickle=False)
+            setattr(obj, f"_{name}", arr.view(np.ndarray))
+        obj._init_tables([tuple(k) for k in meta["segments"]], [tuple(p) for p in meta["neighborhoods"]])
+        return obj
+
+    def extend(self, rows: pd.DataFrame, start: int) -> "SegmentIndex":
+        """
+        New index for the frame with `rows` appended at positions start.. (start == n_rows).
+        The new entries are sorted among themselves and merged into the existing
+        arrays by binary search, so nothing already indexed is re-sorted.
+        Lookups give the same positions as SegmentIndex(full_frame); self is unchanged.
+        """
+        if start != self.n_rows:
+            raise ValueError(f"rows must be appended at position {self.n_rows}, got {start}")
+        k = len(rows)
+        if k == 0:
+            return self
+
+        city = rows['city_norm'].to_numpy(dtype=object)
+        neigh = rows['neigh_norm'].to_numpy(dtype=object) if 'neigh_norm' in rows.columns else np.full(k, None, dtype=object)
+        rooms = rows['rooms'].to_numpy(dtype=np.float64)
+        has_neigh = pd.notna(city) & (pd.notna(neigh) if 'neigh_norm' in rows.columns else True)
+        valid = has_neigh & ~np.isnan(rooms)
+
+        seg_keys = list(self._seg_keys)
+        seg_of = {key: i for i, key in enumerate(seg_keys)}
+        neighborhoods = set(self._neighborhoods)
+        for c, n in zip(city[has_neigh], neigh[has_neigh]):
+            neighborhoods.add((str(c), _opt_str(n)))
+
+        seg = np.empty(int(valid.sum()), dtype=np.int64)
+        for j, (c, n, r) in enumerate(zip(city[valid], neigh[valid], rooms[valid])):
+            key = (str(c), _opt_str(n), float(r))
+            if key not in seg_of:
+                seg_of[key] = len(seg_keys)
+                seg_keys.append(key)
+            seg[j] = seg_of[key]
+
+        pos = start + np.flatnonzero(valid)
+        size = rows['size_sqm'].to_numpy(dtype=np.float64)[valid]
+        dates = _date_ns(rows)[valid]
+
+        n_seg = len(seg_keys)
+        offsets = np.r_[self._offsets, np.full(n_seg - self.n_segments, self._offsets[-1])]
+
+        def merge(values, sorted_old, by_old, extra_old=None, extra_new=None):
+            # new entries ordered by (segment, value, position), then inserted after
+            # equal existing values of their segment: same order a full lexsort gives
+            order = np.lexsort((values, seg))
+            s, v = seg[order], values[order]
+            at = np.empty(len(order), dtype=np.int64)
+            runs = np.flatnonzero(np.r_[True, s[1:] != s[:-1]]) if len(s) else np.array([], dtype=np.int64)
+            for i, j in zip(runs, np.r_[runs[1:], len(s)]):
+                a, b = offsets[s[i]], offsets[s[i] + 1]
+                at[i:j] = a + np.searchsorted(sorted_old[a:b], v[i:j], side='right')
+            out = [np.insert(by_old, at, pos[order]), np.insert(sorted_old, at, v)]
+            if extra_old is not None:
+                out.append(np.insert(extra_old, at, extra_new[order]))
+            return out
+
+        obj = SegmentIndex.__new__(SegmentIndex)
+        obj.n_rows = start + k
+        obj.tag = None
+        obj._by_size, obj._size_sorted, obj._date_at_size = merge(size, self._size_sorted, self._by_size,
+                                                                   self._date_at_size, dates)
+        obj._by_date, obj._date_sorted = merge(dates, self._date_sorted, self._by_date)
+        obj._offsets = (offsets + np.r_[0, np.cumsum(np.bincount(seg, minlength=n_seg))]).astype(np.int64)
+        obj._init_tables(seg_keys, neighborhoods)
+        return obj
+
+    @property
+    def n_segments(self) -> int:
+        return len(self._offsets) - 1
+
+    def has_neighborhood(self, city_norm: str, neigh_norm: str, date_to=None) -> bool:
+        """Any row of the neighborhood (any rooms); with date_to, any dated before it."""
+        if date_to is None:
+            return (city_norm, neigh_norm) in self._neighborhoods
+        return self.count_dates(city_norm, neigh_norm, (-np.inf, np.inf), NAT_NS + 1, to_ns(date_to)) > 0
+
+    def segments(self, city_norm: str, neigh_norm: str | None,
+                 rooms_range: tuple[float, float]) -> list[int]:
+        """
+        Segment ids for a city (all neighborhoods when neigh_norm is None)
+        whose rooms value lies within rooms_range (inclusive).
+        """
+        neighs = self._city_neighs.get(city_norm, []) if neigh_norm is None else [neigh_norm]
+        lo, hi = rooms_range
+        out = []
+        for n in neighs:
+            for r, seg_id in self._segments.get((city_norm, n), []):
+                if lo <= r <= hi:
+                    out.append(seg_id)
+        return out
+
+    def lookup(self, city_norm: str, neigh_norm: str | None,
+               rooms_range: tuple[float, float],
+               size_range: tuple[float, float] | None = None,
+               date_from=None, date_to=None) -> np.ndarray:
+        """
+        Positions of matching rows, ascending (i.e. in frame order).
+          - size_range: inclusive (low, high) on size_sqm
+          - date_from: keep deal_date >= date_from
+          - date_to: keep deal_date < date_to (rows without a date are dropped)
+        """
+        d0 = to_ns(date_from) if date_from is not None else None
+        d1 = to_ns(date_to) if date_to is not None else None
+        if d1 is not None and d0 is None:
+            d0 = NAT_NS + 1
+        parts = []
+        for s in self.segments(city_norm, neigh_norm, rooms_range):
+            a, b = self._offsets[s], self._offsets[s + 1]
+            if size_range is not None:
+                sizes = self._size_sorted[a:b]
+                lo = a + np.searchsorted(sizes, size_range[0], side='left')
+                hi = a + np.searchsorted(sizes, size_range[1], side='right')
+                p = self._by_size[lo:hi]
+                if d0 is not None:
+                    dates = self._date_at_size[lo:hi]
+                    p = p[(dates >= d0) & (dates < d1)] if d1 is not None else p[dates >= d0]
+            elif d0 is not None:
+                dates = self._date_sorted[a:b]
+                lo = a + np.searchsorted(dates, d0, side='left')
+                hi = a + np.searchsorted(dates, d1, side='left') if d1 is not None else b
+                p = self._by_date[lo:hi]
+            else:
+                p = self._by_size[a:b]
+            parts.append(p)
+        if not parts:
+            return np.array([], dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+    def size_bounds(self, seg_id: int, size_range: tuple[float, float]) -> tuple[int, int]:
+        """[lo, hi) of a segment's rows with size_sqm in size_range (inclusive), in size order."""
+        a, b = self._offsets[seg_id], self._offsets[seg_id + 1]
+        sizes = self._size_sorted[a:b]
+        return (int(a + np.searchsorted(sizes, size_range[0], side='left')),
+                int(a + np.searchsorted(sizes, size_range[1], side='right')))
+
+    def size_slice(self, lo: int, hi: int) -> tuple[np.ndarray, np.ndarray]:
+        """(positions, deal_date ns) of a size-order range from size_bounds."""
+        return self._by_size[lo:hi], self._date_at_size[lo:hi]
+
+    def count_dates(self, city_norm: str, neigh_norm: str | None,
+                    rooms_range: tuple[float, float], date_from: int, date_to: int) -> int:
+        """Number of rows with date_from <= deal_date < date_to (int64 ns), by binary search."""
+        total = 0
+        for s in self.segments(city_norm, neigh_norm, rooms_range):
+            dates = self._date_sorted[self._offsets[s]:self._offsets[s + 1]]
+            total += int(np.searchsorted(dates, date_to, side='left') - np.searchsorted(dates, date_from, side='left'))
+        return total
@@ -0,0 +1,83 @@
+"""
+Mergeable quantile sketch for positive values (price_per_sqm).
+Values are counted in logarithmic buckets (bucket i covers (γ^(i-1), γ^i],
+γ = (1 + α) / (1 - α)), so every quantile estimate is within relative error α
+of a true sample value, and merging two sketches is adding their bucket counts:
+exact, order independent, and as cheap as the number of occupied buckets.
+"""
+from __future__ import annotations
+import numpy as np
+from config import SKETCH_RELATIVE_ACCURACY
+
+GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+_LOG_GAMMA = np.log(GAMMA)
+
+def bucket_of(values) -> np.ndarray:
+    """Bucket index per value (values must be > 0)."""
+    return np.ceil(np.log(np.asarray(values, dtype=np.float64)) / _LOG_GAMMA).astype(np.int64)
+
+def bucket_value(buckets) -> np.ndarray:
+    """Representative value of a bucket (relative error ≤ α for anything inside it)."""
+    return 2.0 * GAMMA ** np.asarray(buckets, dtype=np.float64) / (GAMMA + 1.0)
+
+class QuantileSketch:
+    """Sorted occupied buckets and their counts; instances are not modified in place."""
+
+    def __init__(self, buckets: np.ndarray | None = None, counts: np.ndarray | None = None):
+        self.buckets = np.zeros(0, dtype=np.int64) if buckets is None else buckets
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else counts
+
+    @classmethod
+    def from_values(cls, values) -> "QuantileSketch":
+        v = np.asarray(values, dtype=np.float64)
+        v = v[np.isfinite(v) & (v > 0)]
+        return cls.from_buckets(bucket_of(v), np.ones(len(v), dtype=np.int64))
+
+    @classmethod
+    def from_buckets(cls, buckets: np.ndarray, counts: np.ndarray) -> "QuantileSketch":
+        """Sketch from (possibly repeated, unsorted) bucket ids with counts."""
+        uniq, inv = np.unique(buckets, return_inverse=True)
+        return cls(uniq.astype(np.int64), np.bincount(inv, weights=counts, minlength=len(uniq)).astype(np.int64))
+
+    @classmethod
+    def merge_all(cls, sketches) -> "QuantileSketch":
+        sketches = [s for s in sketches if s.n]
+        if not sketches:
+            return cls()
+        if len(sketches) == 1:
+            return sketches[0]
+        return cls.from_buckets(np.concatenate([s.buckets for s in sketches]),
+                                np.concatenate([s.counts for s in sketches]))
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        return QuantileSketch.merge_all([self, other])
+
+    @property
+    def n(self) -> int:
+        return int(self.counts.sum())
+
+    def quantile(self, q: float) -> float | None:
+        """Value at quantile q in [0, 1] (rank q * (n - 1), like the lower end of np.percentile)."""
+        n = self.n
+        if n == 0:
+            return None
+        rank = q * (n - 1)
+        i = int(np.searchsorted(np.cumsum(self.counts), rank, side="right"))
+        return float(bucket_value(self.buckets[min(i, len(self.buckets) - 1)]))
+
+    def percentile_rank(self, value: float) -> float | None:
+        """Share of values below `value` (half of its own bucket counted), in percent."""
+        n = self.n
+        if n == 0 or not value > 0:
+            return None
+        b = int(bucket_of(value))
+        below = int(self.counts[self.buckets < b].sum())
+        same = int(self.counts[self.buckets == b].sum())
+        return 100.0 * (below + 0.5 * same) / n
+
+    def summary(self) -> dict:
+        """Median / IQR in the shape of pricing.summarize_recent_fair_ppsqm."""
+        if self.n == 0:
+            return dict(ok=False, fair_ppsqm=None, message="No deals in the area sketch.")
+        q1, q3 = self.quantile(0.25), self.quantile(0.75)
+        return dict(ok=True, fair_ppsqm=self.quantile(0.5), q1=q1, q3=q3, iqr=q3 - q1, n=self.n)
@@ -0,0 +1,194 @@
+"""
+Columnar on-disk snapshot of the prepared transactions table.
+One .npy file per column (memory-mappable) plus meta.json describing the
+columns and the fingerprint (size, mtime, content hash) of the source file.
+Loading a fresh snapshot skips CSV parsing, date/number coercion and the
+city/neighborhood normalization entirely.
+
+attach_snapshot is the shared serving mode: every column stays backed by
+the mapped files (page cache shared by all worker processes). Strings are
+kept as categoricals over mapped codes; high-cardinality text (tx_id,
+address, ...) is kept out of the frame in mapped UTF-8 arrays and only
+decoded for the rows that end up in a response (see TextColumns).
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_FORMAT = 2
+_HASH_CHUNK = 1 << 20
+ROW_ID = "row_id"
+
+def _codes_dtype(n_categories: int):
+    """Same code width pandas picks for a Categorical, so mapped codes are used as-is."""
+    for dt in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dt).max:
+            return dt
+    return np.int64
+
+def _is_high_cardinality(n_unique: int, n_rows: int) -> bool:
+    return n_unique > max(1000, n_rows // 10)
+
+def snapshot_dir_for(source_path: str | Path) -> Path:
+    """Default location: next to the source, e.g. data/transactions.csv.snapshot/"""
+    p = Path(source_path)
+    return p.with_name(p.name + ".snapshot")
+
+def source_fingerprint(source_path: str | Path, with_hash: bool = True) -> dict:
+    st = os.stat(source_path)
+    fp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if with_hash:
+        h = hashlib.sha256()
+        with open(source_path, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+                h.update(chunk)
+        fp["sha256"] = h.hexdigest()
+    return fp
+
+def _read_meta(snap_dir: Path) -> dict | None:
+    try:
+        meta = json.loads((snap_dir / "meta.json").read_text())
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("format") == SNAPSHOT_FORMAT else None
+
+def is_fresh(snap_dir: str | Path, source_path: str | Path, options: dict | None = None) -> bool:
+    """
+    Size and mtime are checked first; the content hash only when both still match.
+    `options` (loader settings that change the stored table) must match too.
+    """
+    meta = _read_meta(Path(snap_dir))
+    if meta is None or meta.get("options") != options:
+        return False
+    stored = meta["source"]
+    quick = source_fingerprint(source_path, with_hash=False)
+    if (stored["size"], stored["mtime_ns"]) != (quick["size"], quick["mtime_ns"]):
+        return False
+    return stored.get("sha256") == source_fingerprint(source_path)["sha256"]
+
+def write_snapshot(df: pd.DataFrame, snap_dir: str | Path, fingerprint: dict,
+                   options: dict | None = None) -> Path:
+    """
+    Write `df` column by column, then swap the directory in atomically
+    so readers never see a half-written snapshot.
+    """
+    snap_dir = Path(snap_dir)
+    tmp = snap_dir.with_name(snap_dir.name + f".tmp{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        s = df[name]
+        col = {"name": str(name), "file": f"c{i}.npy", "dtype": str(s.dtype)}
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            col["kind"] = "categorical"
+            col["categories"] = [str(c) for c in s.cat.categories]
+            values = s.cat.codes.to_numpy().astype(_codes_dtype(len(col["categories"])))
+        elif s.dtype.kind in "biufM":
+            col["kind"] = "array"
+            values = s.to_numpy()
+        else:
+            # strings / objects: dictionary-encode
+            col["kind"] = "strings"
+            codes, uniques = pd.factorize(s)
+            col["categories"] = [str(u) for u in uniques]
+            values = codes.astype(_codes_dtype(len(uniques)))
+            if _is_high_cardinality(len(uniques), len(df)):
+                col["text_file"] = f"c{i}.text.npy"
+                text = s.astype(object).where(s.notna(), "").astype(str).str.encode("utf-8")
+                np.save(tmp / col["text_file"], text.to_numpy().astype(np.bytes_), allow_pickle=False)
+        np.save(tmp / col["file"], np.ascontiguousarray(values), allow_pickle=False)
+        columns.append(col)
+
+    np.save(tmp / f"{ROW_ID}.npy", np.arange(len(df), dtype=np.int64), allow_pickle=False)
+
+    meta = {"format": SNAPSHOT_FORMAT, "n_rows": len(df), "source": fingerprint,
+            "options": options, "columns": columns}
+    (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False))
+
+    old = snap_dir.with_name(snap_dir.name + f".old{os.getpid()}")
+    if snap_dir.exists():
+        os.replace(snap_dir, old)
+    os.replace(tmp, snap_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    return snap_dir
+
+def read_snapshot(snap_dir: str | Path, mmap: bool = True) -> pd.DataFrame:
+    """
+    Load a snapshot. Numeric and date columns are memory-mapped read-only
+    when mmap=True; string columns are rebuilt from their dictionary codes.
+    """
+    snap_dir = Path(snap_dir)
+    meta = _read_meta(snap_dir)
+    if meta is None:
+        raise FileNotFoundError(f"No snapshot at {snap_dir}")
+
+    data = {}
+    for col in meta["columns"]:
+        values = np.load(snap_dir / col["file"], mmap_mode="r" if mmap else None, allow_pickle=False)
+        values = values.view(np.ndarray)  # plain array over the same (mapped) buffer
+        if col["kind"] == "array":
+            data[col["name"]] = values
+        elif col["kind"] == "categorical":
+            data[col["name"]] = pd.Categorical.from_codes(values, categories=col["categories"])
+        else:
+            s = pd.Series(pd.Categorical.from_codes(values, categories=col["categories"])).astype(object)
+            data[col["name"]] = s if col["dtype"] == "object" else s.astype(col["dtype"])
+    return pd.DataFrame(data, copy=False)
+
+def snapshot_source(snap_dir: str | Path) -> dict | None:
+    """Fingerprint of the source the snapshot was built from (None if missing)."""
+    meta = _read_meta(Path(snap_dir))
+    return meta["source"] if meta else None
+
+class TextColumns:
+    """
+    High-cardinality string columns kept outside the frame as mapped UTF-8 arrays.
+    Frames from attach_snapshot carry a row_id column; `records` turns rows into
+    dicts with these columns filled back in, in the original column order.
+    """
+
+    def __init__(self, arrays: dict, order: list):
+        self.arrays = arrays
+        self.order = order
+
+    def records(self, df: pd.DataFrame) -> list[dict]:
+        out = []
+        for rec in df.to_dict(orient="records"):
+            row = rec.pop(ROW_ID)
+            for name, arr in self.arrays.items():
+                value = arr[row]
+                rec[name] = value.decode("utf-8") if value else None
+            out.append({k: rec[k] for k in self.order if k in rec})
+        return out
+
+def attach_snapshot(snap_dir: str | Path) -> tuple[pd.DataFrame, TextColumns]:
+    """
+    Read-only, zero-copy view of a snapshot for serving from many processes.
+    Returns (frame, text_columns); the frame has no high-cardinality text
+    columns and an extra row_id column used by TextColumns.records.
+    """
+    snap_dir = Path(snap_dir)
+    meta = _read_meta(snap_dir)
+    if meta is None:
+        raise FileNotFoundError(f"No snapshot at {snap_dir}")
+
+    def mapped(name):
+        return np.load(snap_dir / name, mmap_mode="r", allow_pickle=False).view(np.ndarray)
+
+    data, text = {}, {}
+    for col in meta["columns"]:
+        if "text_file" in col:
+            text[col["name"]] = mapped(col["text_file"])
+        elif col["kind"] == "array":
+            data[col["name"]] = mapped(col["file"])
+        else:
+            data[col["name"]] = pd.Categorical.from_codes(mapped(col["file"]), categories=col["categories"])
+    data[ROW_ID] = mapped(f"{ROW_ID}.npy")
+    return pd.DataFrame(data, copy=False), TextColumns(text, [c["name"] for c in meta["columns"]])
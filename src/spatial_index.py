@@ -0,0 +1,201 @@
+"""
+Grid index over deal coordinates (lat / lon columns, optional) for
+"k nearest matching deals within R metres" queries.
+Deals are grouped by (city_norm, rooms); inside a group they are sorted by
+the key of their grid cell (fixed global lat/lon grid, SPATIAL_CELL_M per
+side along the meridian), so every cell is a binary search. A query visits
+rings of cells around the listing, nearest first, and stops once the k-th
+distance found is closer than anything an outer ring can hold.
+"""
+from __future__ import annotations
+import json
+import os
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from config import SPATIAL_CELL_M
+from segment_index import NAT_NS, group_codes, to_ns, _date_ns
+
+M_PER_DEG = 111_320.0
+CELL_DEG = SPATIAL_CELL_M / M_PER_DEG
+_ARRAYS = ("pos", "cell", "lat", "lon", "size", "date", "offsets")
+
+def _cell_rc(lat, lon) -> tuple[np.ndarray, np.ndarray]:
+    return (np.floor((np.asarray(lat) + 90.0) / CELL_DEG).astype(np.int64),
+            np.floor((np.asarray(lon) + 180.0) / CELL_DEG).astype(np.int64))
+
+def _cell_key(row, col):
+    return row * (1 << 32) + col
+
+def distance_m(lat0: float, lon0: float, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Equirectangular distance in metres (well under 0.1% error at city scale)."""
+    dx = (lon - lon0) * np.cos(np.radians((lat + lat0) / 2.0)) * M_PER_DEG
+    dy = (lat - lat0) * M_PER_DEG
+    return np.hypot(dx, dy)
+
+class SpatialIndex:
+    """
+    Positions (0..len(df)-1) of rows of `df` that have coordinates.
+    Like SegmentIndex, only valid for the exact frame it was built from.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.n_rows = len(df)
+        self.tag = None
+        lat = df['lat'].to_numpy(dtype=np.float64)
+        lon = df['lon'].to_numpy(dtype=np.float64)
+        valid = ~np.isnan(lat) & ~np.isnan(lon) & df['city_norm'].notna().to_numpy() & df['rooms'].notna().to_numpy()
+        pos = np.flatnonzero(valid)
+        g, keys = group_codes(df.iloc[pos][['city_norm', 'rooms']], ['city_norm', 'rooms'])
+        self._set_arrays(pos, g, lat[pos], lon[pos], df['size_sqm'].to_numpy(dtype=np.float64)[pos],
+                         _date_ns(df)[pos], len(keys))
+        self._init_groups([(str(c), float(r)) for c, r in zip(keys['city_norm'], keys['rooms'])])
+
+    def _set_arrays(self, pos, g, lat, lon, size, date, n_groups) -> None:
+        cell = _cell_key(*_cell_rc(lat, lon))
+        order = np.lexsort((pos, cell, g))
+        self._pos, self._cell = pos[order], cell[order]
+        self._lat, self._lon, self._size, self._date = lat[order], lon[order], size[order], date[order]
+        self._offsets = np.r_[0, np.cumsum(np.bincount(g, minlength=n_groups))].astype(np.int64)
+
+    def _init_groups(self, group_keys: list) -> None:
+        self._group_keys = group_keys
+        self._groups = {key: i for i, key in enumerate(group_keys)}
+        self._city_groups = {}
+        for i, (city, rooms) in enumerate(group_keys):
+            self._city_groups.setdefault(city, []).append((rooms, i))
+
+    def __len__(self) -> int:
+        return len(self._pos)
+
+    def extend(self, rows: pd.DataFrame, start: int) -> "SpatialIndex":
+        """
+        New index for the frame with `rows` appended at position start (== n_rows).
+        The new entries are sorted among themselves and merged into the existing
+        arrays by binary search within their group, as in SegmentIndex.extend,
+        so nothing already indexed is re-sorted. Same arrays as SpatialIndex(full_frame)
+        (up to group numbering); self is unchanged.
+        """
+        if start != self.n_rows:
+            raise ValueError(f"rows must be appended at position {self.n_rows}, got {start}")
+        if 'lat' not in rows.columns or 'lon' not in rows.columns:
+            rows = rows.assign(lat=np.nan, lon=np.nan)
+        new = SpatialIndex(rows)
+        group_keys = list(self._group_keys)
+        for key in new._group_keys:
+            if key not in self._groups:
+                group_keys.append(key)
+        remap = {key: i for i, key in enumerate(group_keys)}
+        n_groups = len(group_keys)
+        g = np.repeat(np.array([remap[k] for k in new._group_keys], dtype=np.int64), np.diff(new._offsets))
+        # new entries ordered by (group, cell, position); their positions are all after the
+        # existing ones, so each goes after the equal cells of its group: the full lexsort order
+        order = np.lexsort((new._pos, new._cell, g))
+        g, cell = g[order], new._cell[order]
+        offsets = np.r_[self._offsets, np.full(n_groups - len(self._group_keys), self._offsets[-1])]
+        at = np.empty(len(order), dtype=np.int64)
+        for grp in np.unique(g):
+            sel = g == grp
+            lo, hi = offsets[grp], offsets[grp + 1]
+            at[sel] = lo + np.searchsorted(self._cell[lo:hi], cell[sel], side="right")
+
+        obj = SpatialIndex.__new__(SpatialIndex)
+        obj.n_rows = start + len(rows)
+        obj.tag = None
+        obj._pos = np.insert(self._pos, at, new._pos[order] + start)
+        obj._cell = np.insert(self._cell, at, cell)
+        for name in ("lat", "lon", "size", "date"):
+            setattr(obj, f"_{name}", np.insert(getattr(self, f"_{name}"), at, getattr(new, f"_{name}")[order]))
+        obj._offsets = (offsets + np.r_[0, np.cumsum(np.bincount(g, minlength=n_groups))]).astype(np.int64)
+        obj._init_groups(group_keys)
+        return obj
+
+    def save(self, path: str | Path, tag: dict | None = None) -> Path:
+        """Persist as .npy arrays + meta.json (temp dir, then rename), see SegmentIndex.save."""
+        path = Path(path)
+        tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for name in _ARRAYS:
+            np.save(tmp / f"{name}.npy", getattr(self, f"_{name}"), allow_pickle=False)
+        meta = {"n_rows": self.n_rows, "tag": tag, "groups": self._group_keys, "cell_m": SPATIAL_CELL_M}
+        (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "SpatialIndex":
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text())
+        if meta.get("cell_m") != SPATIAL_CELL_M:
+            raise ValueError(f"Spatial index in {path} uses {meta.get('cell_m')} m cells, config has {SPATIAL_CELL_M}.")
+        obj = cls.__new__(cls)
+        obj.n_rows = meta["n_rows"]
+        obj.tag = meta.get("tag")
+        for name in _ARRAYS:
+            arr = np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None, allow_pickle=False)
+            setattr(obj, f"_{name}", arr.view(np.ndarray))
+        obj._init_groups([tuple(k) for k in meta["groups"]])
+        return obj
+
+    def nearest(self, city_norm: str, rooms_range: tuple[float, float], lat: float, lon: float, k: int,
+                radius_m: float, size_range: tuple[float, float] | None = None,
+                date_from=None, date_to=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Up to k rows of city_norm with rooms in rooms_range (inclusive) within radius_m
+        of (lat, lon), nearest first (ties by position), optionally with size_sqm in
+        size_range (inclusive), deal_date >= date_from and deal_date < date_to.
+        Returns (positions, distances in metres).
+        """
+        lo_rooms, hi_rooms = rooms_range
+        spans = [(self._offsets[i], self._offsets[i + 1]) for r, i in self._city_groups.get(city_norm, [])
+                 if lo_rooms <= r <= hi_rooms]
+        empty = np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        if not spans or k <= 0:
+            return empty
+        r0, c0 = _cell_rc(lat, lon)
+        # metres per cell step: exact along the meridian, shrunk by cos(lat) along parallels
+        step = SPATIAL_CELL_M * np.cos(np.radians(min(abs(lat) + 1.0, 89.0)))
+        max_ring = int(np.ceil(radius_m / step))
+        d0 = to_ns(date_from) if date_from is not None else None
+        d1 = to_ns(date_to) if date_to is not None else None
+
+        found_pos, found_dist = [], []
+        for ring in range(max_ring + 1):
+            if ring == 0:
+                rr, cc = np.array([0]), np.array([0])
+            else:
+                side = np.arange(-ring, ring + 1)
+                rr = np.r_[np.full(len(side), -ring), np.full(len(side), ring), side[1:-1], side[1:-1]]
+                cc = np.r_[side, side, np.full(len(side) - 2, -ring), np.full(len(side) - 2, ring)]
+            keys = np.sort(_cell_key(r0 + rr, c0 + cc))
+            hits = []
+            for a, b in spans:
+                lo = a + np.searchsorted(self._cell[a:b], keys, side='left')
+                hi = a + np.searchsorted(self._cell[a:b], keys, side='right')
+                hits += [np.arange(l, h) for l, h in zip(lo, hi) if h > l]
+            if hits:
+                idx = np.concatenate(hits)
+                keep = np.ones(len(idx), dtype=bool)
+                if size_range is not None:
+                    keep &= (self._size[idx] >= size_range[0]) & (self._size[idx] <= size_range[1])
+                if d0 is not None:
+                    keep &= self._date[idx] >= d0
+                if d1 is not None:
+                    keep &= (self._date[idx] < d1) & (self._date[idx] != NAT_NS)
+                idx = idx[keep]
+                dist = distance_m(lat, lon, self._lat[idx], self._lon[idx])
+                inside = dist <= radius_m
+                found_pos.append(self._pos[idx[inside]])
+                found_dist.append(dist[inside])
+            # anything in ring+1 or beyond is at least ring * step away
+            n_found = sum(len(p) for p in found_pos)
+            if n_found >= k and np.partition(np.concatenate(found_dist), k - 1)[k - 1] <= ring * step:
+                break
+        if not found_pos:
+            return empty
+        pos, dist = np.concatenate(found_pos), np.concatenate(found_dist)
+        order = np.lexsort((pos, dist))[:k]
+        return pos[order], dist[order]
@@ -0,0 +1,245 @@
+"""
+Transactions in an embedded SQLite database, for datasets that do not fit
+in RAM as a DataFrame. One table in frame order (row_id = position in the
+frame load_transactions_csv would build) with a composite index on
+(city_norm, neigh_norm, rooms, size_sqm, deal_date), so the comps filters,
+date cutoffs, "newest first, at most N" and the per-year activity counts run
+as indexed queries and only the matching rows are ever materialized.
+
+SQLiteStore stands in for the transactions frame: comps.segment_rows,
+comps.recent_comps, comps.longterm_buckets, stats.sales_counts_last5_years,
+context.EvaluationContext, ... accept it wherever they take `df` and push
+their filters down (results equal the in-memory path). Build the database
+once with SQLiteStore.build (scripts/build_sqlite.py); it is opened read-only.
+"""
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from config import CSV_CHUNK_ROWS, SQLITE_CACHE_MB
+from data_loader import clean_transactions, deal_date_format
+from segment_index import NAT_NS, to_ns
+from snapshot import source_fingerprint
+
+TABLE = "transactions"
+ROW_ID = "row_id"
+INDEX_COLUMNS = ("city_norm", "neigh_norm", "rooms", "size_sqm", "deal_date")
+SQL_FORMAT = 1
+
+def sql_path_for(source_path: str | Path) -> Path:
+    """Default location: next to the source, e.g. data/transactions.csv.sqlite"""
+    p = Path(source_path)
+    return p.with_name(p.name + ".sqlite")
+
+def _kind(s: pd.Series) -> str:
+    """Column kind stored in meta: 'M' datetime (int64 ns), 'i' integer, 'f' float, 'O' text."""
+    return {"M": "M", "i": "i", "u": "i", "f": "f"}.get(s.dtype.kind, "O")
+
+_SQL_TYPES = {"M": "INTEGER", "i": "INTEGER", "f": "REAL", "O": "TEXT"}
+
+def _column_values(s: pd.Series, kind: str) -> list:
+    """Python values to bind for one column (NaN / NaT → NULL)."""
+    if kind == "M":
+        ns = pd.to_datetime(s, errors="coerce").to_numpy(dtype="datetime64[ns]").view("i8")
+        return [None if v == NAT_NS else v for v in ns.tolist()]
+    if kind == "O":
+        return [None if v is None or v != v else str(v) for v in s.astype(object).tolist()]
+    return s.astype(object).where(s.notna(), None).tolist()
+
+def _quote(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+class SQLiteStore:
+    """
+    Read-only view of a database written by SQLiteStore.build.
+    Connections are per thread (API handlers run in a thread pool).
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"{self.path} not found; build it with scripts/build_sqlite.py")
+        self._local = threading.local()
+        meta = json.loads(self._conn().execute("SELECT value FROM meta WHERE key = 'meta'").fetchone()[0])
+        if meta.get("format") != SQL_FORMAT:
+            raise ValueError(f"{self.path} has format {meta.get('format')}, expected {SQL_FORMAT}; rebuild it.")
+        self.columns = list(meta["columns"])
+        self.kinds = dict(zip(self.columns, meta["kinds"]))
+        self.n_rows = meta["n_rows"]
+        self.source = meta.get("source")
+        self._select = ", ".join(_quote(c) for c in self.columns)
+        self._count_key = _quote("tx_id" if "tx_id" in self.columns else "deal_date")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA cache_size = {-SQLITE_CACHE_MB * 1024}")
+            conn.execute(f"PRAGMA mmap_size = {SQLITE_CACHE_MB * 1024 * 1024}")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    @classmethod
+    def build(cls, csv_path: str | Path, db_path: str | Path | None = None,
+              chunksize: int = CSV_CHUNK_ROWS) -> "SQLiteStore":
+        """
+        Load csv_path into a new database (temp file, then renamed over db_path),
+        cleaning it `chunksize` rows at a time, so memory stays bounded by one chunk.
+        The index is created after the rows are in, then ANALYZE records its statistics.
+        """
+        csv_path = Path(csv_path)
+        db_path = Path(db_path) if db_path is not None else sql_path_for(csv_path)
+        tmp = db_path.with_name(db_path.name + f".tmp{os.getpid()}")
+        tmp.unlink(missing_ok=True)
+        fingerprint = source_fingerprint(csv_path)
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            columns, kinds, n_rows, date_format = None, None, 0, None
+            with pd.read_csv(csv_path, chunksize=chunksize) as reader:
+                for chunk in reader:
+                    date_format = date_format or deal_date_format(chunk)
+                    df = clean_transactions(chunk, date_format)
+                    del chunk
+                    if columns is None:
+                        columns = list(df.columns)
+                        kinds = [_kind(df[c]) for c in columns]
+                        ddl = ", ".join(f"{_quote(c)} {_SQL_TYPES[k]}" for c, k in zip(columns, kinds))
+                        conn.execute(f"CREATE TABLE {TABLE} ({ROW_ID} INTEGER PRIMARY KEY, {ddl})")
+                    df = df.reindex(columns=columns)
+                    values = [range(n_rows, n_rows + len(df))]
+                    values += [_column_values(df[c], k) for c, k in zip(columns, kinds)]
+                    marks = ", ".join("?" * (len(columns) + 1))
+                    conn.executemany(f"INSERT INTO {TABLE} VALUES ({marks})", zip(*values))
+                    n_rows += len(df)
+                    del df, values
+            if columns is None:
+                raise ValueError(f"{csv_path} has no rows")
+            missing = [c for c in INDEX_COLUMNS if c not in columns]
+            if missing:
+                raise ValueError(f"{csv_path} lacks the indexed columns {missing}")
+            conn.execute(f"CREATE INDEX ix_segment ON {TABLE} ({', '.join(INDEX_COLUMNS)})")
+            conn.execute("ANALYZE")
+            meta = {"format": SQL_FORMAT, "columns": columns, "kinds": kinds, "n_rows": n_rows,
+                    "source": fingerprint}
+            conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            conn.execute("INSERT INTO meta VALUES ('meta', ?)", (json.dumps(meta),))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp, db_path)
+        return cls(db_path)
+
+    def _frame(self, rows: list[tuple], columns: list[str] | None = None) -> pd.DataFrame:
+        """Query rows → frame with the in-memory dtypes (datetime64[ns], float64, int64, object)."""
+        columns = columns or self.columns
+        cols = list(zip(*rows)) if rows else [()] * len(columns)
+        out = {}
+        for c, values in zip(columns, cols):
+            kind = self.kinds[c]
+            if kind == "M":
+                out[c] = np.array([NAT_NS if v is None else v for v in values], dtype=np.int64).view("datetime64[ns]")
+            elif kind == "f":
+                out[c] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+            elif kind == "i" and None not in values:
+                out[c] = np.array(values, dtype=np.int64)
+            else:
+                out[c] = np.array([np.nan if v is None else v for v in values], dtype=object)
+        return pd.DataFrame(out, columns=columns)
+
+    def _where(self, city_norm: str, neigh_norm: str | None, rooms_range: tuple[float, float],
+               size_range: tuple[float, float] | None, date_from, date_to=None) -> tuple[str, list]:
+        sql, args = ["city_norm = ?"], [city_norm]
+        if neigh_norm is not None:
+            sql.append("neigh_norm = ?")
+            args.append(neigh_norm)
+        if rooms_range[0] == rooms_range[1]:  # equality keeps size_sqm in the index seek
+            sql.append("rooms = ?")
+            args.append(float(rooms_range[0]))
+        else:
+            sql.append("rooms BETWEEN ? AND ?")
+            args += [float(rooms_range[0]), float(rooms_range[1])]
+        if size_range is not None:
+            sql.append("size_sqm BETWEEN ? AND ?")
+            args += [float(size_range[0]), float(size_range[1])]
+        if date_from is not None:
+            sql.append("deal_date >= ?")
+            args.append(to_ns(date_from))
+        if date_to is not None:
+            sql.append("deal_date < ?")
+            args.append(to_ns(date_to))
+        return " AND ".join(sql), args
+
+    def has_neighborhood(self, city_norm: str, neigh_norm: str, date_to=None) -> bool:
+        sql, args = f"SELECT 1 FROM {TABLE} WHERE city_norm = ? AND neigh_norm = ?", [city_norm, neigh_norm]
+        if date_to is not None:
+            sql += " AND deal_date < ?"
+            args.append(to_ns(date_to))
+        return self._conn().execute(sql + " LIMIT 1", args).fetchone() is not None
+
+    def rows(self, city_norm: str, neigh_norm: str | None, rooms_range: tuple[float, float],
+             size_range: tuple[float, float] | None = None, date_from=None, date_to=None,
+             newest_first: bool = False, limit: int | None = None) -> pd.DataFrame:
+        """
+        Matching rows as a frame, with the filters of SegmentIndex.lookup
+        (neigh_norm None → the whole city; ranges inclusive; date_from <= deal_date < date_to).
+        Frame order, or newest first (same-day deals in frame order) with newest_first;
+        at most `limit` rows.
+        """
+        where, args = self._where(city_norm, neigh_norm, rooms_range, size_range, date_from, date_to)
+        sql = f"SELECT {self._select} FROM {TABLE} WHERE {where} ORDER BY "
+        sql += f"deal_date DESC, {ROW_ID}" if newest_first else ROW_ID
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        return self._frame(self._conn().execute(sql, args).fetchall())
+
+    def year_counts(self, city_norm: str, neigh_norm: str, rooms: float, date_from,
+                    date_to=None) -> list[tuple[int, int]]:
+        """(year, deals) for one exact segment since date_from (and before date_to), latest year first."""
+        where, args = self._where(city_norm, neigh_norm, (rooms, rooms), None, date_from, date_to)
+        sql = (f"SELECT CAST(strftime('%Y', deal_date / 1000000000, 'unixepoch') AS INTEGER) AS year, "
+               f"COUNT({self._count_key}) FROM {TABLE} WHERE {where} GROUP BY year ORDER BY year DESC")
+        return self._conn().execute(sql, args).fetchall()
+
+    def city_frames(self, columns: list[str], date_from=None):
+        """
+        One frame per city (only `columns`, rows in frame order, deal_date >= date_from),
+        for whole-history tables built a city at a time (AggregateCube.from_frames,
+        GrowthTable.from_frames): memory is bounded by the largest city.
+        """
+        conn = self._conn()
+        cities = [c for (c,) in conn.execute(f"SELECT DISTINCT city_norm FROM {TABLE} WHERE city_norm IS NOT NULL")]
+        select = ", ".join(_quote(c) for c in columns)
+        for city in cities:
+            sql, args = f"SELECT {select} FROM {TABLE} WHERE city_norm = ?", [city]
+            if date_from is not None:
+                sql += " AND deal_date >= ?"
+                args.append(to_ns(date_from))
+            rows = conn.execute(sql + f" ORDER BY {ROW_ID}", args).fetchall()
+            if rows:
+                yield self._frame(rows, columns)
+
+    def places(self) -> pd.DataFrame:
+        """Distinct (city_norm, neigh_norm) with the first row's city / neighborhood and deal count n."""
+        names = [c if c in self.columns else k for c, k in (("city", "city_norm"), ("neighborhood", "neigh_norm"))]
+        sql = (f"SELECT g.city_norm, g.neigh_norm, t.{_quote(names[0])}, t.{_quote(names[1])}, g.n FROM "
+               f"(SELECT city_norm, neigh_norm, MIN({ROW_ID}) AS first, COUNT(*) AS n FROM {TABLE} "
+               f"WHERE city_norm IS NOT NULL AND neigh_norm IS NOT NULL GROUP BY city_norm, neigh_norm) g "
+               f"JOIN {TABLE} t ON t.{ROW_ID} = g.first ORDER BY g.first")
+        rows = self._conn().execute(sql).fetchall()
+        return pd.DataFrame(rows, columns=["city_norm", "neigh_norm", "city", "neighborhood", "n"])
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
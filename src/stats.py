@@ -1,6 +1,9 @@
 from __future__ import annotations
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
+from segment_index import SegmentIndex, before, dates_at, equals_at, on_or_after
+from sql_store import SQLiteStore
 
 def recent_two_years_stats(recent_df: pd.DataFrame) -> dict:
     """
@@ -21,16 +24,15 @@ def recent_two_years_stats(recent_df: pd.DataFrame) -> dict:
     if recent_df is None or len(recent_df) == 0:
         return out
 
-    df = recent_df.copy()
-    df = df.dropna(subset=["price_ils"])
-    if len(df) == 0:
+    prices = recent_df["price_ils"].dropna()
+    if len(prices) == 0:
         return out
 
-    out["n"] = int(len(df))
-    out["avg_price_recent"] = float(df["price_ils"].mean())
-    out["min_price_recent"] = int(df["price_ils"].min())
-    out["max_price_recent"] = int(df["price_ils"].max())
-    out["count_above_avg_recent"] = int((df["price_ils"] > out["avg_price_recent"]).sum())
+    out["n"] = int(len(prices))
+    out["avg_price_recent"] = float(prices.mean())
+    out["min_price_recent"] = int(prices.min())
+    out["max_price_recent"] = int(prices.max())
+    out["count_above_avg_recent"] = int((prices > out["avg_price_recent"]).sum())
     return out
 
 def sales_counts_last5_years(
@@ -39,33 +41,72 @@ def sales_counts_last5_years(
     neighborhood: str,
     rooms: float,
     today: datetime | None = None,
+    index: SegmentIndex | None = None,
+    as_of: datetime | None = None,
 ) -> dict:
     """
     Count how many sales happened in the last 5 years (same city, neighborhood, and rooms).
     Also return per-year counts for a pie/bar chart.
+    With as_of only sales dated before it count (today defaults to as_of).
+    With a SQLiteStore as df_all the counting is one grouped query.
+    """
+    today = today or as_of or datetime.utcnow()
+    if isinstance(df_all, SQLiteStore):
+        counts = df_all.year_counts(city.strip().lower(), neighborhood.strip().lower(), float(rooms),
+                                    date_from=today - timedelta(days=5 * 365), date_to=as_of)
+        return {
+            "total": sum(n for _, n in counts),
+            "per_year": [{"year": int(year), "count": int(n)} for year, n in counts],
+        }
+    pos = None
+    if index is not None:
+        cutoff = today - timedelta(days=5 * 365)
+        pos = index.lookup(city.strip().lower(), neighborhood.strip().lower(),
+                           (float(rooms), float(rooms)), date_from=cutoff, date_to=as_of)
+    elif as_of is not None:
+        pos = np.flatnonzero(before(dates_at(df_all), as_of))
+    return sales_counts_at(df_all, pos, city, neighborhood, rooms, today=today)
+
+def sales_counts_at(
+    rows: pd.DataFrame,
+    pos: np.ndarray | None,
+    city: str,
+    neighborhood: str,
+    rooms: float,
+    today: datetime | None = None,
+) -> dict:
+    """
+    Same as sales_counts_last5_years, over the rows at positions pos (all rows
+    when None) of `rows`; pos may be any superset of the matching rows (e.g. the
+    segment positions already selected for comps).
+    Works on the columns' arrays at pos; no rows are copied.
     """
     today = today or datetime.utcnow()
     cutoff = today - timedelta(days=5 * 365)
 
-    # filter to same area and exact rooms (keeps consistency with comps logic)
-    df = df_all.copy()
-    df = df.dropna(subset=["deal_date"])
-    df = df[
-        (df["city_norm"] == city.strip().lower())
-        & (df["neigh_norm"] == neighborhood.strip().lower())
-        & (df["rooms"] == float(rooms))
-        & (df["deal_date"] >= cutoff)
-    ]
-
-    if df.empty:
+    # filter to same area and exact rooms (keeps consistency with comps logic),
+    # narrowing the positions step by step so each column is gathered only for the survivors
+    same_area = (equals_at(rows["city_norm"], city.strip().lower(), pos)
+                 & equals_at(rows["neigh_norm"], neighborhood.strip().lower(), pos))
+    at = np.flatnonzero(same_area) if pos is None else pos[same_area]
+    at = at[rows["rooms"].to_numpy()[at] == float(rooms)]
+    hit_dates = dates_at(rows, at)
+    recent = on_or_after(hit_dates, cutoff)
+    at, hit_dates = at[recent], hit_dates[recent]
+    if len(at) == 0:
         return {"total": 0, "per_year": []}
 
-    df["year"] = df["deal_date"].dt.year
-    counts = df.groupby("year")["tx_id"].count().reset_index(name="count")
+    # year of each hit: bucket by the year starts (a handful) instead of sorting the hits
+    first, last = hit_dates.min().astype("datetime64[Y]"), hit_dates.max().astype("datetime64[Y]")
+    starts = np.arange(first, last + 1).astype(hit_dates.dtype)
+    year_of = np.searchsorted(starts, hit_dates, side="right") - 1
+    # count(tx_id) when the frame has it (it is out-of-frame in shared mode); hit dates are never NaT
+    counted = rows["tx_id"].iloc[at].notna().to_numpy() if "tx_id" in rows.columns else None
+    seen = np.bincount(year_of, minlength=len(starts)) > 0
+    counts = np.bincount(year_of, weights=counted, minlength=len(starts)).astype(np.int64)
+    years = starts.astype("datetime64[Y]").astype(np.int64) + 1970
     # ensure latest first for pretty output
-    counts = counts.sort_values("year", ascending=False)
-
     return {
-        "total": int(counts["count"].sum()),
-        "per_year": [{"year": int(r.year), "count": int(r["count"])} for _, r in counts.iterrows()],
+        "total": int(counts.sum()),
+        "per_year": [{"year": int(y), "count": int(c)} for y, c in zip(years[seen][::-1], counts[seen][::-1])],
     }